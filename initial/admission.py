@@ -0,0 +1,250 @@
+"""Admission control for the expensive route classes.
+
+Each class (predictions, procedures, bulk) has its own bounded pool of
+in-flight requests, so a spike on one class cannot take every threadpool
+worker from the cheap CRUD routes, which are not limited at all. Per class:
+
+  * a token bucket per client answers 429 with Retry-After once the client's
+    rate is used up. Clients are keyed on their address, or on their
+    ADMISSION_CLIENT_HEADER value when it is one of ADMISSION_API_KEYS (an
+    unchecked header would let a client mint a fresh bucket per request);
+  * a request that finds the pool full waits in the class queue, unless the
+    expected wait (queue length x recent service time / pool size) already
+    exceeds the class latency budget, in which case it gets an immediate 503
+    with Retry-After; a queued request that is still waiting when the budget
+    runs out gets the same 503.
+
+AdmissionMiddleware holds the slot until the last body chunk is sent, so
+streamed exports count against their class for as long as they run.
+
+Limits come from ADMISSION_<CLASS>_{CONCURRENCY,RATE,BURST,BUDGET_MS}.
+"""
+import asyncio
+import math
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from metrics import registry
+
+load_dotenv()
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ADMISSION_CLIENT_HEADER = os.getenv('ADMISSION_CLIENT_HEADER', 'x-api-key')
+ADMISSION_API_KEYS = frozenset(key.strip() for key in os.getenv('ADMISSION_API_KEYS', '').split(',') if key.strip())
+# Idle buckets are dropped once this many clients are tracked
+MAX_BUCKETS = 10000
+# Weight of the newest request in the service time average
+LATENCY_SMOOTHING = 0.2
+
+# name: (path pattern, concurrency, rate per second per client, burst, latency budget in ms)
+DEFAULT_CLASSES: List[Tuple[str, str, int, float, int, int]] = [
+    ('predictions', r'^/(predict/|forecast|backtest/)', 8, 50.0, 100, 500),
+    ('procedures', r'^/procedures/', 4, 20.0, 40, 1000),
+    ('bulk', r'^/(export/|enter_recs|predictions/rollups/)', 2, 1.0, 5, 2000),
+]
+
+rejected_total = registry.counter(
+    'yield_api_admission_rejected_total', 'Requests refused by admission control', ('route_class', 'reason')
+)
+
+
+def _setting(name: str, key: str, default):
+    return type(default)(os.getenv(f"ADMISSION_{name.upper()}_{key}", default))
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst: int, now: float):
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, rate: float, burst: int, now: float) -> float:
+        """Take one token; returns 0 on success, else seconds until a token is available"""
+        self.tokens = min(float(burst), self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate if rate > 0 else math.inf
+
+
+class RouteClass:
+    """Concurrency pool, wait queue and per-client rate limits for one class of routes.
+
+    Only touched from the event loop, so plain counters need no lock.
+    """
+
+    def __init__(self, name: str, pattern: str, concurrency: int, rate: float, burst: int, budget_ms: int):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.budget = budget_ms / 1000
+        self.in_flight = 0
+        self.waiting = 0
+        self.service_time = 0.0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+        self.timed_out = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def expected_wait(self) -> float:
+        """Seconds a request arriving now would queue, from the queue length and recent service times"""
+        if self.in_flight < self.concurrency:
+            return 0.0
+        return (self.waiting + 1) * self.service_time / self.concurrency
+
+    def _bucket(self, client: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                # Forget clients whose bucket has refilled; they are indistinguishable from new ones
+                full = [key for key, old in self._buckets.items()
+                        if old.tokens + (now - old.updated) * self.rate >= self.burst]
+                for key in full:
+                    del self._buckets[key]
+            bucket = self._buckets[client] = TokenBucket(self.burst, now)
+        return bucket
+
+    def rate_limit_wait(self, client: str) -> float:
+        now = time.monotonic()
+        return self._bucket(client, now).take(self.rate, self.burst, now)
+
+    async def acquire(self) -> Optional[float]:
+        """Take a pool slot; returns None when admitted, else the Retry-After seconds for a 503"""
+        expected = self.expected_wait()
+        if expected > self.budget:
+            self.shed += 1
+            return expected
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        self.waiting += 1
+        try:
+            await asyncio.wait((acquire,), timeout=self.budget)
+        finally:
+            self.waiting -= 1
+            if not acquire.done():
+                # Semaphore.acquire hands the permit back if the cancel lands after it was granted
+                acquire.cancel()
+        if acquire.cancelled() or not acquire.done():
+            self.timed_out += 1
+            return max(self.expected_wait(), self.budget)
+        self.in_flight += 1
+        self.admitted += 1
+        return None
+
+    def release(self, elapsed: float):
+        self.in_flight -= 1
+        self._semaphore.release()
+        if self.service_time == 0.0:
+            self.service_time = elapsed
+        else:
+            self.service_time += LATENCY_SMOOTHING * (elapsed - self.service_time)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "service_time_ms": self.service_time * 1000,
+            "expected_wait_ms": self.expected_wait() * 1000,
+            "latency_budget_ms": self.budget * 1000,
+            "rate_per_client": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionController:
+    def __init__(self, classes=DEFAULT_CLASSES, enabled: bool = ADMISSION_ENABLED,
+                 client_header: str = ADMISSION_CLIENT_HEADER, api_keys=ADMISSION_API_KEYS):
+        self.enabled = enabled
+        self.client_header = client_header
+        self.api_keys = frozenset(api_keys)
+        self.classes = [
+            RouteClass(name, pattern,
+                       _setting(name, 'CONCURRENCY', concurrency),
+                       _setting(name, 'RATE', rate),
+                       _setting(name, 'BURST', burst),
+                       _setting(name, 'BUDGET_MS', budget_ms))
+            for name, pattern, concurrency, rate, burst, budget_ms in classes
+        ]
+
+    def route_class(self, path: str) -> Optional[RouteClass]:
+        if not self.enabled:
+            return None
+        for route_class in self.classes:
+            if route_class.pattern.match(path):
+                return route_class
+        return None
+
+    def client_key(self, headers, client) -> str:
+        key = headers.get(self.client_header)
+        if key and key in self.api_keys:
+            return f"key:{key}"
+        return f"addr:{client.host}" if client else "addr:unknown"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "client_header": self.client_header,
+            "api_keys": len(self.api_keys),
+            "classes": {route_class.name: route_class.status() for route_class in self.classes},
+        }
+
+
+def retry_after(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the global controller to every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = admission.route_class(scope['path']) if scope['type'] == 'http' else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        wait = route_class.rate_limit_wait(admission.client_key(request.headers, request.client))
+        if wait:
+            route_class.rate_limited += 1
+            rejected_total.inc(route_class=route_class.name, reason='rate_limited')
+            response = JSONResponse(status_code=429, headers={'Retry-After': retry_after(wait)},
+                                    content={"detail": f"Rate limit for {route_class.name} requests exceeded"})
+            await response(scope, receive, send)
+            return
+        wait = await route_class.acquire()
+        if wait is not None:
+            rejected_total.inc(route_class=route_class.name, reason='overloaded')
+            response = JSONResponse(status_code=503, headers={'Retry-After': retry_after(wait)},
+                                    content={"detail": f"Too many {route_class.name} requests in progress"})
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            # Returns once the whole body, streamed or not, has been sent
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release(time.perf_counter() - start)
+
+
+# Global instance
+admission = AdmissionController()
@@ -0,0 +1,435 @@
+"""Backtests of the active model against the recorded yields.
+
+Usage: python backtest.py [--mode loyo|rolling|deployed] [--workers 4] [--min-train-years 5]
+
+Modes:
+  deployed  score every (area, item, year) with the model as it is (in-sample
+            for the years it was trained on)
+  loyo      leave one year out: refit on every other year, score the held-out year
+  rolling   rolling origin: refit on the years before Y, score Y
+Folds refit an unfitted clone of the deployed estimator, so they measure its
+hyperparameters on this data. Folds run in a process pool that receives the
+encoded feature matrix once per worker; each fold is scored with one predict
+call and the errors are grouped with numpy.
+
+Results are cached on disk under BACKTEST_CACHE_DIR keyed on mode, model
+version and a fingerprint of the data, and in memory keyed on the table
+versions, so GET /backtest/summary answers instantly after the first run.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from model_artifact import ModelArtifact
+from table_versions import table_versions
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+BACKTEST_CACHE_DIR = os.getenv('BACKTEST_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'yield-api-backtests'))
+BACKTEST_WORKERS = int(os.getenv('BACKTEST_WORKERS', str(min(4, os.cpu_count() or 1))))
+MODES = ('loyo', 'rolling', 'deployed')
+# Summaries kept in memory; older (mode, model version, table versions) entries are evicted first
+BACKTEST_CACHE_SIZE = 8
+# Rolling-origin folds start once this many years are available for training
+MIN_TRAIN_YEARS = 5
+# Residual (actual - predicted) percentiles kept for residual-based prediction intervals
+RESIDUAL_PERCENTILES = list(range(1, 100))
+# Out-of-sample modes whose residuals can stand in for prediction uncertainty, preferred first
+RESIDUAL_MODES = ('loyo', 'rolling')
+
+# Tables the backtest data is read from; a version change invalidates the in-memory cache
+BACKTEST_TABLES = ('yield', 'environment', 'areas', 'items')
+
+BACKTEST_QUERY = """
+SELECT
+    y.area_id,
+    y.item_id,
+    y.year,
+    a.area_name,
+    i.item_name,
+    e.average_rai,
+    e.pesticides_tavg,
+    e.temp,
+    y.hg_per_ha_yield
+FROM yield y
+JOIN areas a ON y.area_id = a.area_id
+JOIN items i ON y.item_id = i.item_id
+JOIN environment e ON e.area_id = y.area_id AND e.year = y.year
+ORDER BY y.area_id, y.item_id, y.year
+"""
+
+
+class BacktestData:
+    """Encoded features and actual yields as numpy arrays, one row per (area, item, year)"""
+
+    def __init__(self, area_ids, item_ids, years, X, y, area_names, item_names, skipped):
+        self.area_ids = area_ids
+        self.item_ids = item_ids
+        self.years = years
+        self.X = X
+        self.y = y
+        self.area_names = area_names
+        self.item_names = item_names
+        self.skipped = skipped
+        hashed = hashlib.sha1()
+        for array in (area_ids, item_ids, years, X, y):
+            hashed.update(array.tobytes())
+        self.fingerprint = hashed.hexdigest()[:12]
+
+
+def load_data(engine, artifact: ModelArtifact) -> BacktestData:
+    """Read and encode the backtest rows; rows whose area or item the model cannot encode are skipped"""
+    import numpy as np
+    from batch_scoring import _codes_for
+    with engine.connect() as conn:
+        rows = conn.execute(text(BACKTEST_QUERY)).fetchall()
+        area_codes, item_codes = _codes_for(artifact, conn)
+
+    kept, area_names, item_names = [], {}, {}
+    for area_id, item_id, year, area_name, item_name, rain, pesticides, temp, actual in rows:
+        area_code, item_code = area_codes.get(area_name), item_codes.get(item_name)
+        if area_code is None or item_code is None or actual is None:
+            continue
+        area_names[area_id], item_names[item_id] = area_name, item_name
+        features = {
+            'average_rain_fall_mm_per_year': rain,
+            'pesticides_tonnes': pesticides,
+            'avg_temp': temp,
+            'Item': item_code,
+            'Area': area_code,
+            'Year': year
+        }
+        kept.append((area_id, item_id, year, [features[name] for name in artifact.features], actual))
+
+    ids = np.array([row[:3] for row in kept], dtype='int64').reshape(-1, 3)
+    X = np.array([row[3] for row in kept], dtype='float64').reshape(-1, len(artifact.features))
+    y = np.array([row[4] for row in kept], dtype='float64')
+    return BacktestData(np.ascontiguousarray(ids[:, 0]), np.ascontiguousarray(ids[:, 1]),
+                        np.ascontiguousarray(ids[:, 2]), X, y, area_names, item_names, len(rows) - len(kept))
+
+
+def fold_years(years, mode: str, min_train_years: int = MIN_TRAIN_YEARS) -> List[int]:
+    """Held-out year of each fold"""
+    import numpy as np
+    distinct = np.unique(years).tolist()
+    if mode == 'loyo':
+        return distinct
+    if mode == 'rolling':
+        return distinct[min_train_years:]
+    raise ValueError(f"Mode {mode} has no folds")
+
+
+# Set in each pool worker by _init_worker so the data is sent once per process
+_worker_data: Optional[Tuple[Any, Any, Any, Any]] = None
+
+
+def _init_worker(estimator, X, y, years):
+    global _worker_data
+    # One process per core already; nested tree threads would oversubscribe
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=1)
+    _worker_data = (estimator, X, y, years)
+
+
+def _fold_in_worker(args):
+    mode, year = args
+    return run_fold(*_worker_data, mode, year)
+
+
+def run_fold(estimator, X, y, years, mode: str, year: int):
+    """Refit a clone of estimator without the held-out year and score that year.
+
+    Returns (held-out row indices, predictions).
+    """
+    import numpy as np
+    from sklearn.base import clone
+    train = years != year if mode == 'loyo' else years < year
+    test = np.flatnonzero(years == year)
+    model = clone(estimator)
+    model.fit(X[train], y[train])
+    return test, model.predict(X[test])
+
+
+def error_metrics(actual, predicted, groups=None, n_groups: int = 1) -> Dict[str, Any]:
+    """n, MAE, RMSE, MAPE (%, over non-zero actuals) and bias per group code, as lists"""
+    import numpy as np
+    if groups is None:
+        groups = np.zeros(len(actual), dtype='int64')
+    error = predicted - actual
+    nonzero = actual != 0
+    ape = np.where(nonzero, np.abs(error) / np.where(nonzero, np.abs(actual), 1.0), 0.0)
+
+    def total(weights):
+        return np.bincount(groups, weights=weights, minlength=n_groups)
+
+    n = np.bincount(groups, minlength=n_groups)
+    n_nonzero = total(nonzero.astype('float64'))
+    safe_n = np.maximum(n, 1)
+    return {
+        "n": n.tolist(),
+        "mae": (total(np.abs(error)) / safe_n).tolist(),
+        "rmse": np.sqrt(total(error * error) / safe_n).tolist(),
+        "mape": np.where(n_nonzero > 0, 100 * total(ape) / np.maximum(n_nonzero, 1), np.nan).tolist(),
+        "bias": (total(error) / safe_n).tolist(),
+    }
+
+
+def _breakdown(keys, actual, predicted, names: Dict[int, str] = None) -> List[Dict[str, Any]]:
+    import numpy as np
+    values, groups = np.unique(keys, return_inverse=True)
+    metrics = error_metrics(actual, predicted, groups, len(values))
+    entries = []
+    for index, key in enumerate(values.tolist()):
+        entry = {"key": key}
+        if names is not None:
+            entry["name"] = names.get(key)
+        for metric, column in metrics.items():
+            value = column[index]
+            entry[metric] = None if value != value else value
+        entries.append(entry)
+    return entries
+
+
+def summarize(data: BacktestData, indices, predictions) -> Dict[str, Any]:
+    """Overall, per-year, per-area and per-item error metrics for the scored rows"""
+    actual = data.y[indices]
+    overall = {metric: column[0] for metric, column in error_metrics(actual, predictions).items()}
+    if overall["mape"] != overall["mape"]:
+        overall["mape"] = None
+    return {
+        "overall": overall,
+        "by_year": _breakdown(data.years[indices], actual, predictions),
+        "by_area": _breakdown(data.area_ids[indices], actual, predictions, data.area_names),
+        "by_item": _breakdown(data.item_ids[indices], actual, predictions, data.item_names),
+        "residuals": residual_percentiles(data.item_ids[indices], actual - predictions),
+    }
+
+
+def residual_percentiles(item_ids, residuals) -> Dict[str, Any]:
+    """RESIDUAL_PERCENTILES of actual - predicted, overall and per item"""
+    import numpy as np
+    if len(residuals) == 0:
+        return {"percentiles": RESIDUAL_PERCENTILES, "overall": None, "by_item": {}}
+    by_item = {}
+    for item_id in np.unique(item_ids).tolist():
+        selected = residuals[item_ids == item_id]
+        by_item[str(item_id)] = {"n": int(len(selected)),
+                                 "values": np.percentile(selected, RESIDUAL_PERCENTILES).tolist()}
+    return {
+        "percentiles": RESIDUAL_PERCENTILES,
+        "overall": {"n": int(len(residuals)), "values": np.percentile(residuals, RESIDUAL_PERCENTILES).tolist()},
+        "by_item": by_item,
+    }
+
+
+def run_backtest(data: BacktestData, artifact: ModelArtifact, mode: str, workers: int = 1,
+                 min_train_years: int = MIN_TRAIN_YEARS) -> Dict[str, Any]:
+    import numpy as np
+    if mode not in MODES:
+        raise ValueError(f"Unknown backtest mode {mode}; use {', '.join(MODES)}")
+    start = time.perf_counter()
+    if mode == 'deployed':
+        import pandas as pd
+        indices = np.arange(len(data.y))
+        predictions = np.asarray(artifact.model.predict(pd.DataFrame(data.X, columns=artifact.features)), dtype='float64')
+        folds = 0
+    else:
+        from sklearn.base import clone
+        # Hyperparameters only; pickling the fitted forest to every worker would dwarf the data
+        estimator = clone(artifact.model)
+        years = fold_years(data.years, mode, min_train_years)
+        tasks = [(mode, year) for year in years]
+        if workers > 1:
+            # Runs from a request's background thread; forking a threaded server can copy held locks
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                                     initializer=_init_worker,
+                                     initargs=(estimator, data.X, data.y, data.years)) as pool:
+                results = list(pool.map(_fold_in_worker, tasks))
+        else:
+            results = [run_fold(estimator, data.X, data.y, data.years, mode, year) for year in years]
+        indices = np.concatenate([fold[0] for fold in results]) if results else np.empty(0, dtype='int64')
+        predictions = np.concatenate([fold[1] for fold in results]) if results else np.empty(0)
+        folds = len(years)
+
+    summary = {
+        "mode": mode,
+        "model_version": artifact.version,
+        "data_fingerprint": data.fingerprint,
+        "rows": int(len(data.y)),
+        "skipped": data.skipped,
+        "scored": int(len(indices)),
+        "folds": folds,
+        "workers": workers if mode != 'deployed' else 1,
+        "computed_at": datetime.utcnow().isoformat(),
+    }
+    summary.update(summarize(data, indices, predictions))
+    summary["seconds"] = time.perf_counter() - start
+    logger.info(f"Backtest {mode} of {artifact.version}: {folds} folds, {len(indices)} rows, "
+                f"MAE {summary['overall']['mae']:.1f} in {summary['seconds']:.1f}s")
+    return summary
+
+
+def cache_path(cache_dir: str, mode: str, model_version: str, data_fingerprint: str) -> str:
+    return os.path.join(cache_dir, f"{mode}-{model_version}-{data_fingerprint}.json")
+
+
+def cached_backtest(engine, artifact: ModelArtifact, mode: str, workers: int = BACKTEST_WORKERS,
+                    cache_dir: str = BACKTEST_CACHE_DIR, refresh: bool = False) -> Dict[str, Any]:
+    """Backtest summary from the disk cache, running and storing it on a miss"""
+    data = load_data(engine, artifact)
+    path = cache_path(cache_dir, mode, artifact.version, data.fingerprint)
+    if not refresh and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    summary = run_backtest(data, artifact, mode, workers)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmp_path, path)
+    return summary
+
+
+class Backtester:
+    """Runs backtests in a background thread and keeps finished summaries in memory"""
+
+    def __init__(self, cache_dir: str = BACKTEST_CACHE_DIR, workers: int = BACKTEST_WORKERS,
+                 cache_size: int = BACKTEST_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.cache_size = cache_size
+        self._engine = None
+        self._results: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._running: Dict[Tuple, threading.Thread] = {}
+        self._errors: Dict[Tuple, str] = {}
+        self._stored: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        self._engine = engine
+
+    def _key(self, artifact: ModelArtifact, mode: str) -> Tuple:
+        return (mode, artifact.version, table_versions.current(BACKTEST_TABLES))
+
+    def _run(self, key: Tuple, artifact: ModelArtifact, mode: str, refresh: bool):
+        try:
+            summary = cached_backtest(self._engine, artifact, mode, self.workers, self.cache_dir, refresh)
+            with self._lock:
+                self._results[key] = summary
+                while len(self._results) > self.cache_size:
+                    self._results.popitem(last=False)
+                self._errors.pop(key, None)
+        except Exception as e:
+            logger.error(f"Backtest {mode} of {artifact.version} failed: {e}")
+            with self._lock:
+                self._errors[key] = str(e)
+                # Keep only failures for the current model and data; older ones are retried if asked for again
+                for stale in [other for other in self._errors if other[1:] != key[1:]]:
+                    del self._errors[stale]
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+
+    def summary(self, artifact: ModelArtifact, mode: str, refresh: bool = False) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """("done", summary) when cached, else starts (or joins) a run: ("running"|"failed", detail)"""
+        if self._engine is None:
+            raise RuntimeError("Backtester is not attached to a database")
+        if mode not in MODES:
+            raise ValueError(f"Unknown backtest mode {mode}; use {', '.join(MODES)}")
+        key = self._key(artifact, mode)
+        with self._lock:
+            if not refresh and key in self._results:
+                self._results.move_to_end(key)
+                return 'done', self._results[key]
+            if key in self._running:
+                return 'running', None
+            if not refresh and key in self._errors:
+                return 'failed', {"error": self._errors[key]}
+            thread = threading.Thread(target=self._run, args=(key, artifact, mode, refresh),
+                                      name=f'backtest-{mode}', daemon=True)
+            self._running[key] = thread
+        thread.start()
+        return 'running', None
+
+    def stored_residuals(self, model_version: str) -> Optional[Dict[str, Any]]:
+        """Residual percentiles of a finished out-of-sample backtest of model_version, without running one"""
+        with self._lock:
+            for mode in RESIDUAL_MODES:
+                for (result_mode, version, _), summary in self._results.items():
+                    if result_mode == mode and version == model_version and summary.get("residuals"):
+                        return summary["residuals"]
+            if model_version in self._stored:
+                return self._stored[model_version]
+        for mode in RESIDUAL_MODES:
+            # Cached by an earlier process or the CLI; the newest file for the version wins
+            paths = glob.glob(cache_path(self.cache_dir, mode, model_version, '*'))
+            for path in sorted(paths, key=os.path.getmtime, reverse=True):
+                try:
+                    with open(path) as f:
+                        residuals = json.load(f).get("residuals")
+                except (OSError, ValueError):
+                    continue
+                if residuals:
+                    with self._lock:
+                        self._stored[model_version] = residuals
+                    return residuals
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cached": [{"mode": mode, "model_version": version} for mode, version, _ in self._results],
+                "running": [{"mode": mode, "model_version": version} for mode, version, _ in self._running],
+                "workers": self.workers,
+            }
+
+
+# Global instance
+backtester = Backtester()
+
+
+def main():
+    from db_schema_file import engine
+    from model_artifact import load_artifact
+    from model_registry import active_model_path
+
+    parser = argparse.ArgumentParser(description="Backtest the active model against recorded yields")
+    parser.add_argument('--mode', default='loyo', choices=MODES)
+    parser.add_argument('--model', default=None, help="Artifact to backtest (default: the active model)")
+    parser.add_argument('--workers', type=int, default=BACKTEST_WORKERS, help="Fold processes")
+    parser.add_argument('--min-train-years', type=int, default=MIN_TRAIN_YEARS)
+    parser.add_argument('--cache-dir', default=BACKTEST_CACHE_DIR)
+    parser.add_argument('--refresh', action='store_true', help="Ignore a cached result")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    artifact = load_artifact(args.model or active_model_path())
+    if args.min_train_years != MIN_TRAIN_YEARS:
+        # Non-default fold layouts are not what the API serves, so they are not cached
+        summary = run_backtest(load_data(engine, artifact), artifact, args.mode, args.workers, args.min_train_years)
+    else:
+        summary = cached_backtest(engine, artifact, args.mode, args.workers, args.cache_dir, args.refresh)
+    print(json.dumps({key: summary[key] for key in summary if not key.startswith('by_')}, indent=2))
+    worst = sorted(summary["by_area"], key=lambda entry: -entry["mae"])[:5]
+    for entry in worst:
+        print(f"  {entry['name']}: MAE {entry['mae']:.0f} over {entry['n']} rows")
+
+
+if __name__ == "__main__":
+    main()
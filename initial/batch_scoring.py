@@ -0,0 +1,176 @@
+"""Offline batch scoring of every yield row into the predictions table.
+
+Usage: python batch_scoring.py [--model PATH] [--workers 4] [--chunk-rows 5000]
+
+Each (area, item, year) in `yield` is scored at its recorded environment
+values and stored in `predictions` under the model's version, so the API can
+serve those predictions (and residuals) with one indexed lookup. Rerunning
+for the same version replaces its rows in a single transaction.
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from model_artifact import ModelArtifact, freeze_codes, load_artifact
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 5000
+
+SCORING_QUERY = """
+SELECT
+    y.area_id,
+    y.item_id,
+    y.year,
+    a.area_name,
+    i.item_name,
+    e.average_rai,
+    e.pesticides_tavg,
+    e.temp
+FROM yield y
+JOIN areas a ON y.area_id = a.area_id
+JOIN items i ON y.item_id = i.item_id
+JOIN environment e ON e.area_id = y.area_id AND e.year = y.year
+ORDER BY y.area_id, y.item_id, y.year
+"""
+
+# Set in each pool worker by _init_worker so the model is loaded once per process
+_worker_artifact: Optional[ModelArtifact] = None
+
+
+def _init_worker(model_path: str):
+    global _worker_artifact
+    _worker_artifact = load_artifact(model_path)
+    # One process per core already; nested tree threads would oversubscribe
+    if hasattr(_worker_artifact.model, 'n_jobs'):
+        _worker_artifact.model.n_jobs = 1
+
+
+def _score_in_worker(args):
+    rows, area_codes, item_codes = args
+    return score_chunk(_worker_artifact, rows, area_codes, item_codes)
+
+
+def score_chunk(artifact: ModelArtifact, rows: Sequence[Tuple], area_codes: Dict[str, int],
+                item_codes: Dict[str, int]) -> Tuple[List[Tuple[int, int, int]], List[float]]:
+    """Predict a chunk of SCORING_QUERY rows in one model call.
+
+    Returns the (area_id, item_id, year) keys that could be encoded and their
+    predictions; rows whose area or item the model never saw are skipped.
+    """
+    import pandas as pd
+    keys, columns = [], {name: [] for name in artifact.features}
+    for area_id, item_id, year, area_name, item_name, rain, pesticides, temp in rows:
+        area_code, item_code = area_codes.get(area_name), item_codes.get(item_name)
+        if area_code is None or item_code is None:
+            continue
+        keys.append((area_id, item_id, year))
+        columns['average_rain_fall_mm_per_year'].append(rain)
+        columns['pesticides_tonnes'].append(pesticides)
+        columns['avg_temp'].append(temp)
+        columns['Item'].append(item_code)
+        columns['Area'].append(area_code)
+        columns['Year'].append(year)
+    if not keys:
+        return [], []
+    predictions = artifact.model.predict(pd.DataFrame(columns, columns=artifact.features))
+    return keys, [float(value) for value in predictions]
+
+
+def _codes_for(artifact: ModelArtifact, conn) -> Tuple[Dict[str, int], Dict[str, int]]:
+    if not artifact.is_legacy:
+        return artifact.area_codes, artifact.item_codes
+    # Same fallback /predict/ml uses: refit codes on the current names
+    areas = [row[0] for row in conn.execute(text("SELECT area_name FROM areas"))]
+    items = [row[0] for row in conn.execute(text("SELECT item_name FROM items"))]
+    return freeze_codes(areas), freeze_codes(items)
+
+
+def _chunks(rows: List[Tuple], size: int):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def score_all(engine, model_path: str, workers: int = 1, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Dict[str, Any]:
+    """Score every yield row with the model at model_path and store the results"""
+    from models import Predictions
+
+    start = time.perf_counter()
+    artifact = load_artifact(model_path)
+    load_seconds = time.perf_counter() - start
+    with engine.connect() as conn:
+        rows = conn.execute(text(SCORING_QUERY)).fetchall()
+        area_codes, item_codes = _codes_for(artifact, conn)
+    rows = [tuple(row) for row in rows]
+    read_seconds = time.perf_counter() - start - load_seconds
+
+    keys: List[Tuple[int, int, int]] = []
+    predictions: List[float] = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+            tasks = ((chunk, area_codes, item_codes) for chunk in _chunks(rows, chunk_rows))
+            for chunk_keys, chunk_predictions in pool.map(_score_in_worker, tasks):
+                keys.extend(chunk_keys)
+                predictions.extend(chunk_predictions)
+    else:
+        for chunk in _chunks(rows, chunk_rows):
+            chunk_keys, chunk_predictions = score_chunk(artifact, chunk, area_codes, item_codes)
+            keys.extend(chunk_keys)
+            predictions.extend(chunk_predictions)
+    score_seconds = time.perf_counter() - start - load_seconds - read_seconds
+
+    scored_at = datetime.utcnow()
+    table = Predictions.__table__
+    with engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.model_version == artifact.version))
+        for start_index in range(0, len(keys), chunk_rows):
+            conn.execute(table.insert(), [
+                {"area_id": area_id, "item_id": item_id, "year": year, "model_version": artifact.version,
+                 "predicted_yield": prediction, "scored_at": scored_at}
+                for (area_id, item_id, year), prediction in zip(
+                    keys[start_index:start_index + chunk_rows], predictions[start_index:start_index + chunk_rows]
+                )
+            ])
+    total_seconds = time.perf_counter() - start
+
+    summary = {
+        "model_version": artifact.version,
+        "rows": len(rows),
+        "scored": len(keys),
+        "skipped": len(rows) - len(keys),
+        "workers": workers,
+        "load_seconds": load_seconds,
+        "read_seconds": read_seconds,
+        "score_seconds": score_seconds,
+        "write_seconds": total_seconds - load_seconds - read_seconds - score_seconds,
+        "total_seconds": total_seconds
+    }
+    logger.info(f"Scored {len(keys)} yield rows with {artifact.version} in {total_seconds:.2f}s")
+    return summary
+
+
+def main():
+    from sqlmodel import SQLModel
+    from db_schema_file import engine
+    from model_registry import active_model_path
+    import models  # noqa: F401  (registers the predictions table)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default=None, help="Artifact to score with (default: the active model)")
+    parser.add_argument('--workers', type=int, default=1, help="Scoring processes")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    SQLModel.metadata.create_all(engine)
+    summary = score_all(engine, args.model or active_model_path(), args.workers, args.chunk_rows)
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Local, reproducible benchmark suite for ingestion and the API.
+
+Usage: python benchmarks/api_suite.py [--requests 200] [--output results.json]
+
+Everything runs in-process against a throwaway SQLite database and an
+in-memory mongomock client, so no MySQL or Atlas access is needed. If
+best_model.pkl.gz is missing a tiny forest is trained as a stand-in. Each
+scenario reports p50/p95/p99 latency, throughput and the process peak RSS,
+and the whole run is emitted as JSON for comparison across commits.
+"""
+import argparse
+import os
+import random
+import resource
+import runpy
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from common import INITIAL_DIR, emit, percentile, populate_database, setup_output, use_temp_database
+
+# Must be configured before any module that creates the engine is imported
+WORK_DIR = use_temp_database()
+os.environ['MODELS_DIR'] = os.path.join(WORK_DIR, 'models')
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+# mongomock's bulk_write does not accept current pymongo UpdateOne objects
+os.environ.setdefault('PREDICTION_ROLLUPS', 'false')
+# The suite fires requests back to back from one address; measure the routes, not the rate limits
+os.environ.setdefault('ADMISSION_ENABLED', 'false')
+
+import mongomock  # noqa: E402
+import pymongo  # noqa: E402
+
+# data_process_mongodb builds its own client at import time
+pymongo.MongoClient = mongomock.MongoClient
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def latency_stats(durations, wall_seconds: float = None) -> dict:
+    wall = wall_seconds if wall_seconds is not None else sum(durations)
+    return {
+        "count": len(durations),
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p95_ms": percentile(durations, 95) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+        "throughput_per_s": len(durations) / wall if wall else 0.0,
+        "peak_rss_kb": peak_rss_kb()
+    }
+
+
+def run_scenario(fn, count: int) -> dict:
+    durations = []
+    start = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        fn(i)
+        durations.append(time.perf_counter() - t0)
+    return latency_stats(durations, time.perf_counter() - start)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=INITIAL_DIR, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def ensure_model():
+    """Publish best_model.pkl.gz, or a tiny stand-in, into the benchmark models dir"""
+    from model_artifact import DEFAULT_MODEL_PATH, load_artifact, save_artifact
+    from model_registry import MODELS_DIR, publish
+    if os.path.exists(DEFAULT_MODEL_PATH):
+        artifact = load_artifact(DEFAULT_MODEL_PATH)
+    else:
+        from train_model import load_training_data_from_csv, train
+        artifact = train(load_training_data_from_csv(), n_estimators=5, version='bench-standin')
+    save_artifact(artifact, os.path.join(MODELS_DIR, 'bench.joblib'))
+    publish('bench.joblib')
+    return artifact
+
+
+def bench_enter_data() -> dict:
+    start = time.perf_counter()
+    with setup_output():
+        populate_database()
+    return latency_stats([time.perf_counter() - start])
+
+
+def bench_mongo_loader(runs: int, rows: int) -> dict:
+    """Time data_process_mongodb against mongomock on the first `rows` CSV rows.
+
+    mongomock checks unique indexes by scanning, so loading the full file
+    would measure the mock rather than the loader.
+    """
+    import pandas as pd
+    sample_dir = os.path.join(WORK_DIR, 'mongo')
+    os.makedirs(sample_dir, exist_ok=True)
+    pd.read_csv(os.path.join(INITIAL_DIR, 'yield_df.csv'), nrows=rows).to_csv(
+        os.path.join(sample_dir, 'yield_df.csv'), index=False
+    )
+
+    def load(_):
+        # A fresh mongomock client (and store) per run, as against an empty Atlas db
+        with setup_output():
+            runpy.run_path(os.path.join(INITIAL_DIR, 'data_process_mongodb.py'), run_name='bench')
+
+    os.chdir(sample_dir)
+    try:
+        stats = run_scenario(load, runs)
+    finally:
+        os.chdir(INITIAL_DIR)
+    stats["rows"] = rows
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200, help="Requests per API scenario")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Rows per batch prediction")
+    parser.add_argument('--mongo-runs', type=int, default=3)
+    parser.add_argument('--mongo-rows', type=int, default=2000, help="CSV rows fed to the Mongo loader")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    results = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "started_at": datetime.utcnow().isoformat(),
+        "requests_per_scenario": args.requests,
+        "scenarios": {}
+    }
+    scenarios = results["scenarios"]
+
+    artifact = ensure_model()
+    results["model_version"] = artifact.version
+
+    scenarios["enter_data"] = bench_enter_data()
+    scenarios["mongo_loader"] = bench_mongo_loader(args.mongo_runs, args.mongo_rows)
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import text
+    from db_schema_file import engine
+    import main as api
+    from prediction_logger import prediction_logger
+
+    # Log predictions into mongomock (it does not implement the ismaster probe)
+    prediction_logger.use_client(mongomock.MongoClient())
+    api.model_registry.refresh()
+
+    with engine.connect() as conn:
+        env_rows = conn.execute(text(
+            "SELECT y.area_id, y.item_id, y.year, e.temp, e.average_rai, e.pesticides_tavg "
+            "FROM yield y JOIN environment e ON e.area_id = y.area_id AND e.year = y.year"
+        )).fetchall()
+
+    client = TestClient(api.app)
+
+    def predict_single(i):
+        area_id, item_id, year, temp, rain, pesticides = random.choice(env_rows)
+        response = client.post('/predict/ml', params={
+            "area_id": area_id, "item_id": item_id, "year": year,
+            "temp": temp, "rain": rain, "pesticides": pesticides
+        })
+        response.raise_for_status()
+    scenarios["predict_single"] = run_scenario(predict_single, args.requests)
+
+    from batch_scoring import score_all
+    from model_registry import active_model_path
+    scenarios["batch_scoring"] = score_all(engine, active_model_path())
+
+    def predict_precomputed(i):
+        area_id, item_id, year = random.choice(env_rows)[:3]
+        client.get(f'/predictions/precomputed/{area_id}/{item_id}/{year}').raise_for_status()
+    scenarios["predict_precomputed"] = run_scenario(predict_precomputed, args.requests)
+
+    with engine.connect() as conn:
+        names = conn.execute(text(
+            "SELECT a.area_name, i.item_name, y.year, e.temp, e.average_rai, e.pesticides_tavg "
+            "FROM yield y JOIN environment e ON e.area_id = y.area_id AND e.year = y.year "
+            "JOIN areas a ON a.area_id = y.area_id JOIN items i ON i.item_id = y.item_id"
+        )).fetchall()
+    all_areas = sorted({row[0] for row in names})
+    all_items = sorted({row[1] for row in names})
+    batch_rows = []
+    for area_name, item_name, year, temp, rain, pesticides in random.sample(names, min(args.batch_size, len(names))):
+        encoded_area, encoded_item = artifact.encode(area_name, item_name, all_areas, all_items)
+        batch_rows.append({
+            'average_rain_fall_mm_per_year': rain,
+            'pesticides_tonnes': pesticides,
+            'avg_temp': temp,
+            'Item': encoded_item,
+            'Area': encoded_area,
+            'Year': year
+        })
+    batch_stats = run_scenario(lambda i: artifact.predict(batch_rows), max(args.requests // 20, 5))
+    batch_stats["rows_per_batch"] = len(batch_rows)
+    batch_stats["rows_per_s"] = batch_stats["throughput_per_s"] * len(batch_rows)
+    scenarios["predict_batch"] = batch_stats
+
+    api_rows = [{"area_id": row[0], "item_id": row[1], "year": row[2]}
+                for row in random.sample(env_rows, min(args.batch_size, len(env_rows)))]
+
+    def predict_batch_api(i):
+        client.post('/predict/ml/batch', json={"rows": api_rows}).raise_for_status()
+    api_batch_stats = run_scenario(predict_batch_api, max(args.requests // 20, 5))
+    api_batch_stats["rows_per_batch"] = len(api_rows)
+    api_batch_stats["rows_per_s"] = api_batch_stats["throughput_per_s"] * len(api_rows)
+    scenarios["predict_batch_api"] = api_batch_stats
+
+    def list_yield(i):
+        client.get('/yield').raise_for_status()
+    scenarios["list_yield"] = run_scenario(list_yield, max(args.requests // 10, 5))
+
+    item_ids = sorted({row[1] for row in env_rows})
+    area_ids = sorted({row[0] for row in env_rows})
+    years = sorted({row[2] for row in env_rows})
+    procedure_calls = {
+        "procedure_item_yield_average": lambda i: f"/procedures/item_yield_average/{random.choice(item_ids)}",
+        "procedure_area_environment_stats": lambda i: f"/procedures/area_environment_stats/{random.choice(area_ids)}",
+        "procedure_predict_yield": lambda i: (
+            f"/procedures/predict_yield/{random.choice(area_ids)}/{random.choice(item_ids)}"
+            "?temp=20&rain=1000&pesticides=100"
+        ),
+        "procedure_top_producing_areas": lambda i: (
+            f"/procedures/top_producing_areas/{random.choice(item_ids)}/{random.choice(years)}"
+        ),
+    }
+    for name, make_path in procedure_calls.items():
+        scenarios[name] = run_scenario(lambda i: client.get(make_path(i)).raise_for_status(), args.requests)
+
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
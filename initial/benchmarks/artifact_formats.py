@@ -0,0 +1,60 @@
+"""Compare model artifact size and load time across storage formats.
+
+Usage: python benchmarks/artifact_formats.py [--model best_model.pkl.gz] [--output results.json]
+
+Without --model a small forest is trained from yield_df.csv so the numbers are
+reproducible on a fresh checkout.
+"""
+import argparse
+import os
+import tempfile
+
+from common import emit, summarize, time_call
+
+from model_artifact import load_artifact, save_artifact
+
+
+def candidate_formats():
+    formats = [
+        ("gzip_pickle", "artifact.pkl.gz", None, None),
+        ("joblib_none", "artifact.joblib", 0, None),
+        ("joblib_zlib3", "artifact_zlib.joblib", 3, None),
+        ("joblib_none_mmap", "artifact_mmap.joblib", 0, 'r'),
+    ]
+    try:
+        import lz4  # noqa: F401
+        formats.append(("joblib_lz4", "artifact_lz4.joblib", ('lz4', 3), None))
+    except ImportError:
+        print("lz4 not installed; skipping joblib_lz4")
+    return formats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default=None, help="Existing artifact to re-encode")
+    parser.add_argument('--n-estimators', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.model:
+        artifact = load_artifact(args.model)
+    else:
+        from train_model import load_training_data_from_csv, train
+        artifact = train(load_training_data_from_csv(), n_estimators=args.n_estimators)
+
+    results = {"model_version": artifact.version, "formats": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, filename, compress, mmap_mode in candidate_formats():
+            path = os.path.join(tmp, filename)
+            save_artifact(artifact, path, compress=compress)
+            _, durations = time_call(lambda: load_artifact(path, mmap_mode=mmap_mode), args.repeat)
+            results["formats"][name] = {
+                "size_bytes": os.path.getsize(path),
+                "load": summarize(durations)
+            }
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
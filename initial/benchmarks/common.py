@@ -0,0 +1,84 @@
+"""Shared helpers for the benchmark scripts in this directory.
+
+Scripts are run from anywhere as `python benchmarks/<name>.py`; importing this
+module puts the `initial/` package directory on sys.path and makes it the
+working directory so relative paths like yield_df.csv resolve.
+"""
+import atexit
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+INITIAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if INITIAL_DIR not in sys.path:
+    sys.path.insert(0, INITIAL_DIR)
+os.chdir(INITIAL_DIR)
+
+
+def time_call(fn, repeat: int = 5):
+    """Run fn `repeat` times and return (last result, list of durations in seconds)"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return result, durations
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(durations) -> dict:
+    """Latency summary in milliseconds"""
+    return {
+        "runs": len(durations),
+        "median_ms": statistics.median(durations) * 1000 if durations else 0.0,
+        "min_ms": min(durations) * 1000 if durations else 0.0
+    }
+
+
+def emit(results, output: str = None):
+    """Print results as JSON and optionally write them to a file"""
+    text = json.dumps(results, indent=2, default=str)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+
+
+def setup_output():
+    """Send what setup code prints (ingestion progress, loader counts) to stderr so stdout stays pure JSON"""
+    return contextlib.redirect_stdout(sys.stderr)
+
+
+def use_temp_database(prefix: str = 'yield-bench-') -> str:
+    """Point DATABASE_URL at a fresh SQLite file in a temp dir removed at exit.
+
+    Must be called before anything imports db_schema_file. Returns the temp dir.
+    """
+    work_dir = tempfile.mkdtemp(prefix=prefix)
+    atexit.register(shutil.rmtree, work_dir, True)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    return work_dir
+
+
+def populate_database():
+    """Create the tables and load yield_df.csv through enter_data"""
+    from sqlmodel import SQLModel
+    from db_schema_file import engine
+    from data_proces_file import enter_data
+
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    enter_data()
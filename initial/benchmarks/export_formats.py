@@ -0,0 +1,86 @@
+"""Compare pulling the joined dataset as JSON versus the Arrow/Parquet export.
+
+Usage: python benchmarks/export_formats.py [--repeat 5] [--output results.json]
+
+The JSON path is what clients did before /export: fetch /yield, /environment,
+/areas and /items (gzip-encoded) and join them with pandas. The export paths
+fetch /export/dataset.arrow and /export/dataset.parquet and parse them with
+pyarrow. Reports bytes on the wire, request time and client parse time.
+"""
+import argparse
+import io
+import json
+import statistics
+import time
+
+from common import emit, populate_database, setup_output, use_temp_database
+
+use_temp_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    with setup_output():
+        populate_database()
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from fastapi.testclient import TestClient
+    import main as api
+
+    client = TestClient(api.app)
+
+    def fetch(path):
+        # Raw (still compressed) body size is what crosses the network
+        response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+        response.raise_for_status()
+        wire = int(response.headers.get('content-length', len(response.content)))
+        return response.content, wire
+
+    def json_path():
+        start = time.perf_counter()
+        bodies = {name: fetch(f'/{name}') for name in ('yield', 'environment', 'areas', 'items')}
+        fetched = time.perf_counter()
+        frames = {name: pd.DataFrame(json.loads(body)) for name, (body, _) in bodies.items()}
+        joined = (
+            frames['yield']
+            .merge(frames['environment'], on=['area_id', 'year'])
+            .merge(frames['areas'], on='area_id')
+            .merge(frames['items'], on='item_id')
+        )
+        return len(joined), sum(wire for _, wire in bodies.values()), fetched - start, time.perf_counter() - fetched
+
+    def export_path(fmt, reader):
+        def run():
+            start = time.perf_counter()
+            body, wire = fetch(f'/export/dataset.{fmt}')
+            fetched = time.perf_counter()
+            table = reader(body)
+            return table.num_rows, wire, fetched - start, time.perf_counter() - fetched
+        return run
+
+    variants = {
+        "json_join": json_path,
+        "arrow": export_path('arrow', lambda body: pa.ipc.open_stream(body).read_all()),
+        "parquet": export_path('parquet', lambda body: pq.read_table(io.BytesIO(body))),
+    }
+
+    results = {}
+    for name, fn in variants.items():
+        runs = [fn() for _ in range(args.repeat)]
+        results[name] = {
+            "rows": runs[-1][0],
+            "wire_bytes": runs[-1][1],
+            "request_ms": statistics.median(run[2] for run in runs) * 1000,
+            "parse_ms": statistics.median(run[3] for run in runs) * 1000,
+        }
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
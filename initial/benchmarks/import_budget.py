@@ -0,0 +1,81 @@
+"""Check that importing the API module stays fast.
+
+Usage: python benchmarks/import_budget.py [--budget-ms 800] [--runs 3]
+
+Imports `main` in fresh interpreters with `-X importtime` and exits non-zero
+if the best cumulative import time exceeds the budget, or if any module that
+should only load lazily (pandas, scikit-learn, pycountry, pymongo, ...) is
+pulled in at import time. Run it in CI to catch startup regressions.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from common import INITIAL_DIR, emit
+
+DEFAULT_BUDGET_MS = float(os.getenv('IMPORT_BUDGET_MS', '800'))
+
+# Heavy modules the API must not import until a request or startup hook needs them
+LAZY_MODULES = ['pandas', 'numpy', 'sklearn', 'scipy', 'joblib', 'pycountry', 'pymongo']
+
+
+def profile_import(module: str):
+    """Return (cumulative microseconds for `module`, set of imported top-level packages)"""
+    env = dict(os.environ)
+    # The engine is created at import; SQLite in memory never opens a connection
+    env.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=INITIAL_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    total_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        imported.add(name.split('.')[0])
+        if name == module:
+            total_us = int(cumulative)
+    return total_us, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=3, help="Best of N runs, to ride out cold caches")
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    timings = []
+    imported = set()
+    for _ in range(args.runs):
+        total_us, imported = profile_import(args.module)
+        timings.append(total_us / 1000)
+
+    best_ms = min(timings)
+    eager = sorted(set(LAZY_MODULES) & imported)
+    results = {
+        "module": args.module,
+        "import_ms": timings,
+        "best_ms": best_ms,
+        "budget_ms": args.budget_ms,
+        "eager_heavy_modules": eager,
+        "passed": best_ms <= args.budget_ms and not eager
+    }
+    emit(results, args.output)
+
+    if eager:
+        print(f"FAIL: {', '.join(eager)} imported eagerly by {args.module}", file=sys.stderr)
+    if best_ms > args.budget_ms:
+        print(f"FAIL: import {args.module} took {best_ms:.0f} ms (budget {args.budget_ms:.0f} ms)", file=sys.stderr)
+    sys.exit(0 if results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
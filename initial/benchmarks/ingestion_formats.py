@@ -0,0 +1,57 @@
+"""Compare reading an ingestion source from CSV, Parquet and Arrow IPC.
+
+Usage: python benchmarks/ingestion_formats.py [--scale 100] [--repeat 3] [--output results.json]
+
+yield_df.csv is repeated `--scale` times (28k rows each) to approximate the
+multi-million-row FAO dumps, converted once with ingestion_sources.convert_csv,
+and then read back with read_source. Reports file size, conversion time and
+read time per format.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from common import emit, summarize, time_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=100, help="Copies of yield_df.csv to concatenate")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    from ingestion_sources import convert_csv, read_source
+
+    work_dir = tempfile.mkdtemp(prefix='ingest-bench-')
+    try:
+        csv_path = os.path.join(work_dir, 'yield_big.csv')
+        with open('yield_df.csv') as f:
+            header, *lines = f.readlines()
+        with open(csv_path, 'w') as f:
+            f.write(header)
+            for _ in range(args.scale):
+                f.writelines(lines)
+
+        results = {"rows": len(lines) * args.scale, "formats": {}}
+        for name, path in (('csv', csv_path),
+                           ('parquet', os.path.join(work_dir, 'yield_big.parquet')),
+                           ('arrow', os.path.join(work_dir, 'yield_big.arrow'))):
+            entry = {}
+            if name != 'csv':
+                _, convert = time_call(lambda: convert_csv(csv_path, path), repeat=1)
+                entry["convert_ms"] = convert[0] * 1000
+            data, durations = time_call(lambda: read_source(path), repeat=args.repeat)
+            entry["bytes"] = os.path.getsize(path)
+            entry["read"] = summarize(durations)
+            entry["rows_read"] = len(data)
+            results["formats"][name] = entry
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
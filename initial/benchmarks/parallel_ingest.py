@@ -0,0 +1,96 @@
+"""Ingestion throughput of enter_data versus parallel_ingest at several worker counts.
+
+Usage: python benchmarks/parallel_ingest.py [--workers 1,2,4,8] [--latency-ms 2] [--output results.json]
+       python benchmarks/parallel_ingest.py --database-url mysql+pymysql://... --i-know-this-drops-tables
+
+Every round starts from empty tables. By default each round gets a fresh
+SQLite file, and every statement sleeps --latency-ms first to stand in for
+the round trip to a networked database; that is the latency parallel
+connections overlap. SQLite still admits one writer at a time, so against
+MySQL (--database-url, whose tables are dropped and recreated every round)
+the scaling is better than this stand-in shows.
+"""
+import argparse
+import os
+import time
+
+from common import emit, setup_output, use_temp_database
+
+work_dir = use_temp_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', default='1,2,4,8', help="Comma separated worker counts")
+    parser.add_argument('--chunk-rows', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="Simulated round trip per statement (SQLite only)")
+    parser.add_argument('--database-url', default=None, help="Benchmark against this database instead")
+    parser.add_argument('--i-know-this-drops-tables', action='store_true')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    if args.database_url:
+        if not args.i_know_this_drops_tables:
+            raise SystemExit("--database-url drops and recreates the yield tables; add --i-know-this-drops-tables")
+        # enter_data writes through the global engine
+        os.environ['DATABASE_URL'] = args.database_url
+
+    from sqlalchemy import event, text
+    from sqlmodel import SQLModel
+    import models  # noqa: F401
+    import db_schema_file
+    from data_proces_file import enter_data, load_data
+    from parallel_ingest import ingest_parallel
+
+    data = load_data()
+
+    def reset(engine):
+        if args.database_url:
+            with engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS ingest_checkpoints"))
+            SQLModel.metadata.drop_all(engine)
+        elif args.latency_ms:
+            @event.listens_for(engine, 'before_cursor_execute')
+            def _round_trip(conn, cursor, statement, parameters, context, executemany):
+                time.sleep(args.latency_ms / 1000)
+        SQLModel.metadata.create_all(engine)
+        return engine
+
+    def fresh_engine(name):
+        if args.database_url:
+            return reset(db_schema_file.make_engine(args.database_url))
+        return reset(db_schema_file.make_engine(f"sqlite:///{os.path.join(work_dir, name + '.db')}"))
+
+    results = {
+        "database": "url" if args.database_url else f"sqlite + {args.latency_ms} ms per statement",
+        "source_rows": len(data),
+        "chunk_rows": args.chunk_rows,
+        "runs": {}
+    }
+    engine = reset(db_schema_file.engine)
+    start = time.perf_counter()
+    with setup_output():
+        enter_data(data)
+    seconds = time.perf_counter() - start
+    with engine.connect() as conn:
+        written = sum(conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() for table in ('environment', 'yield'))
+    results["enter_data"] = {"seconds": seconds, "rows_per_second": written / seconds}
+
+    for workers in (int(value) for value in args.workers.split(',')):
+        engine = fresh_engine(f"parallel-{workers}")
+        with setup_output():
+            report = ingest_parallel(data, engine=engine, workers=workers, chunk_rows=args.chunk_rows)
+        results["runs"][workers] = {
+            "seconds": report["seconds"],
+            "rows_per_second": report["rows_per_second"],
+            "consistent": report["consistency"]["consistent"],
+            "per_worker_rows_per_second": [worker["rows_per_second"] for worker in report["per_worker"].values()],
+        }
+        engine.dispose()
+    base = results["enter_data"]["rows_per_second"]
+    for run in results["runs"].values():
+        run["speedup_vs_enter_data"] = run["rows_per_second"] / base if base else 0.0
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Query plans and latency of the /procedures/* queries before and after the index migrations.
+
+Usage: python benchmarks/query_indexes.py [--repeat 50] [--output results.json]
+
+Loads yield_df.csv into a temporary SQLite database, then for each procedure
+query records its EXPLAIN QUERY PLAN and timing on the bare tables (primary
+keys only), applies migrations.py and measures again. Against MySQL the
+stored procedures run the same statements, so the plan change carries over.
+"""
+import argparse
+
+from common import emit, populate_database, setup_output, summarize, time_call, use_temp_database
+
+use_temp_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    with setup_output():
+        populate_database()
+
+    from sqlalchemy import text
+    from db_schema_file import engine
+    from database_procedures import PROCEDURE_QUERIES
+    from migrations import explain_procedures, migrate, sample_parameters
+
+    params = sample_parameters(engine)
+
+    def measure():
+        plans = explain_procedures(engine, params)
+        out = {}
+        with engine.connect() as conn:
+            for name, query in PROCEDURE_QUERIES.items():
+                statement = text(query)
+                _, durations = time_call(lambda: conn.execute(statement, params[name]).fetchall(), args.repeat)
+                out[name] = {"plan": [step.get('detail', step) for step in plans[name]], **summarize(durations)}
+        return out
+
+    results = {"parameters": params, "before": measure()}
+    results["migrations_applied"] = migrate(engine)
+    results["after"] = measure()
+    results["speedup"] = {
+        name: results["before"][name]["median_ms"] / max(results["after"][name]["median_ms"], 1e-9)
+        for name in PROCEDURE_QUERIES
+    }
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
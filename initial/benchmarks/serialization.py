@@ -0,0 +1,99 @@
+"""Compare the default FastAPI serialization path with serialization.py.
+
+Usage: python benchmarks/serialization.py [--repeat 10] [--output results.json]
+
+Loads yield_df.csv into a temporary SQLite database and serializes the full
+yield table (and a 1000-document prediction history) through:
+  default     ORM objects -> jsonable_encoder -> json.dumps (what the routes used to do)
+  fast        cursor rows as dicts -> serialization.dumps
+  fast_gzip   fast + gzip, as sent to clients with Accept-Encoding: gzip
+  fast_br     fast + brotli (only if the brotli package is installed)
+Each variant reports wall and CPU time per request, payload bytes and bytes/s.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+
+from common import emit, populate_database, setup_output, use_temp_database
+
+use_temp_database()
+
+
+def measure(fn, repeat: int) -> dict:
+    walls, cpus = [], []
+    body = b''
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        body = fn()
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+    wall_ms = statistics.median(walls) * 1000
+    return {
+        "wall_ms": wall_ms,
+        "cpu_ms": statistics.median(cpus) * 1000,
+        "bytes": len(body),
+        "bytes_per_s": len(body) / (wall_ms / 1000) if wall_ms else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    with setup_output():
+        populate_database()
+
+    from fastapi.encoders import jsonable_encoder
+    from sqlmodel import Session
+    from sqlmodel_basecrud import BaseRepository
+    from db_schema_file import engine
+    from models import Yield
+    import serialization
+
+    def default_yield():
+        with Session(engine) as session:
+            rows = BaseRepository(db=session, model=Yield).get_all()
+            return json.dumps(jsonable_encoder(rows)).encode('utf-8')
+
+    def fast_yield():
+        with Session(engine) as session:
+            return serialization.dumps(serialization.fetch_rows(session, Yield))
+
+    history = [
+        {
+            "area_id": i % 100, "item_id": i % 10, "area_name": "Albania", "item_name": "Maize",
+            "year": 1990 + i % 20,
+            "input_data": {"temperature": 16.4, "rainfall": 1485.0, "pesticides": 121.0},
+            "predicted_yield_hg_per_ha": 36613.0 + i, "model_used": "rf-bench",
+            "timestamp": datetime(2026, 1, 1, 12, 0, i % 60), "prediction_type": "rf-bench"
+        }
+        for i in range(1000)
+    ]
+
+    variants = {
+        "default": (default_yield, lambda: json.dumps(jsonable_encoder(history)).encode('utf-8')),
+        "fast": (fast_yield, lambda: serialization.dumps(history)),
+        "fast_gzip": (
+            lambda: serialization.compress(fast_yield(), 'gzip'),
+            lambda: serialization.compress(serialization.dumps(history), 'gzip')
+        ),
+    }
+    if serialization.brotli is not None:
+        variants["fast_br"] = (
+            lambda: serialization.compress(fast_yield(), 'br'),
+            lambda: serialization.compress(serialization.dumps(history), 'br')
+        )
+
+    results = {"encoder": "orjson" if serialization.orjson else "json", "yield_table": {}, "history_1000": {}}
+    for name, (yield_fn, history_fn) in variants.items():
+        results["yield_table"][name] = measure(yield_fn, args.repeat)
+        results["history_1000"][name] = measure(history_fn, args.repeat)
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Per-row latency and memory of sklearn predict vs the compiled tree engine.
+
+Usage: python benchmarks/tree_engine.py [--model best_model.pkl.gz] [--rows 1,10,100,1000] [--output results.json]
+
+Rows are the encoded training data, so every path through the trees is
+realistic. `sklearn` is the model's predict on a DataFrame (as served before
+the engine), `numpy` / `numpy32` the compiled float64 / float32 variants fed
+the array ModelArtifact.build_input produces. Each variant is checked for
+equality against sklearn on the full dataset and on threshold edge cases.
+"""
+import argparse
+import pickle
+import warnings
+
+from common import emit, summarize, time_call
+
+from model_artifact import load_artifact
+from tree_engine import compile_model, verify
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default=None, help="Artifact to compile (default: train a small forest)")
+    parser.add_argument('--n-estimators', type=int, default=50)
+    parser.add_argument('--rows', default='1,10,100,1000', help="Comma separated batch sizes")
+    parser.add_argument('--repeat', type=int, default=200, help="Calls per single-row measurement")
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    from train_model import encode_training_data, load_training_data_from_csv
+    data = load_training_data_from_csv()
+    if args.model:
+        artifact = load_artifact(args.model)
+    else:
+        from train_model import train
+        artifact = train(data, n_estimators=args.n_estimators)
+    frame = encode_training_data(data, artifact.area_codes, artifact.item_codes)
+    X = frame.to_numpy()
+
+    model = artifact.model
+    results = {
+        "model_version": artifact.version,
+        "estimator": type(model).__name__,
+        "sklearn_pickle_bytes": len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)),
+        "variants": {}
+    }
+    compiled = {name: compile_model(model, dtype) for name, dtype in (('numpy', 'float64'), ('numpy32', 'float32'))}
+    for name, engine in compiled.items():
+        if engine is None:
+            raise SystemExit(f"{type(model).__name__} is not supported by the tree engine")
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            results["variants"][name] = {
+                "nodes": engine.n_nodes,
+                "max_depth": engine.max_depth,
+                "array_bytes": engine.nbytes,
+                "verify_dataset": verify(engine, model, X),
+                "verify_edges": verify(engine, model),
+                "latency": {}
+            }
+    results["variants"]["sklearn"] = {"latency": {}}
+
+    for rows in (int(value) for value in args.rows.split(',')):
+        repeat = max(3, args.repeat // rows)
+        batch_frame = frame.iloc[:rows]
+        batch_input = compiled['numpy'].as_input(X[:rows])
+        _, durations = time_call(lambda: model.predict(batch_frame), repeat)
+        results["variants"]["sklearn"]["latency"][rows] = summarize(durations)
+        for name, engine in compiled.items():
+            _, durations = time_call(lambda: engine.predict(batch_input), repeat)
+            results["variants"][name]["latency"][rows] = summarize(durations)
+    emit(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,26 @@
-import pandas as pd
 from sqlmodel import Session, select
 from db_schema_file import engine 
-from models import Items, Areas, Environment, Yield  , countries
+from table_versions import table_versions
+from models import Items, Areas, Environment, Yield  , get_countries
+from ingestion_sources import DEFAULT_SOURCE, read_source
 
-data = pd.read_csv('yield_df.csv')
+ENVIRON_COLUMNS = ['average_rain_fall_mm_per_year', 'pesticides_tonnes', 'avg_temp']
 
-data['Item'] = data['Item'].str.strip().str.title()
-data['Area'] = data['Area'].str.strip()
+# The source is read when data is entered, not at import, so importing this
+# module (e.g. from the API process) stays cheap. CSV, Parquet or Arrow IPC.
+def load_data(path=DEFAULT_SOURCE):
+    data = read_source(path)
 
-data = data.astype({
-    'Year': 'int',
-    'average_rain_fall_mm_per_year': 'float',
-    'pesticides_tonnes': 'float',
-    'avg_temp': 'float',
-    'hg/ha_yield': 'float'
-})
+    data['Item'] = data['Item'].str.strip().str.title()
+    data['Area'] = data['Area'].str.strip()
 
-Items_dataset = data['Item']
-Areas_dataset = data['Area']
-Environ_dataset = data[['average_rain_fall_mm_per_year', 'pesticides_tonnes', 'avg_temp']]
-Yield_dataset = data['hg/ha_yield']
+    return data.astype({
+        'Year': 'int',
+        'average_rain_fall_mm_per_year': 'float',
+        'pesticides_tonnes': 'float',
+        'avg_temp': 'float',
+        'hg/ha_yield': 'float'
+    })
 
 # def validate_item():
 #     crops = [i.value.lower() for i in Crops] 
@@ -27,32 +28,36 @@ Yield_dataset = data['hg/ha_yield']
 #         invalid_items = Items_dataset[~Items_dataset.str.lower().isin(crops)].unique()
 #         raise ValueError(f"items invalid: {invalid_items}")
 
-def validate_area():
+def validate_area(data):
+    Areas_dataset = data['Area']
+    countries = list(get_countries())
     if not Areas_dataset.isin(countries).all():
         raise ValueError(f"areas invalid: {Areas_dataset[~Areas_dataset.isin(countries)].unique()}")
 
-def validate_years():
+def validate_years(data):
     if not data['Year'].between(1980, 2025).all():
         raise ValueError(f"years invalid: {data['Year'][~data['Year'].between(1980, 2025)].unique()}")
 
-def validate_environ():
+def validate_environ(data):
+    Environ_dataset = data[ENVIRON_COLUMNS]
     if Environ_dataset.isna().any().any():
         raise ValueError("missing: Environ_dataset")
     if not (Environ_dataset >= 0).all().all():
         raise ValueError("Negative: Environ_dataset")
 
-def validate_yield():
+def validate_yield(data):
+    Yield_dataset = data['hg/ha_yield']
     if Yield_dataset.isna().any():
         raise ValueError("Missing : Yield_dataset")
     if not (Yield_dataset >= 0).all():
         raise ValueError("Negative : Yield_dataset")
 
-def environ_dup():
-    area_year = Environ_dataset[['Area', 'Year']].drop_duplicates()
-    if len(area_year) != len(Environ_dataset):
+def environ_dup(env_data):
+    area_year = env_data[['Area', 'Year']].drop_duplicates()
+    if len(area_year) != len(env_data):
         raise ValueError("Duplicate (Area, Year) in aggregated ")
 
-def yield_dup():
+def yield_dup(data):
     dup_mask = data.duplicated(subset=['Area', 'Item', 'Year'], keep=False)
     if dup_mask.any():
         duplicates = data[dup_mask].sort_values(['Area', 'Item', 'Year'])
@@ -145,35 +150,40 @@ def is_data_inserted(session: Session) -> bool:
 #             print(f"Insertion failed {step}: {e}")
 #             raise
 
-def enter_data():
+def prepare_data(data):
+    """Deduplicate and validate a loaded dataset; returns (yield rows, per (Area, Year) environment means)"""
+    data = data.drop_duplicates(subset=['Area', 'Item', 'Year'], keep='first')
+    env_data = data.groupby(['Area', 'Year']).agg({
+        'average_rain_fall_mm_per_year': 'mean',
+        'pesticides_tonnes': 'mean',
+        'avg_temp': 'mean'
+    }).reset_index()
+
+    print("Validating data...")
+    # validate_item() 
+    validate_area(data)
+    validate_years(data)
+    validate_environ(data)
+    validate_yield(data)
+    
+    # Check for duplicates 
+    if env_data[['Area', 'Year']].duplicated().any():
+        raise ValueError("Duplicate (Area, Year) in aggregated env_data")
+    
+    # Check yield duplicates Area  Item  Year
+    yield_dup(data)
+    return data, env_data
+
+def enter_data(data=None, source=DEFAULT_SOURCE):
+    if data is None:
+        data = load_data(source)
     with Session(engine) as session:
         try:
 
-            global data  
-            data = data.drop_duplicates(subset=['Area', 'Item', 'Year'], keep='first')
             if is_data_inserted(session):
                 print("Data already inserted")
                 return
-
-            env_data = data.groupby(['Area', 'Year']).agg({
-                'average_rain_fall_mm_per_year': 'mean',
-                'pesticides_tonnes': 'mean',
-                'avg_temp': 'mean'
-            }).reset_index()
-
-            print("Validating data...")
-            # validate_item() 
-            validate_area()  
-            validate_years()  
-            validate_environ()  
-            validate_yield() 
-            
-            # Check for duplicates 
-            if env_data[['Area', 'Year']].duplicated().any():
-                raise ValueError("Duplicate (Area, Year) in aggregated env_data")
-            
-            # Check yield duplicates Area  Item  Year
-            yield_dup()  
+            data, env_data = prepare_data(data)
 
             item_id_map = {}
             for item in data['Item'].unique():
@@ -213,12 +223,16 @@ def enter_data():
                 yield_count += 1
 
             session.commit()
+            table_versions.bump('items', 'areas', 'environment', 'yield')
 
         except Exception as e:
             session.rollback()
 
 if __name__ == "__main__":
+    import sys
     try:
-        enter_data()
+        # Bump the shared table versions so running API workers drop their ETags
+        table_versions.attach(engine)
+        enter_data(source=sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOURCE)
     except Exception as e:
         print(f"Error: {e}")
\ No newline at end of file
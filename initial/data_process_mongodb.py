@@ -3,6 +3,7 @@ import os
 import pandas as pd
 from pymongo import MongoClient
 from pymongo.errors import DuplicateKeyError
+from ingestion_sources import DEFAULT_SOURCE, read_source
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,8 +17,8 @@ try:
     db.environment.create_index([("area_id", 1), ("year", 1)], unique=True)
     db.yields.create_index([("area_id", 1), ("item_id", 1), ("year", 1)], unique=True)
 
-    # Read CSV
-    df = pd.read_csv('yield_df.csv')
+    # Read the source (CSV, or Parquet/Arrow via INGEST_SOURCE)
+    df = read_source(DEFAULT_SOURCE)
 
     # Insert unique areas
     areas_collection = db.areas
@@ -5,7 +5,70 @@ import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Plain SQL equivalents of the stored procedures, used on databases without
+# CALL support (e.g. the SQLite files the local benchmarks run against)
+PROCEDURE_QUERIES = {
+    "CalculateItemYieldAverage": """
+        SELECT
+            i.item_name,
+            AVG(y.hg_per_ha_yield) as average_yield,
+            MIN(y.hg_per_ha_yield) as min_yield,
+            MAX(y.hg_per_ha_yield) as max_yield
+        FROM yield y
+        JOIN items i ON y.item_id = i.item_id
+        WHERE y.item_id = :item_id
+        GROUP BY i.item_name
+    """,
+    "GetAreaEnvironmentStats": """
+        SELECT
+            a.area_name,
+            e.year,
+            AVG(e.temp) as avg_temperature,
+            AVG(e.average_rai) as avg_rainfall,
+            AVG(e.pesticides_tavg) as avg_pesticides
+        FROM environment e
+        JOIN areas a ON e.area_id = a.area_id
+        WHERE e.area_id = :area_id
+        GROUP BY a.area_name, e.year
+        ORDER BY e.year DESC
+    """,
+    "PredictYield": """
+        SELECT
+            (SELECT AVG(hg_per_ha_yield) FROM yield
+             WHERE area_id = :area_id AND item_id = :item_id) +
+            (:temp * 0.5) +
+            (:rain * 0.3) +
+            (:pesticides * -0.2)
+        AS predicted_yield
+    """,
+    "FindTopProducingAreas": """
+        SELECT
+            a.area_name,
+            y.hg_per_ha_yield,
+            y.year,
+            RANK() OVER (ORDER BY y.hg_per_ha_yield DESC) AS yield_rank
+        FROM yield y
+        JOIN areas a ON y.area_id = a.area_id
+        WHERE y.item_id = :item_id AND y.year = :year
+        ORDER BY y.hg_per_ha_yield DESC
+        LIMIT :limit
+    """
+}
+
+def call_procedure(session, name, params):
+    """Run a stored procedure on MySQL, or its plain SQL equivalent elsewhere.
+
+    `params` must be given in the procedure's argument order.
+    """
+    if session.get_bind().dialect.name == 'mysql':
+        placeholders = ', '.join(f':{key}' for key in params)
+        return session.execute(text(f"CALL {name}({placeholders})"), params)
+    return session.execute(text(PROCEDURE_QUERIES[name]), params)
+
 def create_stored_procedures_and_triggers():
+    if engine.dialect.name != 'mysql':
+        logger.info(f"Skipping stored procedures and triggers on {engine.dialect.name}")
+        return
     with engine.begin() as conn:  # Use begin() for transaction management
 
         # Drop and create CalculateItemYieldAverage procedure
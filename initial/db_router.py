@@ -0,0 +1,224 @@
+"""Read/write splitting between the primary database and read replicas.
+
+Writes, ingestion and the in-memory indexes stay on the primary `engine`.
+Read-only routes take their engine from read_router.engine(), which picks a
+healthy replica from DATABASE_READ_URLS (comma separated) by round robin or
+least connections (READ_ROUTING), or the primary when no replica is
+configured or healthy. Replicas are probed with SELECT 1 every
+REPLICA_CHECK_INTERVAL seconds and taken out of rotation as soon as a query
+on one hits a disconnect.
+
+Read-your-writes: a request whose route bumped a table version marks its
+client (same key as admission control) and gets a `read_primary_until`
+cookie; that client's reads go to the primary for READ_YOUR_WRITES_SECONDS,
+in this worker through the marker and in any worker through the cookie.
+"""
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event, text
+
+from db_schema_file import engine, make_engine
+from table_versions import table_versions
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DATABASE_READ_URLS = [url.strip() for url in os.getenv('DATABASE_READ_URLS', '').split(',') if url.strip()]
+READ_ROUTING = os.getenv('READ_ROUTING', 'round_robin')
+ROUTING_STRATEGIES = ('round_robin', 'least_connections')
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+STICKY_COOKIE = 'read_primary_until'
+# Expired write markers are dropped once this many clients are tracked
+MAX_WRITERS = 10000
+
+
+class _RequestRouting:
+    __slots__ = ('primary', 'wrote')
+
+    def __init__(self, primary: bool):
+        self.primary = primary
+        self.wrote = False
+
+
+# Routing state of the request being handled; a mutable holder so writes made
+# in the route's worker thread are seen by the middleware
+_request_routing: ContextVar[Optional[_RequestRouting]] = ContextVar('request_routing', default=None)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = make_engine(url)
+        self.name = repr(self.engine.url)
+        self.healthy = True
+        self.in_use = 0
+        self.served = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+        event.listen(self.engine, 'checkout', self._checked_out)
+        event.listen(self.engine, 'checkin', self._checked_in)
+        event.listen(self.engine, 'handle_error', self._query_failed)
+
+    def _checked_out(self, dbapi_connection, record, proxy):
+        with self._lock:
+            self.in_use += 1
+
+    def _checked_in(self, dbapi_connection, record):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def _query_failed(self, context):
+        if context.is_disconnect:
+            self.mark_down(str(context.original_exception))
+
+    def mark_down(self, error: str):
+        if self.healthy:
+            logger.warning(f"Read replica {self.name} is down: {error}")
+        self.healthy = False
+        self.failures += 1
+        self.last_error = error
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as e:
+            self.mark_down(str(e))
+        else:
+            if not self.healthy:
+                logger.info(f"Read replica {self.name} is back")
+            self.healthy = True
+        self.checked_at = time.time()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "in_use": self.in_use,
+            "served": self.served,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "checked_at": self.checked_at,
+        }
+
+
+class ReadRouter:
+    def __init__(self, primary, urls: List[str] = DATABASE_READ_URLS, strategy: str = READ_ROUTING,
+                 check_interval: float = REPLICA_CHECK_INTERVAL, sticky_seconds: float = READ_YOUR_WRITES_SECONDS):
+        if strategy not in ROUTING_STRATEGIES:
+            logger.warning(f"Unknown READ_ROUTING {strategy}; using round_robin")
+            strategy = 'round_robin'
+        self.primary = primary
+        self.replicas = [Replica(url) for url in urls]
+        self.strategy = strategy
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self.primary_reads = 0
+        self._turn = itertools.count()
+        self._writers: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        table_versions.on_change(self._on_write)
+
+    def engine(self):
+        """Engine for a read-only query of the current request"""
+        routing = _request_routing.get()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy or (routing is not None and routing.primary):
+            self.primary_reads += 1
+            return self.primary
+        if self.strategy == 'least_connections':
+            # Start at a rotating offset so idle replicas share the load
+            start = next(self._turn) % len(healthy)
+            replica = min(healthy[start:] + healthy[:start], key=lambda candidate: candidate.in_use)
+        else:
+            replica = healthy[next(self._turn) % len(healthy)]
+        replica.served += 1
+        return replica.engine
+
+    def reading_primary(self) -> bool:
+        """Whether reads of the current request must see the primary (coalescing keys include this)"""
+        routing = _request_routing.get()
+        return not self.replicas or (routing is not None and routing.primary)
+
+    def _on_write(self, tables):
+        routing = _request_routing.get()
+        if routing is not None:
+            routing.wrote = True
+
+    def begin_request(self, client: str, cookie: Optional[str]):
+        """Route the request's reads to the primary if the client wrote recently; returns a reset token"""
+        now = time.time()
+        try:
+            until = float(cookie) if cookie else 0.0
+        except ValueError:
+            until = 0.0
+        if not math.isfinite(until):
+            until = 0.0
+        # Client-supplied: ignore inf/nan and never credit more than one write's window
+        sticky = min(until, now + self.sticky_seconds) > now
+        with self._lock:
+            sticky = sticky or self._writers.get(client, 0.0) > now
+        return _request_routing.set(_RequestRouting(sticky))
+
+    def end_request(self, token, client: str) -> Optional[float]:
+        """Finish the request; returns until when the client stays on the primary if it wrote"""
+        routing = _request_routing.get()
+        _request_routing.reset(token)
+        if routing is None or not routing.wrote or not self.replicas:
+            return None
+        now = time.time()
+        until = now + self.sticky_seconds
+        with self._lock:
+            if len(self._writers) >= MAX_WRITERS:
+                self._writers = {key: value for key, value in self._writers.items() if value > now}
+            self._writers[client] = until
+        return until
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def start(self):
+        if not self.replicas or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='replica-health', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            sticky_clients = sum(1 for until in self._writers.values() if until > now)
+        return {
+            "strategy": self.strategy,
+            "primary_reads": self.primary_reads,
+            "sticky_clients": sticky_clients,
+            "read_your_writes_seconds": self.sticky_seconds,
+            "replicas": [replica.status() for replica in self.replicas],
+        }
+
+
+# Global instance
+read_router = ReadRouter(engine)
@@ -5,7 +5,13 @@ import os
 load_dotenv()
 db_string = os.getenv('DATABASE_URL')
 
-engine = create_engine(db_string) # This helps us to manage the database connections to the strings and the remote database
+def make_engine(url):
+    # SQLite (used for local benchmarks) refuses connections shared across threads by default,
+    # but FastAPI runs sync routes on a threadpool
+    connect_args = {"check_same_thread": False} if url and url.startswith('sqlite') else {}
+    return create_engine(url, connect_args=connect_args)
+
+engine = make_engine(db_string) # This helps us to manage the database connections to the strings and the remote database
 # echo helps us to print the SQL statements executed and see what's happening
 
 
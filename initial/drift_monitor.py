@@ -0,0 +1,457 @@
+"""Streaming drift monitor for /predict/ml inputs.
+
+Each prediction updates fixed-bin histograms and running moments (Welford)
+per feature in O(1). Histograms are compared with a reference profile of the
+training data: the active model's `reference_profile` metadata (written by
+train_model.py), else the profile file at DRIFT_REFERENCE_PATH, else one
+built from the ingestion source on first use. The profile is reloaded when
+the registry serves a new active model.
+
+Every worker periodically writes its own counts to DRIFT_STATE_DIR; the
+report merges all state files that share the reference, so it covers every
+worker until reset(). Files not rewritten for DRIFT_STATE_EXPIRY_INTERVALS
+persist intervals belong to workers that are gone and are removed.
+
+    python drift_monitor.py profile --source yield_df.csv --output drift_reference.json
+"""
+import argparse
+import bisect
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DRIFT_REFERENCE_PATH = os.getenv('DRIFT_REFERENCE_PATH', 'drift_reference.json')
+DRIFT_STATE_DIR = os.getenv('DRIFT_STATE_DIR', os.path.join(tempfile.gettempdir(), 'yield-api-drift'))
+DRIFT_PERSIST_INTERVAL = float(os.getenv('DRIFT_PERSIST_INTERVAL', '60'))
+DRIFT_STATE_EXPIRY_INTERVALS = int(os.getenv('DRIFT_STATE_EXPIRY_INTERVALS', '5'))
+# Fewer observations than this make PSI/KS too noisy to act on
+DRIFT_MIN_OBSERVATIONS = int(os.getenv('DRIFT_MIN_OBSERVATIONS', '100'))
+
+# Monitored feature -> training column
+NUMERIC_FEATURES = {
+    'temp': 'avg_temp',
+    'rain': 'average_rain_fall_mm_per_year',
+    'pesticides': 'pesticides_tonnes',
+    'year': 'Year',
+}
+CATEGORICAL_FEATURES = {
+    'area': 'Area',
+    'item': 'Item',
+}
+REFERENCE_BINS = 10
+# Conventional PSI bands
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+PSI_EPSILON = 1e-4
+
+
+def build_reference_profile(data, bins: int = REFERENCE_BINS, source: str = None) -> Dict[str, Any]:
+    """Quantile bin edges, bin shares and moments per feature from a training DataFrame"""
+    import numpy as np
+    profile: Dict[str, Any] = {"rows": int(len(data)), "source": source, "numeric": {}, "categorical": {}}
+    for feature, column in NUMERIC_FEATURES.items():
+        values = data[column].astype('float64').to_numpy()
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])).tolist()
+        counts = _bin_counts(values, edges)
+        profile["numeric"][feature] = {
+            "edges": edges,
+            "shares": [count / len(values) for count in counts],
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+        }
+    for feature, column in CATEGORICAL_FEATURES.items():
+        shares = data[column].value_counts(normalize=True)
+        profile["categorical"][feature] = {str(name): float(share) for name, share in shares.items()}
+    profile["id"] = hashlib.sha1(json.dumps(profile, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return profile
+
+
+def _bin_counts(values, edges: List[float]) -> List[int]:
+    import numpy as np
+    # Bin i holds edges[i-1] < x <= edges[i] (same as bisect_left); the outer bins are open-ended
+    positions = np.searchsorted(np.asarray(edges, dtype='float64'), values, side='left')
+    return np.bincount(positions, minlength=len(edges) + 1).tolist()
+
+
+def psi(expected: List[float], actual: List[float]) -> float:
+    """Population stability index between two share vectors"""
+    total = 0.0
+    for e, a in zip(expected, actual):
+        e, a = max(e, PSI_EPSILON), max(a, PSI_EPSILON)
+        total += (a - e) * math.log(a / e)
+    return total
+
+
+def binned_ks(expected: List[float], actual: List[float]) -> float:
+    """Largest gap between the two cumulative distributions, evaluated at the bin edges"""
+    gap = cumulative_e = cumulative_a = 0.0
+    for e, a in zip(expected, actual):
+        cumulative_e += e
+        cumulative_a += a
+        gap = max(gap, abs(cumulative_a - cumulative_e))
+    return gap
+
+
+def psi_status(value: float) -> str:
+    if value >= PSI_SIGNIFICANT:
+        return 'significant'
+    if value >= PSI_MODERATE:
+        return 'moderate'
+    return 'stable'
+
+
+class _Moments:
+    """Welford running mean/variance plus min/max"""
+
+    __slots__ = ('n', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, min=None, max=None):
+        self.n, self.mean, self.m2, self.min, self.max = n, mean, m2, min, max
+
+    def add(self, value: float):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: '_Moments'):
+        """Combine with another partition (Chan et al. parallel update)"""
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n, self.mean, self.m2, self.min, self.max = other.n, other.mean, other.m2, other.min, other.max
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.n) if self.n else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"n": self.n, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+
+class _State:
+    """Counts for one reference profile; mergeable across workers"""
+
+    def __init__(self, profile: Dict[str, Any]):
+        self.profile_id = profile["id"]
+        self.edges = {feature: spec["edges"] for feature, spec in profile["numeric"].items()}
+        self.numeric = {
+            feature: ([0] * (len(spec["edges"]) + 1), _Moments()) for feature, spec in profile["numeric"].items()
+        }
+        self.categorical: Dict[str, Dict[str, int]] = {feature: {} for feature in profile["categorical"]}
+        self.observations = 0
+        self.started_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "profile_id": self.profile_id,
+            "started_at": self.started_at,
+            "observations": self.observations,
+            "numeric": {feature: {"counts": counts, "moments": moments.to_dict()}
+                        for feature, (counts, moments) in self.numeric.items()},
+            "categorical": self.categorical,
+        }
+
+    def merge_dict(self, data: Dict[str, Any]):
+        self.observations += data["observations"]
+        for feature, entry in data["numeric"].items():
+            if feature not in self.numeric or len(entry["counts"]) != len(self.numeric[feature][0]):
+                continue
+            counts, moments = self.numeric[feature]
+            for index, count in enumerate(entry["counts"]):
+                counts[index] += count
+            moments.merge(_Moments(**entry["moments"]))
+        for feature, entry in data["categorical"].items():
+            merged = self.categorical.setdefault(feature, {})
+            for name, count in entry.items():
+                merged[name] = merged.get(name, 0) + count
+
+
+class DriftMonitor:
+    """Per-worker drift counters compared against a training reference profile"""
+
+    def __init__(self, state_dir: str = DRIFT_STATE_DIR, reference_path: str = DRIFT_REFERENCE_PATH,
+                 persist_interval: float = DRIFT_PERSIST_INTERVAL):
+        self.state_dir = state_dir
+        self.reference_path = reference_path
+        self.persist_interval = persist_interval
+        # One file per worker process lifetime; old files keep contributing until reset
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._profile: Optional[Dict[str, Any]] = None
+        # Version of the active model the profile was loaded for
+        self._profile_version: Optional[str] = None
+        self._state: Optional[_State] = None
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.skipped = 0
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.state_dir, f"worker-{self.worker_id}.json")
+
+    @property
+    def reset_path(self) -> str:
+        return os.path.join(self.state_dir, 'RESET')
+
+    def _reset_at(self) -> float:
+        # Any worker's reset() touches this file; counts started before it are discarded everywhere
+        try:
+            with open(self.reset_path) as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            return 0.0
+
+    def _active_model(self):
+        from model_registry import model_registry
+        return model_registry.active
+
+    def _load_profile(self, active) -> Dict[str, Any]:
+        if active is not None and active.metadata.get("reference_profile"):
+            return active.metadata["reference_profile"]
+        if os.path.exists(self.reference_path):
+            with open(self.reference_path) as f:
+                return json.load(f)
+        from ingestion_sources import DEFAULT_SOURCE, read_source
+        logger.info(f"No drift reference profile; building one from {DEFAULT_SOURCE}")
+        from train_model import normalize_training_data
+        return build_reference_profile(normalize_training_data(read_source(DEFAULT_SOURCE)), source=DEFAULT_SOURCE)
+
+    def _is_current(self, active) -> bool:
+        return self._profile is not None and self._profile_version == (active.version if active else None)
+
+    def profile(self) -> Dict[str, Any]:
+        """The reference for the active model; reloaded when the registry swaps models"""
+        active = self._active_model()
+        if not self._is_current(active):
+            with self._profile_lock:
+                if not self._is_current(active):
+                    profile = self._load_profile(active)
+                    with self._lock:
+                        # Counts against another reference cannot be compared with this one
+                        if self._state is None or self._state.profile_id != profile["id"]:
+                            self._state = _State(profile)
+                    self._profile = profile
+                    self._profile_version = active.version if active else None
+        return self._profile
+
+    def warm(self):
+        """Load the reference profile in the background if it is missing or belongs to another model"""
+        if self._is_current(self._active_model()) or self._profile_lock.locked():
+            return
+        threading.Thread(target=self.profile, name='drift-profile', daemon=True).start()
+
+    def observe(self, area: str, item: str, year: int, temp: float, rain: float, pesticides: float):
+        """Record one prediction's inputs; skipped (not blocking) until the reference profile is loaded"""
+        if self._profile is None:
+            self.skipped += 1
+            self.warm()
+            return
+        if not self._is_current(self._active_model()):
+            # Counted against the old reference until the new one is loaded
+            self.warm()
+        values = {'temp': temp, 'rain': rain, 'pesticides': pesticides, 'year': year}
+        with self._lock:
+            state = self._state
+            state.observations += 1
+            for feature, value in values.items():
+                if value is None:
+                    continue
+                counts, moments = state.numeric[feature]
+                counts[bisect.bisect_left(state.edges[feature], value)] += 1
+                moments.add(float(value))
+            for feature, name in (('area', area), ('item', item)):
+                seen = state.categorical[feature]
+                seen[name] = seen.get(name, 0) + 1
+
+    def observe_many(self, rows: Iterable[Dict[str, Any]]):
+        for row in rows:
+            self.observe(row['area'], row['item'], row['year'], row['temp'], row['rain'], row['pesticides'])
+
+    def persist(self):
+        """Write this worker's counts (atomically) so other workers and restarts see them"""
+        if self._state is None:
+            return
+        profile = self.profile()
+        reset_at = self._reset_at()
+        with self._lock:
+            if self._state.started_at < reset_at:
+                self._state = _State(profile)
+            data = self._state.to_dict()
+        if data["observations"] == 0:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.state_path)
+        self._state_files()
+
+    def _state_files(self) -> List[str]:
+        """Other workers' state files, removing the ones their worker stopped rewriting"""
+        expires = time.time() - DRIFT_STATE_EXPIRY_INTERVALS * self.persist_interval
+        paths = []
+        for path in glob.glob(os.path.join(self.state_dir, 'worker-*.json')):
+            if path == self.state_path:
+                continue
+            try:
+                if os.path.getmtime(path) < expires:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            paths.append(path)
+        return paths
+
+    def _merged_state(self) -> _State:
+        profile = self.profile()
+        merged = _State(profile)
+        reset_at = self._reset_at()
+        with self._lock:
+            if self._state.started_at >= reset_at:
+                merged.merge_dict(self._state.to_dict())
+        for path in self._state_files():
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable drift state {path}: {e}")
+                continue
+            if data.get("profile_id") == merged.profile_id and data.get("started_at", 0.0) >= reset_at:
+                merged.merge_dict(data)
+        return merged
+
+    def report(self) -> Dict[str, Any]:
+        """PSI and binned KS per feature for all workers' observations against the reference"""
+        profile = self.profile()
+        state = self._merged_state()
+        features: Dict[str, Any] = {}
+        for feature, spec in profile["numeric"].items():
+            counts, moments = state.numeric[feature]
+            total = sum(counts)
+            shares = [count / total for count in counts] if total else [0.0] * len(counts)
+            value = psi(spec["shares"], shares) if total else None
+            features[feature] = {
+                "observations": total,
+                "psi": value,
+                "ks": binned_ks(spec["shares"], shares) if total else None,
+                "status": psi_status(value) if value is not None and total >= DRIFT_MIN_OBSERVATIONS else 'insufficient_data',
+                "mean": moments.mean if moments.n else None,
+                "std": moments.std if moments.n else None,
+                "min": moments.min,
+                "max": moments.max,
+                "reference_mean": spec["mean"],
+                "reference_std": spec["std"],
+            }
+        for feature, reference in profile["categorical"].items():
+            seen = state.categorical.get(feature, {})
+            total = sum(seen.values())
+            names = sorted(set(reference) | set(seen))
+            expected = [reference.get(name, 0.0) for name in names]
+            actual = [seen.get(name, 0) / total if total else 0.0 for name in names]
+            value = psi(expected, actual) if total else None
+            unseen = sum(count for name, count in seen.items() if name not in reference)
+            features[feature] = {
+                "observations": total,
+                "psi": value,
+                "status": psi_status(value) if value is not None and total >= DRIFT_MIN_OBSERVATIONS else 'insufficient_data',
+                "categories_seen": len(seen),
+                "unseen_share": unseen / total if total else None,
+            }
+        statuses = [entry["status"] for entry in features.values()]
+        overall = next((status for status in ('significant', 'moderate', 'stable') if status in statuses),
+                       'insufficient_data')
+        return {
+            "status": overall,
+            "observations": state.observations,
+            "skipped_before_profile": self.skipped,
+            "reference": {"id": profile["id"], "rows": profile["rows"], "source": profile.get("source")},
+            "features": features,
+        }
+
+    def reset(self):
+        """Forget all observations, in this worker and in persisted state files, and reload the reference"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{self.reset_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(repr(time.time()))
+        os.replace(tmp_path, self.reset_path)
+        with self._profile_lock:
+            self._profile = None
+            with self._lock:
+                self._state = None
+        for path in glob.glob(os.path.join(self.state_dir, 'worker-*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _run(self):
+        while not self._stop.wait(self.persist_interval):
+            try:
+                self.persist()
+            except Exception as e:
+                logger.warning(f"Failed to persist drift state: {e}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='drift-persist', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.persist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drift monitor tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('profile', help="Build the reference profile from training data")
+    build.add_argument('--source', default='yield_df.csv', help="CSV, Parquet or Arrow training data")
+    build.add_argument('--output', default=DRIFT_REFERENCE_PATH)
+    build.add_argument('--bins', type=int, default=REFERENCE_BINS)
+    args = parser.parse_args()
+
+    from ingestion_sources import read_source
+    from train_model import normalize_training_data
+    profile = build_reference_profile(normalize_training_data(read_source(args.source)), args.bins, source=args.source)
+    with open(args.output, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"Wrote reference profile {profile['id']} ({profile['rows']} rows) to {args.output}")
+
+
+# Global instance
+drift_monitor = DriftMonitor()
+
+
+if __name__ == "__main__":
+    main()
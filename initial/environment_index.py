@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from table_versions import table_versions
+
+logger = logging.getLogger(__name__)
+
+# Tables the index is built from; a version change in any of them triggers a rebuild
+INDEX_TABLES = ('environment', 'areas', 'items')
+
+# Column order of the value array, as returned by lookup()
+ENVIRONMENT_COLUMNS = ('average_rai', 'pesticides_tavg', 'temp')
+
+
+# (area_id, year) packs into one sortable int64 key with the year in the low YEAR_BITS bits;
+# years outside 0..MAX_YEAR would land on another area's keys, so they never get a key
+YEAR_BITS = 16
+MAX_YEAR = (1 << YEAR_BITS) - 1
+
+
+def _pack(area_ids, years):
+    return (area_ids.astype('int64') << YEAR_BITS) | years.astype('int64')
+
+
+def pack_key(area_id: int, year: int) -> Optional[int]:
+    """Index key of (area_id, year), or None when the pair cannot be in the index"""
+    if not 0 <= year <= MAX_YEAR or area_id < 0:
+        return None
+    return (int(area_id) << YEAR_BITS) | int(year)
+
+
+class _Snapshot:
+    """Immutable build of the index; swapped in whole so readers never see a partial rebuild"""
+
+    __slots__ = ('versions', 'keys', 'values', 'area_names', 'item_names', 'built_at')
+
+    def __init__(self, versions, keys, values, area_names, item_names):
+        self.versions = versions
+        self.keys = keys
+        self.values = values
+        self.area_names = area_names
+        self.item_names = item_names
+        self.built_at = time.time()
+
+
+class EnvironmentIndex:
+    """In-memory copy of the environment table plus area/item names.
+
+    Environment rows are held as a sorted int64 key array and an (n, 3)
+    float64 value array, so a lookup is one binary search. The index is
+    rebuilt on the next lookup after environment, areas or items change,
+    either through this worker (table_versions listener) or another one
+    (shared table version counters).
+    """
+
+    def __init__(self):
+        self._engine = None
+        self._snapshot: Optional[_Snapshot] = None
+        self._stale = False
+        self._lock = threading.Lock()
+        table_versions.on_change(self._on_change)
+
+    def attach(self, engine):
+        self._engine = engine
+
+    def _on_change(self, tables):
+        if set(tables) & set(INDEX_TABLES):
+            self._stale = True
+
+    def _build(self, versions) -> _Snapshot:
+        import numpy as np
+        start = time.perf_counter()
+        with self._engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT area_id, year, average_rai, pesticides_tavg, temp FROM environment"
+            )).fetchall()
+            area_names = {area_id: name for area_id, name in conn.execute(text("SELECT area_id, area_name FROM areas"))}
+            item_names = {item_id: name for item_id, name in conn.execute(text("SELECT item_id, item_name FROM items"))}
+
+        if rows:
+            data = np.array(rows, dtype='float64')
+            valid = (data[:, 0] >= 0) & (data[:, 1] >= 0) & (data[:, 1] <= MAX_YEAR)
+            if not valid.all():
+                logger.warning(f"Skipping {int((~valid).sum())} environment rows with a year outside 0..{MAX_YEAR}")
+                data = data[valid]
+            keys = _pack(data[:, 0], data[:, 1])
+            order = np.argsort(keys, kind='stable')
+            keys, values = keys[order], np.ascontiguousarray(data[order, 2:])
+        else:
+            keys, values = np.empty(0, dtype='int64'), np.empty((0, 3), dtype='float64')
+        snapshot = _Snapshot(versions, keys, values, area_names, item_names)
+        logger.info(f"Built environment index: {len(keys)} rows, {len(area_names)} areas, "
+                    f"{len(item_names)} items in {time.perf_counter() - start:.3f}s")
+        return snapshot
+
+    def snapshot(self) -> _Snapshot:
+        """Current index, rebuilding first if its tables changed since the last build"""
+        if self._engine is None:
+            raise RuntimeError("Environment index is not attached to a database")
+        versions = table_versions.current(INDEX_TABLES)
+        snapshot = self._snapshot
+        if snapshot is not None and not self._stale and snapshot.versions == versions:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or self._stale or snapshot.versions != versions:
+                # Clear first: a write landing during the build marks it stale again
+                self._stale = False
+                snapshot = self._build(versions)
+                self._snapshot = snapshot
+        return snapshot
+
+    def lookup(self, area_id: int, year: int) -> Optional[Tuple[float, float, float]]:
+        """(average_rai, pesticides_tavg, temp) recorded for area_id in year, or None"""
+        import numpy as np
+        key = pack_key(area_id, year)
+        if key is None:
+            return None
+        snapshot = self.snapshot()
+        position = int(np.searchsorted(snapshot.keys, key))
+        if position < len(snapshot.keys) and snapshot.keys[position] == key:
+            rain, pesticides, temp = snapshot.values[position]
+            return float(rain), float(pesticides), float(temp)
+        return None
+
+    def area_name(self, area_id: int) -> Optional[str]:
+        return self.snapshot().area_names.get(area_id)
+
+    def item_name(self, item_id: int) -> Optional[str]:
+        return self.snapshot().item_names.get(item_id)
+
+    def names(self) -> Tuple[List[str], List[str]]:
+        """All area and item names, for encoding with legacy models"""
+        snapshot = self.snapshot()
+        return list(snapshot.area_names.values()), list(snapshot.item_names.values())
+
+    @property
+    def rows(self) -> int:
+        snapshot = self._snapshot
+        return len(snapshot.keys) if snapshot is not None else 0
+
+    def status(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "rows": len(snapshot.keys),
+            "areas": len(snapshot.area_names),
+            "items": len(snapshot.item_names),
+            "bytes": int(snapshot.keys.nbytes + snapshot.values.nbytes),
+            "versions": dict(zip(INDEX_TABLES, snapshot.versions)),
+            "built_at": snapshot.built_at
+        }
+
+
+# Global instance
+environment_index = EnvironmentIndex()
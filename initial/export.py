@@ -0,0 +1,159 @@
+import io
+import logging
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 50000
+
+# Same columns, names and order as yield_df.csv (minus its index column).
+# 'category' columns are dictionary-encoded: a few hundred distinct names repeated per row.
+EXPORT_COLUMNS = [
+    ('Area', 'category'),
+    ('Item', 'category'),
+    ('Year', 'int64'),
+    ('hg/ha_yield', 'float64'),
+    ('average_rain_fall_mm_per_year', 'float64'),
+    ('pesticides_tonnes', 'float64'),
+    ('avg_temp', 'float64'),
+]
+
+EXPORT_QUERY = """
+SELECT
+    a.area_name,
+    i.item_name,
+    y.year,
+    y.hg_per_ha_yield,
+    e.average_rai,
+    e.pesticides_tavg,
+    e.temp
+FROM yield y
+JOIN areas a ON y.area_id = a.area_id
+JOIN items i ON y.item_id = i.item_id
+JOIN environment e ON e.area_id = y.area_id AND e.year = y.year
+"""
+
+MEDIA_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def build_export_query(area_id: Optional[int] = None, item_id: Optional[int] = None,
+                       year_from: Optional[int] = None, year_to: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    conditions, params = [], {}
+    if area_id is not None:
+        conditions.append("y.area_id = :area_id")
+        params["area_id"] = area_id
+    if item_id is not None:
+        conditions.append("y.item_id = :item_id")
+        params["item_id"] = item_id
+    if year_from is not None:
+        conditions.append("y.year >= :year_from")
+        params["year_from"] = year_from
+    if year_to is not None:
+        conditions.append("y.year <= :year_to")
+        params["year_to"] = year_to
+    query = EXPORT_QUERY
+    if conditions:
+        query += "WHERE " + " AND ".join(conditions) + "\n"
+    # Primary key order, so the server can stream straight off the index
+    query += "ORDER BY y.area_id, y.item_id, y.year"
+    return query, params
+
+
+def export_schema():
+    import pyarrow as pa
+    return pa.schema([
+        (name, pa.dictionary(pa.int32(), pa.string()) if kind == 'category' else getattr(pa, kind)())
+        for name, kind in EXPORT_COLUMNS
+    ])
+
+
+def _to_array(values, arrow_type):
+    import pyarrow as pa
+    if pa.types.is_dictionary(arrow_type):
+        return pa.array(values, type=arrow_type.value_type).dictionary_encode()
+    return pa.array(values, type=arrow_type)
+
+
+def iter_record_batches(engine, query: str, params: Dict[str, Any], chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """Yield pyarrow RecordBatches of up to chunk_rows rows from a server-side cursor"""
+    import pyarrow as pa
+    schema = export_schema()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(text(query), params)
+        while True:
+            rows = result.fetchmany(chunk_rows)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [_to_array(column, field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            )
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose buffered bytes can be drained between writes"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_arrow(batches, compression: Optional[str] = 'zstd') -> Iterator[bytes]:
+    """Encode batches as an Arrow IPC stream, yielding bytes as each batch is written"""
+    import pyarrow as pa
+    sink = _DrainableSink()
+    # Each batch has its own dictionaries; deltas only send names not seen before
+    options = pa.ipc.IpcWriteOptions(compression=compression, emit_dictionary_deltas=True)
+    with pa.ipc.new_stream(sink, export_schema(), options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_parquet(batches, compression: Optional[str] = 'zstd') -> Iterator[bytes]:
+    """Encode batches as a Parquet file with one row group per batch"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sink = _DrainableSink()
+    with pq.ParquetWriter(sink, export_schema(), compression=compression or 'none') as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_batches([batch]))
+            yield sink.drain()
+    # Footer is written on close
+    yield sink.drain()
+
+
+def stream_export(engine, fmt: str, area_id: Optional[int] = None, item_id: Optional[int] = None,
+                  year_from: Optional[int] = None, year_to: Optional[int] = None,
+                  chunk_rows: int = DEFAULT_CHUNK_ROWS, compression: Optional[str] = 'zstd') -> Iterator[bytes]:
+    query, params = build_export_query(area_id, item_id, year_from, year_to)
+    batches = iter_record_batches(engine, query, params, chunk_rows)
+    if fmt == 'arrow':
+        return stream_arrow(batches, compression)
+    if fmt == 'parquet':
+        return stream_parquet(batches, compression)
+    raise ValueError(f"Unknown export format {fmt}")
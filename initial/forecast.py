@@ -0,0 +1,221 @@
+"""Multi-year yield forecasts for every (area, item) pair.
+
+Each area's rainfall, pesticides and temperature are extrapolated with a
+least-squares linear trend over its last FORECAST_TREND_YEARS recorded years.
+All areas and features are fitted at once from grouped sums (np.bincount),
+not one regression per area. The (area x item x future year) feature matrix
+is built with array broadcasting and scored in chunks of FORECAST_CHUNK_ROWS.
+Results are cached as column arrays, keyed on model version, table versions
+and forecast parameters, so pages and filters are slices of the cached
+columns.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from environment_index import MAX_YEAR, YEAR_BITS, environment_index
+from model_artifact import ModelArtifact
+from table_versions import table_versions
+
+logger = logging.getLogger(__name__)
+
+FORECAST_TREND_YEARS = int(os.getenv('FORECAST_TREND_YEARS', '10'))
+FORECAST_CHUNK_ROWS = int(os.getenv('FORECAST_CHUNK_ROWS', '5000'))
+FORECAST_MAX_YEARS = 30
+FORECAST_CACHE_SIZE = 8
+
+# Tables a forecast is derived from, besides the model
+FORECAST_TABLES = ('environment', 'yield', 'areas', 'items')
+COLUMNS = ('area_id', 'item_id', 'year', 'average_rai', 'pesticides_tavg', 'temp', 'predicted_yield_hg_per_ha')
+
+
+def fit_trends(area_ids, years, values, window: int = FORECAST_TREND_YEARS):
+    """Per-area least-squares slope and intercept of each value column against year.
+
+    Only each area's last `window` recorded years are used. Returns
+    (areas, slopes, intercepts, last_years). slopes and intercepts are
+    (n_areas, n_columns); an area with a single year gets a flat trend.
+    """
+    import numpy as np
+    areas, groups = np.unique(area_ids, return_inverse=True)
+    last_year = np.full(len(areas), np.iinfo(np.int64).min)
+    np.maximum.at(last_year, groups, years)
+    keep = years > last_year[groups] - window
+    groups, x, values = groups[keep], years[keep].astype(np.float64), values[keep]
+
+    def total(weights):
+        return np.bincount(groups, weights=weights, minlength=len(areas))
+
+    n = total(np.ones(len(x)))
+    mean_x = total(x) / n
+    centred = x - mean_x[groups]
+    sxx = total(centred * centred)
+    slopes = np.empty((len(areas), values.shape[1]))
+    intercepts = np.empty_like(slopes)
+    for column in range(values.shape[1]):
+        mean_y = total(values[:, column]) / n
+        sxy = total(centred * values[:, column])
+        slope = np.divide(sxy, sxx, out=np.zeros(len(areas)), where=sxx > 0)
+        slopes[:, column] = slope
+        intercepts[:, column] = mean_y - slope * mean_x
+    return areas, slopes, intercepts, last_year
+
+
+class Forecast:
+    """Forecast rows as column arrays sorted by (area_id, item_id, year)"""
+
+    def __init__(self, columns: Dict[str, Any], model_version: str, start_year: int, end_year: int,
+                 skipped_pairs: int, seconds: float):
+        self.columns = columns
+        self.model_version = model_version
+        self.start_year = start_year
+        self.end_year = end_year
+        self.skipped_pairs = skipped_pairs
+        self.seconds = seconds
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.columns['year'])
+
+    def select(self, area_id: Optional[int] = None, item_id: Optional[int] = None, year: Optional[int] = None):
+        """Row indices matching the filters (all rows when none are given)"""
+        import numpy as np
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in (('area_id', area_id), ('item_id', item_id), ('year', year)):
+            if value is not None:
+                mask &= self.columns[column] == value
+        return np.flatnonzero(mask)
+
+
+def build_forecast(engine, artifact: ModelArtifact, start_year: int, end_year: int,
+                   trend_years: int = FORECAST_TREND_YEARS, chunk_rows: int = FORECAST_CHUNK_ROWS) -> Forecast:
+    """Extrapolate environment trends and score every grown (area, item) pair for start_year..end_year"""
+    import numpy as np
+    from batch_scoring import _codes_for
+    start = time.perf_counter()
+    snapshot = environment_index.snapshot()
+    with engine.connect() as conn:
+        pairs = np.array(conn.execute(text(
+            "SELECT DISTINCT area_id, item_id FROM yield ORDER BY area_id, item_id"
+        )).fetchall(), dtype=np.int64).reshape(-1, 2)
+        area_codes, item_codes = _codes_for(artifact, conn)
+
+    areas, slopes, intercepts, _ = fit_trends(snapshot.keys >> YEAR_BITS, snapshot.keys & MAX_YEAR, snapshot.values,
+                                                trend_years)
+    # Pairs need an environment trend and names the model can encode
+    area_code = np.array([area_codes.get(snapshot.area_names.get(area), -1) for area in areas], dtype=np.int64)
+    item_ids = np.unique(pairs[:, 1]) if len(pairs) else np.empty(0, dtype=np.int64)
+    item_code = np.array([item_codes.get(snapshot.item_names.get(item), -1) for item in item_ids.tolist()],
+                         dtype=np.int64)
+    area_index = np.searchsorted(areas, pairs[:, 0])
+    has_trend = (area_index < len(areas)) & (areas[np.minimum(area_index, len(areas) - 1)] == pairs[:, 0]) \
+        if len(areas) else np.zeros(len(pairs), dtype=bool)
+    item_index = np.searchsorted(item_ids, pairs[:, 1])
+    usable = has_trend
+    usable[has_trend] &= area_code[area_index[has_trend]] >= 0
+    usable &= item_code[item_index] >= 0
+    pairs, area_index, item_index = pairs[usable], area_index[usable], item_index[usable]
+
+    years = np.arange(start_year, end_year + 1, dtype=np.int64)
+    # (pairs x years) rows, year varying fastest so the output stays sorted
+    pair_of_row = np.repeat(np.arange(len(pairs)), len(years))
+    year_of_row = np.tile(years, len(pairs))
+    row_area = area_index[pair_of_row]
+    environment = intercepts[row_area] + slopes[row_area] * year_of_row[:, None].astype(np.float64)
+    # Rainfall and pesticide use cannot go negative however steep the trend
+    environment[:, :2] = np.maximum(environment[:, :2], 0.0)
+    features = {
+        'average_rain_fall_mm_per_year': environment[:, 0],
+        'pesticides_tonnes': environment[:, 1],
+        'avg_temp': environment[:, 2],
+        'Item': item_code[item_index[pair_of_row]],
+        'Area': area_code[row_area],
+        'Year': year_of_row,
+    }
+    X = np.column_stack([features[name].astype(np.float64) for name in artifact.features])
+
+    predictions = np.empty(len(X), dtype=np.float64)
+    for offset in range(0, len(X), chunk_rows):
+        chunk = X[offset:offset + chunk_rows]
+        predictions[offset:offset + len(chunk)] = artifact.predict_input(artifact.input_from_array(chunk))
+
+    columns = {
+        'area_id': pairs[pair_of_row, 0],
+        'item_id': pairs[pair_of_row, 1],
+        'year': year_of_row,
+        'average_rai': environment[:, 0],
+        'pesticides_tavg': environment[:, 1],
+        'temp': environment[:, 2],
+        'predicted_yield_hg_per_ha': predictions,
+    }
+    forecast = Forecast(columns, artifact.version, start_year, end_year, int((~usable).sum()),
+                        time.perf_counter() - start)
+    logger.info(f"Forecast {len(pairs)} area/item pairs x {len(years)} years ({len(X)} rows) "
+                f"with {artifact.version} in {forecast.seconds:.2f}s")
+    return forecast
+
+
+class Forecaster:
+    """Builds forecasts on demand and keeps the most recent ones in memory"""
+
+    def __init__(self, cache_size: int = FORECAST_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._engine = None
+        self._cache: "OrderedDict[Tuple, Forecast]" = OrderedDict()
+        self._building: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, engine):
+        self._engine = engine
+
+    def forecast(self, artifact: ModelArtifact, start_year: int, end_year: int,
+                 trend_years: int = FORECAST_TREND_YEARS) -> Forecast:
+        if self._engine is None:
+            raise RuntimeError("Forecaster is not attached to a database")
+        if end_year < start_year or end_year - start_year + 1 > FORECAST_MAX_YEARS:
+            raise ValueError(f"Forecast between 1 and {FORECAST_MAX_YEARS} years (start_year <= end_year)")
+        key = (artifact.version, table_versions.current(FORECAST_TABLES), start_year, end_year, trend_years)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            building = self._building.setdefault(key, threading.Lock())
+        # Concurrent requests for the same forecast wait for one build
+        with building:
+            with self._lock:
+                cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            try:
+                cached = build_forecast(self._engine, artifact, start_year, end_year, trend_years)
+                with self._lock:
+                    self.misses += 1
+                    self._cache[key] = cached
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+        return cached
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cached": [{"model_version": forecast.model_version, "start_year": forecast.start_year,
+                            "end_year": forecast.end_year, "rows": len(forecast)} for forecast in self._cache.values()],
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# Global instance
+forecaster = Forecaster()
@@ -0,0 +1,142 @@
+"""Ingestion sources for the SQL and Mongo loaders.
+
+A source is a yield_df.csv-shaped file in CSV, Parquet or Arrow IPC format,
+picked by extension. Parquet and Arrow files are memory-mapped and only the
+columns the loaders use are read, so large dumps are not re-parsed as text
+on every load. Convert a CSV once with:
+
+    python ingestion_sources.py convert yield_df.csv yield_df.parquet
+"""
+import argparse
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE = os.getenv('INGEST_SOURCE', 'yield_df.csv')
+
+# Everything enter_data and data_process_mongodb read; the CSV's unnamed index column is skipped
+SOURCE_COLUMNS = [
+    'Area',
+    'Item',
+    'Year',
+    'hg/ha_yield',
+    'average_rain_fall_mm_per_year',
+    'pesticides_tonnes',
+    'avg_temp',
+]
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+CONVERT_BLOCK_SIZE = 16 << 20
+
+
+def source_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return 'parquet'
+    if extension in ARROW_EXTENSIONS:
+        return 'arrow'
+    if extension == '.csv':
+        return 'csv'
+    raise ValueError(f"Unsupported ingestion source {path}")
+
+
+def source_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('Area', pa.string()),
+        ('Item', pa.string()),
+        ('Year', pa.int64()),
+        ('hg/ha_yield', pa.float64()),
+        ('average_rain_fall_mm_per_year', pa.float64()),
+        ('pesticides_tonnes', pa.float64()),
+        ('avg_temp', pa.float64()),
+    ])
+
+
+def _read_arrow(path: str, columns):
+    import pyarrow as pa
+    source = pa.memory_map(path, 'r')
+    try:
+        table = pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        # Arrow IPC stream rather than file (e.g. saved from /export/dataset.arrow)
+        source.seek(0)
+        table = pa.ipc.open_stream(source).read_all()
+    return table.select(columns)
+
+
+def read_source(path: str = DEFAULT_SOURCE, columns=None):
+    """Read a source file into a DataFrame holding only `columns` (default SOURCE_COLUMNS)"""
+    import pandas as pd
+    columns = list(columns or SOURCE_COLUMNS)
+    fmt = source_format(path)
+    start = time.perf_counter()
+    if fmt == 'csv':
+        data = pd.read_csv(path, usecols=columns)[columns]
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        data = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    else:
+        data = _read_arrow(path, columns).to_pandas()
+    logger.info(f"Read {len(data)} rows from {path} ({fmt}) in {time.perf_counter() - start:.2f}s")
+    return data
+
+
+def convert_csv(csv_path: str, output_path: str, compression: str = 'zstd') -> int:
+    """Stream a CSV into Parquet or Arrow IPC (by output extension) without loading it whole.
+
+    Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    schema = source_schema()
+    fmt = source_format(output_path)
+    if fmt == 'csv':
+        raise ValueError("Output must be a Parquet or Arrow file")
+    reader = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=CONVERT_BLOCK_SIZE),
+        convert_options=pv.ConvertOptions(column_types=schema, include_columns=schema.names)
+    )
+    rows = 0
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(output_path, schema, compression=compression)
+    else:
+        # Uncompressed so readers can memory-map record batches without copying
+        writer = pa.ipc.new_file(output_path, schema)
+    with writer:
+        for batch in reader:
+            # Values are stored as-is; the loaders clean names as they do for CSV
+            if fmt == 'parquet':
+                writer.write_table(pa.Table.from_batches([batch], schema=schema))
+            else:
+                writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion source tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert = subparsers.add_parser('convert', help="Convert a CSV to Parquet or Arrow IPC")
+    convert.add_argument('csv')
+    convert.add_argument('output')
+    convert.add_argument('--compression', default='zstd', help="Parquet codec (zstd, snappy, none)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    rows = convert_csv(args.csv, args.output, args.compression)
+    print(f"Wrote {rows} rows to {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,45 @@
-from fastapi import FastAPI, HTTPException , Query
-from data_proces_file import enter_data , Session
+from fastapi import FastAPI, HTTPException , Query, Request
+from fastapi.responses import PlainTextResponse
 import logging
-from sqlalchemy import text
+import math
+import os
+from datetime import date
+import threading
 from typing import Any, List , Dict 
 from pydantic import BaseModel , Field
-from sqlmodel import SQLModel
+from sqlmodel import SQLModel, Session
+from sqlalchemy import text
 from db_schema_file import engine
-import uvicorn
-import gzip
-import pickle
-import pandas as pd
-import numpy as np
-from sklearn.preprocessing import LabelEncoder
-from database_procedures import create_stored_procedures_and_triggers
+import time
+import anyio
+from model_registry import model_registry
+from database_procedures import call_procedure, create_stored_procedures_and_triggers
 from models import Environment , Items ,Areas , Yield
 from sqlmodel_basecrud import BaseRepository
-from prediction_logger import prediction_logger
+from prediction_logger import STATS_GROUPS, prediction_logger
+from serialization import fetch_rows, json_response, negotiate_encoding
+from table_versions import CACHE_CONTROL, etag_matches, make_etag, table_versions, tables_for_path
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from export import DEFAULT_CHUNK_ROWS, MEDIA_TYPES, stream_export
+from environment_index import MAX_YEAR, environment_index
+from similarity_index import MAX_NEIGHBOURS, similarity_index
+from drift_monitor import drift_monitor
+from uncertainty import parse_quantiles, predict_with_uncertainty
+from backtest import MODES as BACKTEST_MODES, backtester
+from forecast import COLUMNS as FORECAST_COLUMNS, forecaster
+from admission import AdmissionMiddleware, admission
+from single_flight import single_flight
+from db_router import STICKY_COOKIE, read_router
+from migrations import SCHEMA_MIGRATIONS, explain_procedures, migrate, status as migration_status
+from metrics import (METRICS_DEBUG, METRICS_ENABLED, begin_request, finish_request,
+                     instrument_engine, registry, server_timing, stage)
 
 app = FastAPI()
+
+MAX_BATCH_ROWS = int(os.getenv('PREDICT_BATCH_MAX_ROWS', '5000'))
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load the trained model
-try:
-    with gzip.open('best_model.pkl.gz', 'rb') as f:
-        ml_model = pickle.load(f)
-    logger.info("Machine learning model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load ML model: {e}")
-    ml_model = None
-
 # Dependency to get a database session
 with Session(engine) as session:
     environment = BaseRepository(db=session, model=Environment)
@@ -37,10 +47,121 @@ with Session(engine) as session:
     areas = BaseRepository(db=session, model=Areas)
     yields = BaseRepository(db=session, model=Yield)
 
+def read_session() -> Session:
+    """Session for a read-only route (a replica when configured); writes keep using the repositories above"""
+    return Session(read_router.engine())
+
+# The in-memory indexes are keyed on table versions, so they must load from the primary
+environment_index.attach(engine)
+similarity_index.attach(engine)
+backtester.attach(engine)
+forecaster.attach(engine)
+
+if METRICS_ENABLED:
+    instrument_engine(engine)
+    for replica in read_router.replicas:
+        instrument_engine(replica.engine, pool_gauges=False)
+    registry.gauge('yield_api_threadpool_busy', 'Worker threads running sync routes',
+                   callback=lambda: anyio.to_thread.current_default_thread_limiter().borrowed_tokens)
+    registry.gauge('yield_api_threadpool_waiting', 'Sync route calls queued for a worker thread',
+                   callback=lambda: anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting)
+    registry.gauge('yield_api_models_cached', 'Model artifacts held in memory by the registry',
+                   callback=lambda: model_registry.cached_models)
+    registry.gauge('yield_api_environment_index_rows', 'Environment rows held by the in-memory feature index',
+                   callback=lambda: environment_index.rows)
+
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        stages = begin_request()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            elapsed = time.perf_counter() - start
+            route = request.scope.get('route')
+            finish_request(stages, getattr(route, 'path', 'unmatched'), request.method, status, elapsed)
+        if METRICS_DEBUG:
+            response.headers['Server-Timing'] = server_timing(stages, elapsed)
+        return response
+
+# Added here so it wraps the routes and the metrics middleware but sits inside conditional GET
+app.add_middleware(AdmissionMiddleware)
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """Answer If-None-Match with 304 from table versions alone, before any DB work"""
+    tables = tables_for_path(request.url.path) if request.method in ('GET', 'HEAD') else None
+    # The versions count writes on the primary; a lagging replica could serve an older body under them
+    if tables is None or not read_router.reading_primary():
+        return await call_next(request)
+
+    versions = table_versions.current(tables)
+    etag = make_etag(request.url.path, request.url.query, negotiate_encoding(request.headers.get('accept-encoding')),
+                     tables, versions, table_versions.epoch)
+    headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
+
+@app.middleware("http")
+async def read_write_routing(request: Request, call_next):
+    """Send reads to replicas, except for clients that wrote within READ_YOUR_WRITES_SECONDS"""
+    client = admission.client_key(request.headers, request.client)
+    token = read_router.begin_request(client, request.cookies.get(STICKY_COOKIE))
+    try:
+        response = await call_next(request)
+    finally:
+        until = read_router.end_request(token, client)
+    if until is not None:
+        response.set_cookie(STICKY_COOKIE, f"{until:.3f}", max_age=math.ceil(read_router.sticky_seconds),
+                            httponly=True, samesite='lax')
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of request, stage, pool, queue and cache metrics"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/limiter")
+async def get_limiter_state():
+    """Admission control state: pool usage, queue, service time and refusals per route class"""
+    return admission.status()
+
+@app.get("/admin/replicas")
+def get_replica_state():
+    """Read replica health, connections in use, reads served, and read-your-writes stickiness"""
+    return read_router.status()
+
 @app.on_event("startup")
 def on_startup():
     SQLModel.metadata.create_all(engine)
+    if SCHEMA_MIGRATIONS == 'startup':
+        try:
+            migrate(engine)
+        except Exception as e:
+            logger.warning(f"Schema migrations failed; run `python migrations.py migrate`: {e}")
     create_stored_procedures_and_triggers()
+    try:
+        table_versions.attach(engine)
+        table_versions.start()
+    except Exception as e:
+        logger.warning(f"Table versions are per-process only: {e}")
+    # Load the model and connect to MongoDB in the background so the worker
+    # starts serving immediately; the first request that needs either waits for it
+    model_registry.start()
+    threading.Thread(target=similarity_index.warm, name='environment-index', daemon=True).start()
+    drift_monitor.warm()
+    drift_monitor.start()
+    read_router.start()
+    threading.Thread(target=prediction_logger.connect, name='mongo-connect', daemon=True).start()
 @app.get("/")
 def read_root():
     return {"crosix": "Connected"}
@@ -49,6 +170,7 @@ def read_root():
 def insert_recs():
     logger.info("Received POST request to /enter_recs")
     try:
+        from data_proces_file import enter_data
         enter_data()
         return {"Entered": "Data inserted successfully"}
     except Exception as e:
@@ -81,85 +203,116 @@ class EnvUpdate(BaseModel):
 @app.get('/items/latest')
 def get_latest_items() :
     try:
-        length=  len(list(items.get_all()))
-        return items.get_all()[length-1]
+        with read_session() as session:
+            rows = BaseRepository(db=session, model=Items).get_all()
+            return rows[len(list(rows))-1]
     except Exception as e:
         return e
 @app.get('/environment/latest')
 def get_latest_environment() :
     try:
-        length=  len(list(environment.get_all()))
-        return environment.get_all()[length-1]
+        with read_session() as session:
+            rows = BaseRepository(db=session, model=Environment).get_all()
+            return rows[len(list(rows))-1]
     except Exception as e:
         return e
+@app.get('/environment/similar')
+def get_similar_environment(
+    request: Request,
+    area_id: int,
+    year: int = Query(..., ge=0, le=MAX_YEAR),
+    k: int = Query(10, ge=1, le=MAX_NEIGHBOURS, description="Number of similar (area, year) rows"),
+    item_id: int = Query(None, description="Only include this item's yields"),
+    exclude_same_area: bool = Query(True, description="Skip other years of the same area")
+):
+    """(area, year) rows whose rainfall, pesticides and temperature are closest to area_id's in year"""
+    try:
+        with stage('similarity'):
+            result = similarity_index.similar(area_id, year, k, item_id, exclude_same_area)
+    except Exception as e:
+        logger.error(f"Similarity search failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Similarity search failed: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No environment data for area {area_id} in {year}")
+    return json_response(request, result)
 @app.get('/yield/latest')
 def get_latest_yield() :
     try:
-        length=  len(list(yields.get_all()))
-        return yields.get_all()[length-1]
+        with read_session() as session:
+            rows = BaseRepository(db=session, model=Yield).get_all()
+            return rows[len(list(rows))-1]
     except Exception as e:
         return e
 @app.get('/areas/latest')
 def get_latest_areas() :
     try:
-        length=  len(list(areas.get_all()))
-        return areas.get_all()[length-1]
+        with read_session() as session:
+            rows = BaseRepository(db=session, model=Areas).get_all()
+            return rows[len(list(rows))-1]
     except Exception as e:
         return e
     
 @app.get('/items')
-def get_all_items() -> List[Dict[str | int , Any]]:
-    try:    
-        return items.get_all()
+def get_all_items(request: Request):
+    try:
+        with read_session() as session:
+            return json_response(request, fetch_rows(session, Items))
     except Exception as e:
-        return e
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get('/areas')
-def get_all_areas() -> List[Dict[str | int,Any]]:
+def get_all_areas(request: Request):
     try:
-        return areas.get_all()
+        with read_session() as session:
+            return json_response(request, fetch_rows(session, Areas))
     except Exception as e:
-        return e
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get('/environment')
-def get_all_environment() ->  List[Dict[str,Any]]:
+def get_all_environment(request: Request):
     try:
-        return environment.get_all()
+        with read_session() as session:
+            return json_response(request, fetch_rows(session, Environment))
     except Exception as e:
-        return e
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get('/yield')
-def get_all_yields()-> List[Dict[str,Any]]:
+def get_all_yields(request: Request):
     try:
-        return yields.get_all()
+        with read_session() as session:
+            return json_response(request, fetch_rows(session, Yield))
     except Exception as e:
-        return e
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get('/items/{id}')
 def get_single_items(id)-> Dict[str,Any]:
     try:
-        return items.get(item_id=id)
+        with read_session() as session:
+            return BaseRepository(db=session, model=Items).get(item_id=id)
     except Exception as e:
         return e
 
 @app.get('/areas/{id}')
 def get_single_areas(id)-> Dict[str | int,Any]:
     try:
-        return areas.get(area_id=id)
+        with read_session() as session:
+            return BaseRepository(db=session, model=Areas).get(area_id=id)
     except Exception as e:
         return e
 
 @app.get('/environment/{id}')
 def get_single_environment(id) ->Dict[str,Any]:
     try:
-        return environment.get(area_id=id)
+        with read_session() as session:
+            return BaseRepository(db=session, model=Environment).get(area_id=id)
     except Exception as e:
         return e
 
 @app.get('/yield/{id}')
 def get_single_yields(id:int)-> Dict[str,Any]:
     try:
-        return yields.get(area_id=id)
+        with read_session() as session:
+            return BaseRepository(db=session, model=Yield).get(area_id=id)
     except Exception as e:
         return e
 
@@ -169,6 +322,7 @@ def update_item(req:ItemUpdate,id:int):
         item_update = items.get(item_id=id)
         item_update.item_name = req.item_name
         items.update(item_update)
+        table_versions.bump('items')
         return f'Updated Item {id}'
     except Exception as e:
         return e
@@ -181,6 +335,7 @@ def update_environment(req:EnvUpdate,id:int,year:int):
         env_update.pesticides_tavg = req.pesticides_tavg   
         env_update.temp = req.temp
         environment.update(env_update)
+        table_versions.bump('environment')
         return f'Updated Environment {id}'
     except Exception as e:
         return e
@@ -191,6 +346,7 @@ def update_yield(req:YieldIn,area_id,item_id,year):
         yield_update = yields.get(area_id=area_id,item_id=item_id,year=year)
         yield_update.hg_per_ha_yield = req.hg_per_ha_yield
         yields.update(yield_update)
+        table_versions.bump('yield')
         return f'Updated Yield {id}'
     except Exception as e:
         return e
@@ -199,6 +355,7 @@ def update_yield(req:YieldIn,area_id,item_id,year):
 def create_item(req:ItemsInput):
     try:
         items.create(Items(item_name=req.item_name))
+        table_versions.bump('items')
         return f'Added successfully'
     except Exception as e:
         return e
@@ -208,6 +365,7 @@ def create_environment(req:EnvironmentInput,id:int):
     try:
         env = Environment(year=req.year,temp=req.temp,average_rai=req.rai,pesticides_tavg=req.tavg,area_id=id)
         environment.create(env)
+        table_versions.bump('environment')
         return f'Added successfully'
     except Exception as e:
         return e
@@ -217,6 +375,7 @@ def create_yield(req: YieldIn,area_id,item_id):
     try:
         yiel = Yield(area_id=area_id,item_id=item_id,year=req.year,hg_per_ha_yield=req.hg)
         yields.create(yiel)  
+        table_versions.bump('yield')
         return f'Added successfully'
     except Exception as e:
         return e
@@ -226,6 +385,7 @@ def create_yield(req: YieldIn,area_id,item_id):
 def delete_items(id):
     try:
         items.delete(items.get(item_id=id))
+        table_versions.bump('items')
         return f'Deleted {id} in items'
     except Exception as e:
         return e
@@ -234,6 +394,7 @@ def delete_items(id):
 def delete_environment(area_id,year):
     try:
         environment.delete(environment.get(area_id=area_id,year=year))
+        table_versions.bump('environment')
         return f'Deleted {area_id} in {year} in environment'
     except Exception as e:
         return e
@@ -242,38 +403,41 @@ def delete_environment(area_id,year):
 def delete_yields(area_id,item_id,year):
     try:
         yields.delete(yields.get(item_id=item_id,area_id=area_id,year=year))
+        table_versions.bump('yield')
         return f'Deleted {area_id} in {areas.get(area_id=area_id)} from {year} in yields'
     except Exception as e:
         return e
 
+def run_procedure(request: Request, name: str, params: Dict[str, Any], scalar: bool = False):
+    """Call a stored procedure once for all concurrent identical requests (keyed on params and table versions)"""
+    key = (tuple(sorted(params.items())), table_versions.current(tables_for_path(request.url.path)),
+           read_router.reading_primary())
+
+    def execute():
+        with read_session() as session:
+            result = call_procedure(session, name, params)
+            return result.scalar() if scalar else [dict(row) for row in result.fetchall()]
+    return single_flight.do(name, key, execute)
+
 @app.get("/procedures/item_yield_average/{item_id}")
-def get_item_yield_average(item_id: int):
+def get_item_yield_average(request: Request, item_id: int):
     """Endpoint that uses the CalculateItemYieldAverage stored procedure"""
     try:
-        with Session(engine) as session:
-            result = session.execute(
-                text("CALL CalculateItemYieldAverage(:item_id)"),
-                {"item_id": item_id}
-            ).fetchall()
-            return [dict(row) for row in result]
+        return run_procedure(request, "CalculateItemYieldAverage", {"item_id": item_id})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/procedures/area_environment_stats/{area_id}")
-def get_area_environment_stats(area_id: int):
+def get_area_environment_stats(request: Request, area_id: int):
     """Endpoint that uses the GetAreaEnvironmentStats stored procedure"""
     try:
-        with Session(engine) as session:
-            result = session.execute(
-                text("CALL GetAreaEnvironmentStats(:area_id)"),
-                {"area_id": area_id}
-            ).fetchall()
-            return [dict(row) for row in result]
+        return run_procedure(request, "GetAreaEnvironmentStats", {"area_id": area_id})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/procedures/predict_yield/{area_id}/{item_id}")
 def predict_yield(
+    request: Request,
     area_id: int,
     item_id: int,
     temp: float = Query(...),
@@ -282,150 +446,332 @@ def predict_yield(
 ):
     """Endpoint that uses the PredictYield stored procedure"""
     try:
-        with Session(engine) as session:
-            result = session.execute(
-                text("CALL PredictYield(:area_id, :item_id, :temp, :rain, :pesticides)"),
-                {
-                    "area_id": area_id,
-                    "item_id": item_id,
-                    "temp": temp,
-                    "rain": rain,
-                    "pesticides": pesticides
-                }
-            ).scalar()
-            return {"predicted_yield": result}
+        result = run_procedure(
+            request, "PredictYield",
+            {
+                "area_id": area_id,
+                "item_id": item_id,
+                "temp": temp,
+                "rain": rain,
+                "pesticides": pesticides
+            },
+            scalar=True
+        )
+        return {"predicted_yield": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/procedures/top_producing_areas/{item_id}/{year}")
 def get_top_producing_areas(
+    request: Request,
     item_id: int,
     year: int,
     limit: int = Query(10, gt=0, le=100)
 ):
     """Endpoint that uses the FindTopProducingAreas stored procedure"""
     try:
-        with Session(engine) as session:
-            result = session.execute(
-                text("CALL FindTopProducingAreas(:item_id, :year, :limit)"),
-                {"item_id": item_id, "year": year, "limit": limit}
-            ).fetchall()
-            return [dict(row) for row in result]
+        return run_procedure(request, "FindTopProducingAreas", {"item_id": item_id, "year": year, "limit": limit})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/export/dataset.{fmt}")
+def export_dataset(
+    fmt: str,
+    area_id: int = Query(None, description="Filter by area ID"),
+    item_id: int = Query(None, description="Filter by item ID"),
+    year_from: int = Query(None, description="First year to include"),
+    year_to: int = Query(None, description="Last year to include"),
+    chunk_rows: int = Query(DEFAULT_CHUNK_ROWS, ge=1000, le=500000, description="Rows per batch / row group"),
+    compression: str = Query('zstd', pattern='^(zstd|lz4|none)$')
+):
+    """Stream the joined yield + environment table (yield_df.csv layout) as Arrow IPC or Parquet"""
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail=f"Unknown export format {fmt}; use arrow or parquet")
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=501, detail="pyarrow is not installed on this server")
+
+    stream = stream_export(
+        read_router.engine(), fmt,
+        area_id=area_id, item_id=item_id, year_from=year_from, year_to=year_to,
+        chunk_rows=chunk_rows, compression=None if compression == 'none' else compression
+    )
+    return StreamingResponse(
+        stream,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="yield_dataset.{fmt}"'}
+    )
+
+def resolve_features(area_id: int, item_id: int, year: int, temp=None, rain=None, pesticides=None):
+    """Look up names and fill missing environment features from the in-memory index.
+
+    Returns (area_name, item_name, rain, pesticides, temp, filled) or raises HTTPException.
+    """
+    with stage('lookup'):
+        area_name = environment_index.area_name(area_id)
+        item_name = environment_index.item_name(item_id)
+    if not area_name:
+        raise HTTPException(status_code=404, detail="Area not found")
+    if not item_name:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    filled = []
+    if temp is None or rain is None or pesticides is None:
+        with stage('environment_lookup'):
+            recorded = environment_index.lookup(area_id, year)
+        if recorded is None:
+            raise HTTPException(
+                status_code=422,
+                detail=f"No environment data for area {area_id} in {year}; pass temp, rain and pesticides"
+            )
+        if rain is None:
+            rain = recorded[0]
+            filled.append("rainfall")
+        if pesticides is None:
+            pesticides = recorded[1]
+            filled.append("pesticides")
+        if temp is None:
+            temp = recorded[2]
+            filled.append("temperature")
+    return area_name, item_name, rain, pesticides, temp, filled
+
+# Tables a single prediction's resolved features and encodings are read from
+PREDICT_TABLES = ('environment', 'areas', 'items')
+
+def score_one(ml_model, area_id: int, item_id: int, year: int, temp, rain, pesticides, quantiles=None):
+    """Resolve missing features, encode and score one row; an interval is added when quantiles are given"""
+    area_name, item_name, rain, pesticides, temp, filled = resolve_features(
+        area_id, item_id, year, temp, rain, pesticides
+    )
+
+    # Legacy models carry no frozen codes, so refit them on current DB names
+    all_areas = all_items = None
+    if ml_model.is_legacy:
+        with stage('name_lists'):
+            all_areas, all_items = environment_index.names()
+
+    # Encode categorical features
+    try:
+        with stage('encode'):
+            encoded_area, encoded_item = ml_model.encode(area_name, item_name, all_areas, all_items)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    # Prepare input for model
+    input_row = {
+        'average_rain_fall_mm_per_year': rain,
+        'pesticides_tonnes': pesticides,
+        'avg_temp': temp,
+        'Item': encoded_item,
+        'Area': encoded_area,
+        'Year': year
+    }
+
+    # Make prediction
+    with stage('build_frame'):
+        input_data = ml_model.build_input([input_row])
+    interval = None
+    with stage('model_predict'):
+        if quantiles is not None:
+            points, intervals = predict_with_uncertainty(ml_model, input_data, quantiles, [item_id])
+            prediction, interval = points[0], intervals[0]
+        else:
+            prediction = ml_model.predict_input(input_data)[0]
+    return area_name, item_name, rain, pesticides, temp, filled, prediction, interval
+
 @app.post("/predict/ml")
 def predict_with_ml_model(
     area_id: int,
     item_id: int,
-    year: int,
-    temp: float = Query(..., description="Temperature"),
-    rain: float = Query(..., description="Average rainfall"),
-    pesticides: float = Query(..., description="Pesticides usage")
+    year: int = Query(..., ge=0, le=MAX_YEAR),
+    temp: float = Query(None, description="Temperature; defaults to the recorded value for (area, year)"),
+    rain: float = Query(None, description="Average rainfall; defaults to the recorded value for (area, year)"),
+    pesticides: float = Query(None, description="Pesticides usage; defaults to the recorded value for (area, year)"),
+    uncertainty: bool = Query(False, description="Add a prediction interval (ensemble spread or backtest residuals)"),
+    quantiles: str = Query(None, description="Comma separated interval quantiles, default 0.05,0.5,0.95")
 ):
-    """Make prediction using the trained ML model with database data for encoding"""
+    """Make prediction using the trained ML model; missing environment features come from the environment table"""
+    ml_model, model_role = model_registry.choose()
     if ml_model is None:
         raise HTTPException(status_code=500, detail="ML model not loaded")
+    try:
+        quantiles = parse_quantiles(quantiles)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     
     try:
-        # Create a fresh session for this request
-        with Session(engine) as fresh_session:
-            # Create fresh repository instances
-            fresh_areas = BaseRepository(db=fresh_session, model=Areas)
-            fresh_items = BaseRepository(db=fresh_session, model=Items)
-            
-            # Fetch area and item
-            area = fresh_areas.get(area_id=area_id)
-            if not area:
-                raise HTTPException(status_code=404, detail="Area not found")
-            
-            item = fresh_items.get(item_id=item_id)
-            if not item:
-                raise HTTPException(status_code=404, detail="Item not found")
-            
-            # Get all areas and items for encoding
-            all_areas_objects = fresh_areas.get_all()
-            all_items_objects = fresh_items.get_all()
-            
-            # Extract names from objects - handle both dict and object formats
-            all_areas = []
-            for a in all_areas_objects:
-                if isinstance(a, dict):
-                    all_areas.append(a["area_name"])
-                else:
-                    all_areas.append(a.area_name)
-                    
-            all_items = []
-            for i in all_items_objects:
-                if isinstance(i, dict):
-                    all_items.append(i["item_name"])
-                else:
-                    all_items.append(i.item_name)
-            
-            # Create label encoders
-            area_encoder = LabelEncoder().fit(all_areas)
-            item_encoder = LabelEncoder().fit(all_items)
-            
-            # Get area and item names - handle both dict and object formats
-            area_name = area.area_name if hasattr(area, 'area_name') else area["area_name"]
-            item_name = item.item_name if hasattr(item, 'item_name') else item["item_name"]
-            
-            # Encode categorical features
-            encoded_area = area_encoder.transform([area_name])[0]
-            encoded_item = item_encoder.transform([item_name])[0]
-            
-            # Prepare input for model
-            input_data = pd.DataFrame([{
-                'average_rain_fall_mm_per_year': rain,
-                'pesticides_tonnes': pesticides,
-                'avg_temp': temp,
-                'Item': encoded_item,
-                'Area': encoded_area,
-                'Year': year
-            }])
-            
-            # Make prediction
-            prediction = ml_model.predict(input_data)[0]
-            
-            # Prepare response
-            response_data = {
-                "area_id": area_id,
-                "item_id": item_id,
-                "area_name": area_name,
-                "item_name": item_name,
-                "year": year,
-                "input_data": {
-                    "temperature": temp,
-                    "rainfall": rain,
-                    "pesticides": pesticides
-                },
-                "predicted_yield_hg_per_ha": float(prediction),
-                "model_used": "trained_ml_model"
-            }
-            
-            # Save prediction to MongoDB
-            try:
+        # Identical concurrent requests share one feature lookup and model call
+        key = (ml_model.version, area_id, item_id, year, temp, rain, pesticides,
+               quantiles if uncertainty else None, table_versions.current(PREDICT_TABLES))
+        area_name, item_name, rain, pesticides, temp, filled, prediction, interval = single_flight.do(
+            'predict_ml', key,
+            lambda: score_one(ml_model, area_id, item_id, year, temp, rain, pesticides,
+                              quantiles if uncertainty else None)
+        )
+
+        # Prepare response
+        response_data = {
+            "area_id": area_id,
+            "item_id": item_id,
+            "area_name": area_name,
+            "item_name": item_name,
+            "year": year,
+            "input_data": {
+                "temperature": temp,
+                "rainfall": rain,
+                "pesticides": pesticides
+            },
+            "predicted_yield_hg_per_ha": float(prediction),
+            "model_used": ml_model.version,
+            "model_role": model_role,
+            "filled_from_environment": filled
+        }
+        if interval is not None:
+            response_data["uncertainty"] = dict(interval)
+
+        try:
+            with stage('drift'):
+                drift_monitor.observe(area_name, item_name, year, temp, rain, pesticides)
+        except Exception as e:
+            logger.warning(f"Drift monitor failed to record prediction: {e}")
+        
+        # Save prediction to MongoDB
+        try:
+            with stage('mongo_log'):
                 prediction_saved = prediction_logger.log_prediction(response_data)
-                if prediction_saved:
-                    logger.info(f"Prediction saved to MongoDB for area_id={area_id}, item_id={item_id}")
-                    response_data["mongodb_logged"] = True
-                else:
-                    logger.warning("Failed to save prediction to MongoDB")
-                    response_data["mongodb_logged"] = False
-            except Exception as log_error:
-                logger.warning(f"Error saving prediction to MongoDB: {log_error}")
+            if prediction_saved:
+                logger.info(f"Prediction saved to MongoDB for area_id={area_id}, item_id={item_id}")
+                response_data["mongodb_logged"] = True
+            else:
+                logger.warning("Failed to save prediction to MongoDB")
                 response_data["mongodb_logged"] = False
-            
-            return response_data
-            
+        except Exception as log_error:
+            logger.warning(f"Error saving prediction to MongoDB: {log_error}")
+            response_data["mongodb_logged"] = False
+        
+        return response_data
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Prediction failed: {e}")
         import traceback
         logger.error(f"Full traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+class PredictionRow(BaseModel):
+    area_id: int
+    item_id: int
+    year: int = Field(..., ge=0, le=MAX_YEAR)
+    temp: float = None
+    rain: float = None
+    pesticides: float = None
+
+class BatchPredictionRequest(BaseModel):
+    rows: List[PredictionRow]
+    uncertainty: bool = False
+    quantiles: List[float] = None
+
+@app.post("/predict/ml/batch")
+def predict_batch_with_ml_model(request: Request, req: BatchPredictionRequest):
+    """Score many rows with one model call; rows that cannot be scored are reported in `errors`"""
+    if len(req.rows) > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ROWS} rows per batch")
+    ml_model, model_role = model_registry.choose()
+    if ml_model is None:
+        raise HTTPException(status_code=500, detail="ML model not loaded")
+    try:
+        quantiles = parse_quantiles(req.quantiles)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    try:
+        all_areas = all_items = None
+        if ml_model.is_legacy:
+            with stage('name_lists'):
+                all_areas, all_items = environment_index.names()
+
+        results, errors, input_rows = [], [], []
+        with stage('encode'):
+            for index, row in enumerate(req.rows):
+                try:
+                    area_name, item_name, rain, pesticides, temp, filled = resolve_features(
+                        row.area_id, row.item_id, row.year, row.temp, row.rain, row.pesticides
+                    )
+                    try:
+                        encoded_area, encoded_item = ml_model.encode(area_name, item_name, all_areas, all_items)
+                    except ValueError as e:
+                        raise HTTPException(status_code=422, detail=str(e))
+                except HTTPException as e:
+                    errors.append({"index": index, "status_code": e.status_code, "detail": e.detail})
+                    continue
+                input_rows.append({
+                    'average_rain_fall_mm_per_year': rain,
+                    'pesticides_tonnes': pesticides,
+                    'avg_temp': temp,
+                    'Item': encoded_item,
+                    'Area': encoded_area,
+                    'Year': row.year
+                })
+                results.append({
+                    "index": index,
+                    "area_id": row.area_id,
+                    "item_id": row.item_id,
+                    "area_name": area_name,
+                    "item_name": item_name,
+                    "year": row.year,
+                    "input_data": {"temperature": temp, "rainfall": rain, "pesticides": pesticides},
+                    "filled_from_environment": filled
+                })
+
+        if input_rows:
+            with stage('build_frame'):
+                input_data = ml_model.build_input(input_rows)
+            with stage('model_predict'):
+                if req.uncertainty:
+                    predictions, intervals = predict_with_uncertainty(
+                        ml_model, input_data, quantiles, [result["item_id"] for result in results]
+                    )
+                    for result, interval in zip(results, intervals):
+                        result["uncertainty"] = interval
+                else:
+                    predictions = ml_model.predict_input(input_data)
+            for result, prediction in zip(results, predictions):
+                result["predicted_yield_hg_per_ha"] = float(prediction)
+                result["model_used"] = ml_model.version
+                result["model_role"] = model_role
+
+        try:
+            with stage('drift'):
+                drift_monitor.observe_many(
+                    {"area": result["area_name"], "item": result["item_name"], "year": result["year"],
+                     "temp": row['avg_temp'], "rain": row['average_rain_fall_mm_per_year'],
+                     "pesticides": row['pesticides_tonnes']}
+                    for result, row in zip(results, input_rows)
+                )
+        except Exception as e:
+            logger.warning(f"Drift monitor failed to record batch: {e}")
+
+        with stage('mongo_log'):
+            logged = prediction_logger.log_predictions(results) if results else 0
+
+        return json_response(request, {
+            "model_used": ml_model.version,
+            "model_role": model_role,
+            "predictions": results,
+            "errors": errors,
+            "mongodb_logged": logged
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch prediction failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
+
 @app.get("/predictions/history")
 def get_prediction_history(
+    request: Request,
     area_id: int = Query(None, description="Filter by area ID"),
     item_id: int = Query(None, description="Filter by item ID"), 
     limit: int = Query(100, ge=1, le=1000, description="Number of predictions to retrieve")
@@ -437,18 +783,234 @@ def get_prediction_history(
             item_id=item_id, 
             limit=limit
         )
-        return {
+        return json_response(request, {
             "total_predictions": len(history),
             "predictions": history,
             "mongodb_available": prediction_logger.predictions_collection is not None
-        }
+        })
     except Exception as e:
         logger.error(f"Failed to retrieve prediction history: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve prediction history: {str(e)}")
 
+PRECOMPUTED_QUERY = """
+SELECT p.model_version, p.predicted_yield, p.scored_at, y.hg_per_ha_yield
+FROM predictions p
+LEFT JOIN yield y ON y.area_id = p.area_id AND y.item_id = p.item_id AND y.year = p.year
+WHERE p.area_id = :area_id AND p.item_id = :item_id AND p.year = :year
+"""
+
+@app.get("/predictions/precomputed/{area_id}/{item_id}/{year}")
+def get_precomputed_prediction(
+    area_id: int,
+    item_id: int,
+    year: int,
+    model_version: str = Query(None, description="Defaults to the active model")
+):
+    """Batch-scored prediction at the recorded environment values, with its residual (no model call)"""
+    if model_version is None and model_registry.active is not None:
+        model_version = model_registry.active.version
+    query = PRECOMPUTED_QUERY
+    params = {"area_id": area_id, "item_id": item_id, "year": year}
+    if model_version is not None:
+        query += "AND p.model_version = :model_version\n"
+        params["model_version"] = model_version
+    # Without a version (model still loading) serve the most recent scoring run
+    query += "ORDER BY p.scored_at DESC LIMIT 1"
+    try:
+        with stage('lookup'), read_router.engine().connect() as conn:
+            row = conn.execute(text(query), params).first()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if row is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No precomputed prediction for {area_id}/{item_id}/{year}"
+                   + (f" with model {model_version}; run batch_scoring.py" if model_version else "")
+        )
+    version, predicted, scored_at, actual = row
+    return {
+        "area_id": area_id,
+        "item_id": item_id,
+        "year": year,
+        "predicted_yield_hg_per_ha": predicted,
+        "actual_yield_hg_per_ha": actual,
+        "residual": actual - predicted if actual is not None else None,
+        "model_used": version,
+        "scored_at": scored_at
+    }
+
+@app.get("/predictions/stats")
+def get_prediction_stats(
+    request: Request,
+    group_by: str = Query('area_item_day', description=f"One of {', '.join(STATS_GROUPS)}"),
+    source: str = Query('rollup', pattern='^(rollup|raw)$', description="Daily rollups, or the raw prediction log"),
+    area_id: int = Query(None, description="Filter by area ID"),
+    item_id: int = Query(None, description="Filter by item ID"),
+    model: str = Query(None, description="Filter by model version"),
+    start: date = Query(None, description="First UTC day to include"),
+    end: date = Query(None, description="Last UTC day to include"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of groups")
+):
+    """Prediction count and average/min/max predicted yield per group, aggregated in MongoDB"""
+    try:
+        stats = prediction_logger.get_prediction_stats(
+            group_by=group_by, area_id=area_id, item_id=item_id, model=model,
+            start=start, end=end, source=source, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to aggregate prediction stats: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to aggregate prediction stats: {str(e)}")
+    return json_response(request, {"group_by": group_by, "source": source, "groups": len(stats), "stats": stats})
+
+@app.get("/predictions/stats/distribution")
+def get_prediction_distribution(
+    request: Request,
+    bucket_width: float = Query(25000, gt=0, description="Bucket width in hg/ha"),
+    max_yield: float = Query(500000, gt=0, description="Upper edge of the last bucket; larger values go to 'overflow'"),
+    area_id: int = Query(None, description="Filter by area ID"),
+    item_id: int = Query(None, description="Filter by item ID"),
+    model: str = Query(None, description="Filter by model version"),
+    start: date = Query(None, description="First UTC day to include"),
+    end: date = Query(None, description="Last UTC day to include")
+):
+    """Histogram of predicted yields ($bucket over the prediction log)"""
+    buckets = int(max_yield // bucket_width) + 1
+    if buckets > 1000:
+        raise HTTPException(status_code=422, detail="At most 1000 buckets; raise bucket_width")
+    boundaries = [bucket_width * i for i in range(buckets + 1)]
+    try:
+        distribution = prediction_logger.get_prediction_distribution(
+            boundaries, area_id=area_id, item_id=item_id, model=model, start=start, end=end
+        )
+    except Exception as e:
+        logger.error(f"Failed to compute prediction distribution: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to compute prediction distribution: {str(e)}")
+    return json_response(request, {"bucket_width": bucket_width, "buckets": distribution})
+
+@app.post("/predictions/rollups/rebuild")
+def rebuild_prediction_rollups():
+    """Recompute the daily rollups from the raw prediction log"""
+    try:
+        prediction_logger.rebuild_rollups()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Rollup rebuild failed: {str(e)}")
+    return {"rebuilt": True}
+
+@app.get("/models")
+def get_models():
+    """Show the active and candidate models and the traffic split"""
+    return model_registry.status()
+
+@app.post("/models/reload")
+def reload_models():
+    """Re-read the model manifest now instead of waiting for the watcher"""
+    if not model_registry.refresh():
+        raise HTTPException(status_code=500, detail=f"Model reload failed: {model_registry.last_error}")
+    return model_registry.status()
+
+@app.get("/drift")
+def get_drift(request: Request):
+    """Input drift of predictions served so far (all workers) against the training data"""
+    try:
+        return json_response(request, drift_monitor.report())
+    except Exception as e:
+        logger.error(f"Drift report failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Drift report failed: {str(e)}")
+
+@app.post("/drift/reset")
+def reset_drift():
+    """Discard observed counts in every worker, e.g. after deploying a retrained model"""
+    drift_monitor.reset()
+    return {"reset": True}
+
+@app.get("/backtest/summary")
+def get_backtest_summary(
+    request: Request,
+    mode: str = Query('loyo', pattern=f"^({'|'.join(BACKTEST_MODES)})$", description="loyo, rolling or deployed"),
+    breakdown: str = Query('all', pattern='^(all|year|area|item|none)$', description="Which per-group metrics to include"),
+    refresh: bool = Query(False, description="Recompute even if a cached result exists")
+):
+    """MAE/RMSE/MAPE of the active model against recorded yields, overall and per year, area and item.
+
+    The first call for a model and data version starts the backtest and answers 202;
+    later calls return the cached summary.
+    """
+    # choose() loads the model on a cold worker; the backtest always describes the active one
+    model_registry.choose()
+    ml_model = model_registry.active
+    if ml_model is None:
+        raise HTTPException(status_code=500, detail="ML model not loaded")
+    try:
+        state, summary = backtester.summary(ml_model, mode, refresh)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Backtest failed: {str(e)}")
+    if state == 'failed':
+        raise HTTPException(status_code=500, detail=f"Backtest failed: {summary['error']}")
+    if state == 'running':
+        return JSONResponse(status_code=202, content={"status": "running", "mode": mode, "model_version": ml_model.version},
+                            headers={"Retry-After": "5"})
+    if breakdown != 'all':
+        summary = {key: value for key, value in summary.items()
+                   if key != 'residuals' and (not key.startswith('by_') or key == f"by_{breakdown}")}
+    return json_response(request, summary)
+
+@app.get("/forecast")
+def get_forecast(
+    request: Request,
+    start_year: int = Query(..., description="First forecast year"),
+    end_year: int = Query(..., description="Last forecast year (inclusive)"),
+    area_id: int = Query(None, description="Only this area"),
+    item_id: int = Query(None, description="Only this item"),
+    year: int = Query(None, description="Only this year"),
+    format: str = Query('rows', pattern='^(rows|columns)$', description="A list of row objects or one array per column"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=100000)
+):
+    """Active-model yield forecasts from per-area environment trends for every grown (area, item) pair"""
+    # choose() loads the model on a cold worker; forecasts always come from the active one
+    model_registry.choose()
+    ml_model = model_registry.active
+    if ml_model is None:
+        raise HTTPException(status_code=500, detail="ML model not loaded")
+    try:
+        with stage('forecast'):
+            forecast = forecaster.forecast(ml_model, start_year, end_year)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"Forecast failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Forecast failed: {str(e)}")
+
+    selected = forecast.select(area_id, item_id, year)
+    page = selected[offset:offset + limit]
+    columns = {name: forecast.columns[name][page].tolist() for name in FORECAST_COLUMNS}
+    payload = {
+        "model_version": forecast.model_version,
+        "start_year": forecast.start_year,
+        "end_year": forecast.end_year,
+        "total": int(len(selected)),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < len(selected) else None,
+    }
+    if format == 'columns':
+        payload["columns"] = columns
+    else:
+        payload["rows"] = [dict(zip(FORECAST_COLUMNS, values)) for values in zip(*columns.values())]
+    return json_response(request, payload)
+
 @app.on_event("shutdown")
 def on_shutdown():
     """Cleanup on application shutdown"""
+    model_registry.stop()
+    read_router.stop()
+    table_versions.stop()
+    try:
+        drift_monitor.stop()
+    except Exception as e:
+        logger.warning(f"Error persisting drift state: {e}")
     try:
         prediction_logger.close()
         logger.info("MongoDB connection closed")
@@ -471,11 +1033,22 @@ def debug_data_structure():
             "sample_item_type": type(sample_items[0]).__name__ if sample_items else "None",
             "sample_area_data": str(sample_areas[0]) if sample_areas else "None",
             "sample_item_data": str(sample_items[0]) if sample_items else "None",
-            "ml_model_loaded": ml_model is not None
+            "ml_model_loaded": model_registry.active is not None,
+            "environment_index": environment_index.status(),
+            "similarity_index": similarity_index.status(),
+            "single_flight": single_flight.status()
         }
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/debug/query_plans")
+def debug_query_plans():
+    """Applied schema migrations and the primary's query plans for the /procedures/* queries"""
+    try:
+        return {"migrations": migration_status(engine), "plans": explain_procedures(engine)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/debug/mongodb_status")
 def check_mongodb_status():
     """Check MongoDB connection status"""
@@ -503,4 +1076,5 @@ def check_mongodb_status():
         }
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,271 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# In debug mode every response carries a Server-Timing header with its stage timings
+METRICS_DEBUG = os.getenv('METRICS_DEBUG', 'false').lower() in ('1', 'true', 'yes')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage timings of the request being handled, as (stage, seconds) pairs
+_request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('request_stages', default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """A gauge set directly or computed by a callback when /metrics is scraped"""
+    kind = 'gauge'
+
+    def __init__(self, *args, callback: Callable[[], float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+                return []
+            if value is None:
+                return []
+            items = [((), value)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, callback: Callable[[], float] = None) -> Gauge:
+        return self._register(Gauge(name, help_text, callback=callback))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Global registry and the core latency metrics
+registry = MetricsRegistry()
+request_seconds = registry.histogram(
+    'yield_api_request_seconds', 'End-to-end request latency', ('route', 'method', 'status')
+)
+stage_seconds = registry.histogram(
+    'yield_api_stage_seconds', 'Latency of individual request stages', ('route', 'stage')
+)
+
+
+class _StageTimer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_NOOP = nullcontext()
+
+
+def stage(name: str):
+    """Time a block as a named stage of the current request.
+
+    Returns a shared no-op context manager when metrics are disabled.
+    """
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _StageTimer(name)
+
+
+def record_stage(name: str, seconds: float):
+    stages = _request_stages.get()
+    if stages is not None:
+        # Observed with the route label once the request finishes
+        stages.append((name, seconds))
+    else:
+        stage_seconds.observe(seconds, route='none', stage=name)
+
+
+def begin_request() -> List[Tuple[str, float]]:
+    """Start collecting stage timings for the current request context"""
+    stages: List[Tuple[str, float]] = []
+    _request_stages.set(stages)
+    return stages
+
+
+def finish_request(stages: List[Tuple[str, float]], route: str, method: str, status: int, seconds: float):
+    request_seconds.observe(seconds, route=route, method=method, status=status)
+    for name, duration in stages:
+        stage_seconds.observe(duration, route=route, stage=name)
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    """Format stage timings as a Server-Timing header value (milliseconds)"""
+    totals: Dict[str, float] = {}
+    for name, duration in stages:
+        totals[name] = totals.get(name, 0.0) + duration
+    parts = [f"{name};dur={duration * 1000:.3f}" for name, duration in totals.items()]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ', '.join(parts)
+
+
+def instrument_engine(engine, pool_gauges: bool = True):
+    """Record every SQL statement executed on `engine` as a `db_query` stage (and export its pool gauges)"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if starts:
+            record_stage('db_query', time.perf_counter() - starts.pop())
+
+    if not pool_gauges:
+        return
+    pool = engine.pool
+    # Only QueuePool-style pools expose these counters
+    if hasattr(pool, 'checkedout'):
+        registry.gauge('yield_api_db_pool_checked_out', 'Connections currently checked out', callback=pool.checkedout)
+    if hasattr(pool, 'size') and callable(pool.size):
+        registry.gauge('yield_api_db_pool_size', 'Configured pool size', callback=pool.size)
+    if hasattr(pool, 'overflow'):
+        registry.gauge('yield_api_db_pool_overflow', 'Connections open beyond the pool size', callback=pool.overflow)
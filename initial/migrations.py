@@ -0,0 +1,154 @@
+"""Schema migrations and secondary indexes for the SQL tables.
+
+SQLModel's create_all only creates missing tables, so anything added to an
+existing schema goes here as a numbered migration. Applied versions are
+recorded in `schema_migrations`. Migrations run on startup unless
+SCHEMA_MIGRATIONS=manual, or on demand:
+
+    python migrations.py migrate      apply pending migrations
+    python migrations.py status       applied / pending versions
+    python migrations.py explain      query plans of the /procedures/* queries
+
+The yield primary key is (area_id, item_id, year), so the item filters of
+CalculateItemYieldAverage and FindTopProducingAreas cannot use it; the
+environment key starts with year, so GetAreaEnvironmentStats' area filter
+cannot either. The indexes below cover those lookups.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Index, text
+from sqlalchemy.exc import IntegrityError
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SCHEMA_MIGRATIONS = os.getenv('SCHEMA_MIGRATIONS', 'startup')
+
+
+class Migration(NamedTuple):
+    version: str
+    description: str
+    apply: Callable
+
+
+def _index(name: str, table: str, *columns: str) -> Callable:
+    def apply(conn):
+        from sqlmodel import SQLModel
+        table_obj = SQLModel.metadata.tables[table]
+        # checkfirst makes the step safe to rerun on a database indexed by hand
+        Index(name, *(table_obj.c[column] for column in columns)).create(conn, checkfirst=True)
+    return apply
+
+
+MIGRATIONS: List[Migration] = [
+    Migration('0001', "yield (item_id, year, hg_per_ha_yield) for per-item averages and top areas",
+              _index('ix_yield_item_year_yield', 'yield', 'item_id', 'year', 'hg_per_ha_yield')),
+    Migration('0002', "yield (year) for per-year scans",
+              _index('ix_yield_year', 'yield', 'year')),
+    Migration('0003', "environment (area_id, year) for per-area environment stats",
+              _index('ix_environment_area_year', 'environment', 'area_id', 'year')),
+]
+
+
+def _ensure_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(50) PRIMARY KEY, description VARCHAR(255) NOT NULL, "
+            "applied_at DOUBLE PRECISION NOT NULL, seconds DOUBLE PRECISION NOT NULL)"
+        ))
+
+
+def applied_versions(engine) -> Dict[str, Dict[str, Any]]:
+    _ensure_table(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT version, description, applied_at, seconds FROM schema_migrations"))
+        return {row.version: dict(row._mapping) for row in rows}
+
+
+def migrate(engine, migrations: List[Migration] = MIGRATIONS) -> List[str]:
+    """Apply pending migrations in order; returns the versions applied by this call"""
+    import models  # noqa: F401  registers the tables the migrations refer to
+    done = applied_versions(engine)
+    applied = []
+    for migration in migrations:
+        if migration.version in done:
+            continue
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                migration.apply(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, applied_at, seconds) "
+                         "VALUES (:version, :description, :applied_at, :seconds)"),
+                    {"version": migration.version, "description": migration.description,
+                     "applied_at": time.time(), "seconds": time.perf_counter() - start}
+                )
+        except IntegrityError:
+            # Another worker applied it first
+            logger.info(f"Migration {migration.version} already applied elsewhere")
+            continue
+        logger.info(f"Applied migration {migration.version} ({migration.description}) "
+                    f"in {time.perf_counter() - start:.2f}s")
+        applied.append(migration.version)
+    return applied
+
+
+def status(engine) -> Dict[str, Any]:
+    done = applied_versions(engine)
+    return {
+        "applied": [done[version] for version in sorted(done)],
+        "pending": [migration.version for migration in MIGRATIONS if migration.version not in done],
+    }
+
+
+def sample_parameters(engine) -> Dict[str, Dict[str, Any]]:
+    """Parameters for each procedure query taken from an existing yield row, so plans reflect real lookups"""
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT area_id, item_id, year FROM yield ORDER BY year DESC LIMIT 1")).first()
+    area_id, item_id, year = row if row is not None else (1, 1, 2000)
+    return {
+        "CalculateItemYieldAverage": {"item_id": item_id},
+        "GetAreaEnvironmentStats": {"area_id": area_id},
+        "PredictYield": {"area_id": area_id, "item_id": item_id, "temp": 20.0, "rain": 1000.0, "pesticides": 100.0},
+        "FindTopProducingAreas": {"item_id": item_id, "year": year, "limit": 10},
+    }
+
+
+def explain(engine, query: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The database's plan for query: EXPLAIN QUERY PLAN on SQLite, EXPLAIN elsewhere"""
+    prefix = 'EXPLAIN QUERY PLAN' if engine.dialect.name == 'sqlite' else 'EXPLAIN'
+    with engine.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(text(f"{prefix} {query}"), params)]
+
+
+def explain_procedures(engine, params: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Plans of the SQL behind each /procedures/* endpoint (the stored procedures run the same statements)"""
+    from database_procedures import PROCEDURE_QUERIES
+    params = params or sample_parameters(engine)
+    return {name: explain(engine, query, params[name]) for name, query in PROCEDURE_QUERIES.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations")
+    parser.add_argument('command', choices=('migrate', 'status', 'explain'))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from db_schema_file import engine
+    if args.command == 'migrate':
+        print(json.dumps({"applied": migrate(engine)}, indent=2))
+    elif args.command == 'status':
+        print(json.dumps(status(engine), indent=2))
+    else:
+        print(json.dumps(explain_procedures(engine), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
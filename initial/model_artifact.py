@@ -0,0 +1,176 @@
+import gzip
+import logging
+import os
+import pickle
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from tree_engine import TREE_ENGINE_MAX_ROWS
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT_VERSION = 1
+DEFAULT_MODEL_PATH = 'best_model.pkl.gz'
+
+# Column order the model was trained on (matches yield_df.csv after encoding)
+FEATURE_COLUMNS = [
+    'average_rain_fall_mm_per_year',
+    'pesticides_tonnes',
+    'avg_temp',
+    'Item',
+    'Area',
+    'Year'
+]
+
+
+def freeze_codes(names) -> Dict[str, int]:
+    """Map each distinct name to the code LabelEncoder would give it (sorted order)"""
+    return {name: code for code, name in enumerate(sorted(set(names)))}
+
+
+class ModelArtifact:
+    """A trained estimator bundled with its feature schema and frozen category codes"""
+
+    def __init__(
+        self,
+        model,
+        version: str,
+        features: Optional[List[str]] = None,
+        area_codes: Optional[Dict[str, int]] = None,
+        item_codes: Optional[Dict[str, int]] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        self.model = model
+        self.version = version
+        self.features = list(features or FEATURE_COLUMNS)
+        self.area_codes = area_codes
+        self.item_codes = item_codes
+        self.metadata = metadata or {}
+        # Compiled tree evaluator set by the registry when serving (see tree_engine)
+        self.engine = None
+
+    @property
+    def is_legacy(self) -> bool:
+        """Legacy artifacts are bare estimators without frozen category codes"""
+        return self.area_codes is None or self.item_codes is None
+
+    def encode(self, area_name: str, item_name: str, all_areas=None, all_items=None):
+        """Return (encoded_area, encoded_item) for the given names.
+
+        Legacy artifacts fall back to fitting codes on the supplied name lists,
+        which only matches training if the lists have not changed since.
+        """
+        if self.is_legacy:
+            if all_areas is None or all_items is None:
+                raise ValueError("Legacy model needs all area and item names for encoding")
+            area_codes, item_codes = freeze_codes(all_areas), freeze_codes(all_items)
+        else:
+            area_codes, item_codes = self.area_codes, self.item_codes
+
+        if area_name not in area_codes:
+            raise ValueError(f"Area '{area_name}' was not seen when the model was trained")
+        if item_name not in item_codes:
+            raise ValueError(f"Item '{item_name}' was not seen when the model was trained")
+        return area_codes[area_name], item_codes[item_name]
+
+    def build_frame(self, rows: List[Dict[str, Any]]):
+        """Build a model input DataFrame from encoded feature dicts"""
+        import pandas as pd
+        return pd.DataFrame(rows, columns=self.features)
+
+    def build_input(self, rows: List[Dict[str, Any]]):
+        """Model input for predict_input: a float32 array for the compiled engine, else a DataFrame"""
+        if self.engine is not None and len(rows) <= TREE_ENGINE_MAX_ROWS:
+            return self.engine.as_input([[row[name] for name in self.features] for row in rows])
+        return self.build_frame(rows)
+
+    def input_from_array(self, X):
+        """Same as build_input for an already encoded (rows, features) array in `features` order"""
+        if self.engine is not None and len(X) <= TREE_ENGINE_MAX_ROWS:
+            return self.engine.as_input(X)
+        import pandas as pd
+        return pd.DataFrame(X, columns=self.features)
+
+    def predict_input(self, X):
+        if self.engine is not None and not hasattr(X, 'columns'):
+            return self.engine.predict(X)
+        return self.model.predict(X)
+
+    def predict(self, rows: List[Dict[str, Any]]):
+        return self.predict_input(self.build_input(rows))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format_version": ARTIFACT_FORMAT_VERSION,
+            "version": self.version,
+            "model": self.model,
+            "features": self.features,
+            "area_codes": self.area_codes,
+            "item_codes": self.item_codes,
+            "metadata": self.metadata
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        """JSON-safe summary of the artifact (everything but the estimator)"""
+        metadata = dict(self.metadata)
+        if "reference_profile" in metadata:
+            # Several KB of bin edges and shares; /drift reports against it in full
+            profile = metadata["reference_profile"]
+            metadata["reference_profile"] = {"id": profile.get("id"), "rows": profile.get("rows")}
+        return {
+            "version": self.version,
+            "estimator": type(self.model).__name__,
+            "features": self.features,
+            "legacy": self.is_legacy,
+            "areas": len(self.area_codes) if self.area_codes else None,
+            "items": len(self.item_codes) if self.item_codes else None,
+            "metadata": metadata
+        }
+
+
+def save_artifact(artifact: ModelArtifact, path: str, compress=3) -> str:
+    """Write the artifact; `.pkl.gz` paths use gzip pickle, anything else joblib.
+
+    For joblib, `compress` is passed through (e.g. 0, 3, ('lz4', 3)); use 0 to
+    produce a file that can be memory-mapped on load.
+    """
+    payload = artifact.to_dict()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if path.endswith('.pkl.gz'):
+        with gzip.open(path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        import joblib
+        joblib.dump(payload, path, compress=compress)
+    logger.info(f"Saved model artifact {artifact.version} to {path}")
+    return path
+
+
+def load_artifact(path: str = DEFAULT_MODEL_PATH, mmap_mode: Optional[str] = None) -> ModelArtifact:
+    """Load an artifact from disk, wrapping bare legacy estimators"""
+    if path.endswith('.pkl.gz'):
+        with gzip.open(path, 'rb') as f:
+            payload = pickle.load(f)
+    else:
+        import joblib
+        payload = joblib.load(path, mmap_mode=mmap_mode)
+
+    if isinstance(payload, dict) and "format_version" in payload:
+        if payload["format_version"] > ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported artifact format {payload['format_version']} in {path}")
+        return ModelArtifact(
+            model=payload["model"],
+            version=payload["version"],
+            features=payload.get("features"),
+            area_codes=payload.get("area_codes"),
+            item_codes=payload.get("item_codes"),
+            metadata=payload.get("metadata")
+        )
+
+    # Bare estimator pickled before artifacts existed
+    logger.warning(f"{path} holds a bare estimator; category codes will be refit from the database")
+    modified = datetime.utcfromtimestamp(os.path.getmtime(path)).strftime('%Y%m%dT%H%M%S')
+    return ModelArtifact(model=payload, version=f"legacy-{modified}")
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import random
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from model_artifact import DEFAULT_MODEL_PATH, ModelArtifact, load_artifact
+from tree_engine import compile_for_serving
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.getenv('MODELS_DIR', 'models')
+MANIFEST_NAME = 'manifest.json'
+POLL_INTERVAL = float(os.getenv('MODEL_POLL_INTERVAL', '10'))
+
+
+def read_manifest(models_dir: str = MODELS_DIR) -> Optional[Dict[str, Any]]:
+    path = os.path.join(models_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: Dict[str, Any], models_dir: str = MODELS_DIR):
+    """Atomically replace the manifest so watchers never see a half-written file"""
+    os.makedirs(models_dir, exist_ok=True)
+    path = os.path.join(models_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def publish(filename: str, role: str = 'active', traffic: float = None, models_dir: str = MODELS_DIR):
+    """Point the manifest's active or candidate slot at a file inside models_dir"""
+    if role not in ('active', 'candidate'):
+        raise ValueError(f"Unknown role {role}")
+    manifest = read_manifest(models_dir) or {}
+    manifest[role] = filename
+    if role == 'candidate':
+        manifest['candidate_traffic'] = traffic if traffic is not None else manifest.get('candidate_traffic', 0.0)
+    elif manifest.get('candidate') == filename:
+        # Promoting the candidate ends the experiment
+        manifest.pop('candidate', None)
+        manifest['candidate_traffic'] = 0.0
+    write_manifest(manifest, models_dir)
+
+
+def active_model_path(models_dir: str = MODELS_DIR, fallback_path: str = DEFAULT_MODEL_PATH) -> str:
+    """File the registry would serve as the active model"""
+    manifest = read_manifest(models_dir)
+    if manifest and manifest.get('active'):
+        return os.path.join(models_dir, manifest['active'])
+    return fallback_path
+
+
+class ModelRegistry:
+    """Keeps the active (and optional candidate) model loaded and hot-swaps new versions.
+
+    The registry reads models/manifest.json:
+        {"active": "rf-v2.joblib", "candidate": "rf-v3.joblib", "candidate_traffic": 0.1}
+    and falls back to best_model.pkl.gz (not tracked; see train_model.py --output)
+    when there is no manifest. A background thread polls for changes; new
+    artifacts are loaded off the request path and published with a single
+    reference assignment, so requests always see a consistent (active,
+    candidate, traffic) triple.
+    """
+
+    def __init__(self, models_dir: str = MODELS_DIR, fallback_path: str = DEFAULT_MODEL_PATH,
+                 poll_interval: float = POLL_INTERVAL):
+        self.models_dir = models_dir
+        self.fallback_path = fallback_path
+        self.poll_interval = poll_interval
+        self._state: Tuple[Optional[ModelArtifact], Optional[ModelArtifact], float] = (None, None, 0.0)
+        self._loaded: Dict[str, Tuple[float, ModelArtifact]] = {}
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    @property
+    def active(self) -> Optional[ModelArtifact]:
+        return self._state[0]
+
+    @property
+    def candidate(self) -> Optional[ModelArtifact]:
+        return self._state[1]
+
+    @property
+    def cached_models(self) -> int:
+        return len(self._loaded)
+
+    def _load_cached(self, path: str) -> ModelArtifact:
+        """Load path unless the same file (by mtime) is already in memory"""
+        mtime = os.path.getmtime(path)
+        cached = self._loaded.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        artifact = load_artifact(path)
+        try:
+            artifact.engine = compile_for_serving(artifact.model)
+        except Exception as e:
+            logger.warning(f"Could not compile {artifact.version} for the tree engine: {e}")
+        self._loaded[path] = (mtime, artifact)
+        logger.info(f"Loaded model {artifact.version} from {path}")
+        return artifact
+
+    def refresh(self) -> bool:
+        """Re-read the manifest and swap in any changed models. Returns True on success."""
+        with self._refresh_lock:
+            try:
+                manifest = read_manifest(self.models_dir)
+                if manifest and manifest.get('active'):
+                    active = self._load_cached(os.path.join(self.models_dir, manifest['active']))
+                    candidate = None
+                    if manifest.get('candidate'):
+                        candidate = self._load_cached(os.path.join(self.models_dir, manifest['candidate']))
+                    traffic = float(manifest.get('candidate_traffic', 0.0)) if candidate else 0.0
+                    wanted = {os.path.join(self.models_dir, name) for name in (manifest.get('active'), manifest.get('candidate')) if name}
+                else:
+                    active, candidate, traffic = self._load_cached(self.fallback_path), None, 0.0
+                    wanted = {self.fallback_path}
+
+                previous = self._state
+                self._state = (active, candidate, min(max(traffic, 0.0), 1.0))
+                # Drop artifacts no longer referenced so old versions can be freed
+                for path in list(self._loaded):
+                    if path not in wanted:
+                        del self._loaded[path]
+
+                if previous[0] is not active or previous[1] is not candidate:
+                    logger.info(f"Serving model {active.version}"
+                                + (f" with candidate {candidate.version} at {traffic:.0%}" if candidate else ""))
+                self.last_error = None
+                return True
+            except Exception as e:
+                # Keep serving whatever is already loaded
+                self.last_error = str(e)
+                logger.error(f"Model refresh failed: {e}")
+                return False
+
+    def choose(self) -> Tuple[Optional[ModelArtifact], str]:
+        """Pick the model for one request, routing candidate_traffic of requests to the candidate"""
+        if self._state[0] is None:
+            # Nothing loaded yet (startup load still running, or never started): load now
+            self.refresh()
+        active, candidate, traffic = self._state
+        if candidate is not None and random.random() < traffic:
+            return candidate, 'candidate'
+        return active, 'active'
+
+    def _watch(self):
+        # Initial load happens here, off the startup path
+        self.refresh()
+        while not self._stop.wait(self.poll_interval):
+            self.refresh()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='model-registry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval)
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        active, candidate, traffic = self._state
+        return {
+            "active": active.describe() if active else None,
+            "candidate": candidate.describe() if candidate else None,
+            "candidate_traffic": traffic,
+            "models_dir": self.models_dir,
+            "watching": self._thread is not None and self._thread.is_alive(),
+            "last_error": self.last_error
+        }
+
+
+# Global instance
+model_registry = ModelRegistry()
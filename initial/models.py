@@ -1,11 +1,22 @@
+from datetime import datetime
+from functools import lru_cache
 from typing import List, Optional
 from sqlmodel import Relationship, SQLModel, Field
 from enum import Enum
-import pycountry
 from pydantic import validator
 
-# For validation in request body
-countries: List[str] = [i.name for i in pycountry.countries] + ["Turkey"]
+# For validation in request body. Built on first use: importing pycountry and
+# walking its database is slow, and only writes of Areas need it.
+@lru_cache(maxsize=1)
+def get_countries() -> frozenset:
+    import pycountry
+    return frozenset([i.name for i in pycountry.countries] + ["Turkey"])
+
+def __getattr__(name):
+    # Keep `from models import countries` working without paying for it at import
+    if name == 'countries':
+        return sorted(get_countries())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 #For validation in query parameters
 # class Crops(str, Enum):
@@ -39,7 +50,7 @@ class Areas(SQLModel, table=True):
 
     @validator('area_name')
     def country_valid(cls, v):
-        if v not in countries:
+        if v not in get_countries():
             raise ValueError(f"{v} not in countries list")
         return v
 
@@ -80,4 +91,13 @@ class Yield(SQLModel, table=True):
     def validate_yield(cls, v):
         if v < 0:
             raise ValueError("Not nega")
-        return v
\ No newline at end of file
+        return v
+
+class Predictions(SQLModel, table=True):
+    # Filled offline by batch_scoring.py: one row per yield row per model version
+    area_id: int = Field(primary_key=True, foreign_key='areas.area_id')
+    item_id: int = Field(primary_key=True, foreign_key='items.item_id')
+    year: int = Field(primary_key=True)
+    model_version: str = Field(primary_key=True, max_length=100)
+    predicted_yield: float
+    scored_at: datetime
@@ -0,0 +1,266 @@
+"""Parallel ingestion of a yield dataset over several database connections.
+
+enter_data writes everything through one session in one transaction, so a
+large load waits on one connection's round trips. Here the validated dataset
+is split into one partition per area. Partitions never share primary key
+ranges and only reference already committed items/areas, so they do not
+contend. INGEST_WORKERS threads each take partitions off a shared queue and
+write them over their own pooled connection, INGEST_CHUNK_ROWS rows per
+transaction. The default pool holds 15 connections (5 + 10 overflow); workers
+beyond that wait for a connection.
+
+Each chunk commits together with its partition's checkpoint in
+`ingest_checkpoints`. A rerun of the same dataset (the run id is a hash of
+the validated rows) continues from the last committed chunk. Afterwards the
+row counts per area are compared with the dataset.
+
+    python parallel_ingest.py [source] [--workers 4] [--chunk-rows 1000]
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '4'))
+INGEST_CHUNK_ROWS = int(os.getenv('INGEST_CHUNK_ROWS', '1000'))
+# Tables written per partition, in order, with the checkpoint column counting their rows
+PARTITION_TABLES = (('environment', 'environment_rows'), ('yield', 'yield_rows'))
+
+
+class Partition(NamedTuple):
+    area_id: int
+    rows: Dict[str, List[Dict[str, Any]]]
+
+    @property
+    def size(self) -> int:
+        return sum(len(rows) for rows in self.rows.values())
+
+
+def run_id_for(data, env_data) -> str:
+    """Stable id of a validated dataset, so a rerun of the same load resumes its checkpoints"""
+    import pandas as pd
+    digest = hashlib.sha1()
+    for frame, keys in ((data, ['Area', 'Item', 'Year']), (env_data, ['Area', 'Year'])):
+        ordered = frame.sort_values(keys).reset_index(drop=True)
+        digest.update(pd.util.hash_pandas_object(ordered, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def _ensure_checkpoint_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS ingest_checkpoints ("
+            "run_id VARCHAR(40) NOT NULL, area_id INTEGER NOT NULL, "
+            "environment_rows INTEGER NOT NULL DEFAULT 0, yield_rows INTEGER NOT NULL DEFAULT 0, "
+            "finished_at DOUBLE PRECISION, PRIMARY KEY (run_id, area_id))"
+        ))
+
+
+def _ids_by_name(conn, table: str, id_column: str, name_column: str, names) -> Dict[str, int]:
+    """Name -> id for `names`, inserting the ones not in the table yet"""
+    existing = {name: id_ for id_, name in conn.execute(text(f"SELECT {id_column}, {name_column} FROM {table}"))}
+    missing = [{"name": name} for name in names if name not in existing]
+    if missing:
+        conn.execute(text(f"INSERT INTO {table} ({name_column}) VALUES (:name)"), missing)
+        existing = {name: id_ for id_, name in conn.execute(text(f"SELECT {id_column}, {name_column} FROM {table}"))}
+    return {name: existing[name] for name in names}
+
+
+def build_partitions(data, env_data, area_ids: Dict[str, int], item_ids: Dict[str, int]) -> List[Partition]:
+    """One partition per area, rows in primary key order so a checkpoint offset always means the same rows"""
+    env = env_data.assign(area_id=env_data['Area'].map(area_ids)).sort_values(['area_id', 'Year'])
+    yields = data.assign(area_id=data['Area'].map(area_ids), item_id=data['Item'].map(item_ids)) \
+        .sort_values(['area_id', 'item_id', 'Year'])
+    env_rows = env.rename(columns={
+        'Year': 'year', 'average_rain_fall_mm_per_year': 'average_rai',
+        'pesticides_tonnes': 'pesticides_tavg', 'avg_temp': 'temp'
+    })[['area_id', 'year', 'average_rai', 'pesticides_tavg', 'temp']]
+    yield_rows = yields.rename(columns={'Year': 'year', 'hg/ha_yield': 'hg_per_ha_yield'})[
+        ['area_id', 'item_id', 'year', 'hg_per_ha_yield']]
+
+    def records(frame):
+        # Plain Python scalars: DB drivers do not all accept numpy types
+        return {int(area_id): group.astype(object).to_dict('records') for area_id, group in frame.groupby('area_id')}
+
+    env_by_area, yield_by_area = records(env_rows), records(yield_rows)
+    return [
+        Partition(area_id, {'environment': env_by_area.get(area_id, []), 'yield': yield_by_area.get(area_id, [])})
+        for area_id in sorted(set(env_by_area) | set(yield_by_area))
+    ]
+
+
+class WorkerStats:
+    def __init__(self):
+        self.partitions = 0
+        self.rows = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "partitions": self.partitions,
+            "rows": self.rows,
+            "chunks": self.chunks,
+            "seconds": self.seconds,
+            "rows_per_second": self.rows / self.seconds if self.seconds else 0.0,
+        }
+
+
+def write_partition(engine, run_id: str, partition: Partition, done: Dict[str, int], chunk_rows: int,
+                    stats: WorkerStats):
+    """Write the rows of partition after its checkpoint, one transaction per chunk"""
+    from sqlmodel import SQLModel
+    start = time.perf_counter()
+    for table, column in PARTITION_TABLES:
+        rows = partition.rows[table]
+        insert = SQLModel.metadata.tables[table].insert()
+        checkpoint = text(f"UPDATE ingest_checkpoints SET {column} = :rows "
+                          "WHERE run_id = :run_id AND area_id = :area_id")
+        for offset in range(done[column], len(rows), chunk_rows):
+            chunk = rows[offset:offset + chunk_rows]
+            with engine.begin() as conn:
+                conn.execute(insert, chunk)
+                conn.execute(checkpoint, {"rows": offset + len(chunk), "run_id": run_id,
+                                          "area_id": partition.area_id})
+            stats.rows += len(chunk)
+            stats.chunks += 1
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE ingest_checkpoints SET finished_at = :now "
+                          "WHERE run_id = :run_id AND area_id = :area_id"),
+                     {"now": time.time(), "run_id": run_id, "area_id": partition.area_id})
+    stats.partitions += 1
+    stats.seconds += time.perf_counter() - start
+
+
+def check_counts(engine, partitions: List[Partition]) -> Dict[str, Any]:
+    """Compare per-area row counts in the database with the dataset's"""
+    mismatches = []
+    totals = {}
+    with engine.connect() as conn:
+        for table, _ in PARTITION_TABLES:
+            counts = dict(conn.execute(text(f"SELECT area_id, COUNT(*) FROM {table} GROUP BY area_id")).fetchall())
+            expected = {partition.area_id: len(partition.rows[table]) for partition in partitions}
+            for area_id, rows in expected.items():
+                if counts.get(area_id, 0) != rows:
+                    mismatches.append({"table": table, "area_id": area_id, "expected": rows,
+                                       "found": counts.get(area_id, 0)})
+            totals[table] = {"expected": sum(expected.values()),
+                             "found": sum(counts.get(area_id, 0) for area_id in expected)}
+    return {"consistent": not mismatches, "totals": totals, "mismatches": mismatches}
+
+
+def ingest_parallel(data=None, source: Optional[str] = None, engine=None, workers: int = INGEST_WORKERS,
+                    chunk_rows: int = INGEST_CHUNK_ROWS) -> Dict[str, Any]:
+    """Validate data (default: load `source`), write it across `workers` connections and verify the counts"""
+    from sqlmodel import Session
+    from data_proces_file import DEFAULT_SOURCE, is_data_inserted, load_data, prepare_data
+    from table_versions import table_versions
+    if engine is None:
+        from db_schema_file import engine
+    if data is None:
+        data = load_data(source or DEFAULT_SOURCE)
+    data, env_data = prepare_data(data)
+    run_id = run_id_for(data, env_data)
+    _ensure_checkpoint_table(engine)
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        checkpoints = {
+            row.area_id: dict(row._mapping) for row in conn.execute(
+                text("SELECT area_id, environment_rows, yield_rows, finished_at FROM ingest_checkpoints "
+                     "WHERE run_id = :run_id"), {"run_id": run_id})
+        }
+        if not checkpoints:
+            with Session(bind=conn) as session:
+                if is_data_inserted(session):
+                    logger.info("Data already inserted")
+                    return {"run_id": run_id, "skipped": "Data already inserted"}
+        # Items, areas and the checkpoints commit together, so a resumed run finds all three
+        item_ids = _ids_by_name(conn, 'items', 'item_id', 'item_name', list(data['Item'].unique()))
+        area_ids = _ids_by_name(conn, 'areas', 'area_id', 'area_name', list(data['Area'].unique()))
+        partitions = build_partitions(data, env_data, area_ids, item_ids)
+        new = [{"run_id": run_id, "area_id": partition.area_id}
+               for partition in partitions if partition.area_id not in checkpoints]
+        if new:
+            conn.execute(text("INSERT INTO ingest_checkpoints (run_id, area_id) VALUES (:run_id, :area_id)"), new)
+    for row in new:
+        checkpoints[row["area_id"]] = {"environment_rows": 0, "yield_rows": 0, "finished_at": None}
+
+    pending = [partition for partition in partitions if checkpoints[partition.area_id]["finished_at"] is None]
+    # Largest partitions first so no worker is left with a big one at the end
+    pending.sort(key=lambda partition: partition.size, reverse=True)
+    stats: Dict[str, WorkerStats] = {}
+    stats_lock = threading.Lock()
+
+    def run(partition: Partition):
+        name = threading.current_thread().name
+        with stats_lock:
+            worker = stats.setdefault(name, WorkerStats())
+        write_partition(engine, run_id, partition, checkpoints[partition.area_id], chunk_rows, worker)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as pool:
+            # list() re-raises the first failure; finished chunks stay checkpointed for the rerun
+            list(pool.map(run, pending))
+    finally:
+        # Committed chunks (and new items/areas) are visible even if a partition failed
+        if new or any(worker.chunks for worker in stats.values()):
+            table_versions.bump('items', 'areas', 'environment', 'yield')
+    seconds = time.perf_counter() - start
+
+    rows = sum(worker.rows for worker in stats.values())
+    report = {
+        "run_id": run_id,
+        "workers": workers,
+        "chunk_rows": chunk_rows,
+        "partitions": len(partitions),
+        "resumed_partitions": sum(1 for partition in pending if any(
+            checkpoints[partition.area_id][column] for _, column in PARTITION_TABLES)),
+        "skipped_partitions": len(partitions) - len(pending),
+        "rows_written": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+        "per_worker": {name: worker.to_dict() for name, worker in sorted(stats.items())},
+        "consistency": check_counts(engine, partitions),
+    }
+    logger.info(f"Ingested {rows} rows in {len(pending)} partitions with {workers} workers in {seconds:.2f}s "
+                f"({report['rows_per_second']:.0f} rows/s)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel partitioned ingestion")
+    parser.add_argument('source', nargs='?', default=None, help="CSV, Parquet or Arrow dataset")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS)
+    parser.add_argument('--chunk-rows', type=int, default=INGEST_CHUNK_ROWS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from db_schema_file import engine
+    from table_versions import table_versions
+    # Bump the shared table versions so running API workers drop their ETags
+    table_versions.attach(engine)
+    # prepare_data prints its progress; stdout carries only the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = ingest_parallel(source=args.source, engine=engine, workers=args.workers,
+                                 chunk_rows=args.chunk_rows)
+    print(json.dumps(report, indent=2))
+    if not report.get("consistency", {"consistent": True})["consistent"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
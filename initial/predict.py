@@ -1,121 +1,180 @@
-import requests
-import gzip
-import pickle
-import pandas as pd
-import numpy as np
-from sklearn.preprocessing import LabelEncoder
+"""Client library and CLI for the yield prediction API.
 
-# Base URL of the FastAPI app
-BASE_URL = "http://127.0.0.1:8000"
+    python predict.py                         # predict for the latest environment row and item
+    python predict.py --rows rows.csv         # score many rows (area_id,item_id,year[,temp,rain,pesticides])
+    python predict.py --all-items --year 2013 # every item in every area for one recorded year
 
-# Load the trained model
-with gzip.open('best_model.pkl.gz', 'rb') as f:
-    model = pickle.load(f)
+All requests go through one pooled keep-alive connection set, with at most
+`concurrency` requests in flight. Scoring is done by the server in batches
+(`POST /predict/ml/batch`), so the client needs no model or encoders. For
+tests, pass an in-process transport:
 
-def fetch_latest_environment():
-    try:
-        response = requests.get(f"{BASE_URL}/environment/latest")
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Error fetching latest environment: {e}")
-        return None
+    client = YieldClient(transport=httpx.ASGITransport(app=main.app))
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional
 
-def fetch_area_name(area_id):
-    try:
-        response = requests.get(f"{BASE_URL}/areas/{area_id}")
-        response.raise_for_status()
-        return response.json().get("area_name")
-    except requests.RequestException as e:
-        print(f"Error fetching area {area_id}: {e}")
-        return None
+import httpx
 
-def fetch_all_areas():
-    try:
-        response = requests.get(f"{BASE_URL}/areas")
+# Base URL of the FastAPI app
+BASE_URL = os.getenv('YIELD_API_URL', "http://127.0.0.1:8000")
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 30.0
+
+
+class YieldClient:
+    """Async client for the prediction API with cached reference data"""
+
+    def __init__(self, base_url: str = BASE_URL, concurrency: int = DEFAULT_CONCURRENCY,
+                 timeout: float = DEFAULT_TIMEOUT, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            transport=transport,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            headers={"Accept-Encoding": "gzip"}
+        )
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._areas: Optional[Dict[int, str]] = None
+        self._items: Optional[Dict[int, str]] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        async with self._semaphore:
+            response = await self._http.request(method, path, **kwargs)
         response.raise_for_status()
-        return [area["area_name"] for area in response.json()]
-    except requests.RequestException as e:
-        print(f"Error fetching areas: {e}")
-        return []
+        return response.json()
 
-def fetch_all_items():
-    try:
-        response = requests.get(f"{BASE_URL}/items")
-        response.raise_for_status()
-        return [item["item_name"] for item in response.json()]
-    except requests.RequestException as e:
-        print(f"Error fetching items: {e}")
-        return []
+    async def areas(self) -> Dict[int, str]:
+        """area_id -> area_name, fetched once per client"""
+        if self._areas is None:
+            self._areas = {row["area_id"]: row["area_name"] for row in await self._request('GET', '/areas')}
+        return self._areas
+
+    async def items(self) -> Dict[int, str]:
+        """item_id -> item_name, fetched once per client"""
+        if self._items is None:
+            self._items = {row["item_id"]: row["item_name"] for row in await self._request('GET', '/items')}
+        return self._items
+
+    async def environment(self) -> List[Dict[str, Any]]:
+        return await self._request('GET', '/environment')
+
+    async def latest_environment(self) -> Dict[str, Any]:
+        return await self._request('GET', '/environment/latest')
+
+    async def latest_item(self) -> Dict[str, Any]:
+        return await self._request('GET', '/items/latest')
+
+    async def predict(self, area_id: int, item_id: int, year: int, temp: float = None,
+                      rain: float = None, pesticides: float = None) -> Dict[str, Any]:
+        """One prediction; omitted environment values are filled by the server"""
+        params = {"area_id": area_id, "item_id": item_id, "year": year}
+        for name, value in (("temp", temp), ("rain", rain), ("pesticides", pesticides)):
+            if value is not None:
+                params[name] = value
+        return await self._request('POST', '/predict/ml', params=params)
+
+    async def predict_many(self, rows: Iterable[Dict[str, Any]],
+                           batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, List[Dict[str, Any]]]:
+        """Score rows in batches of batch_size, running up to `concurrency` batches at once.
+
+        Returns {"predictions": [...], "errors": [...]} with `index` referring to
+        the position in `rows`.
+        """
+        rows = list(rows)
+        batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+        responses = await asyncio.gather(*(
+            self._request('POST', '/predict/ml/batch', json={"rows": batch}) for batch in batches
+        ))
+        predictions, errors = [], []
+        for offset, response in zip(range(0, len(rows), batch_size), responses):
+            for prediction in response["predictions"]:
+                prediction["index"] += offset
+                predictions.append(prediction)
+            for error in response["errors"]:
+                error["index"] += offset
+                errors.append(error)
+        return {"predictions": predictions, "errors": errors}
+
+
+def read_rows(path: str) -> List[Dict[str, Any]]:
+    """Rows to score from a CSV with area_id,item_id,year and optional temp,rain,pesticides"""
+    rows = []
+    with open(path, newline='') as f:
+        for record in csv.DictReader(f):
+            row = {"area_id": int(record["area_id"]), "item_id": int(record["item_id"]), "year": int(record["year"])}
+            for name in ("temp", "rain", "pesticides"):
+                if record.get(name) not in (None, ''):
+                    row[name] = float(record[name])
+            rows.append(row)
+    return rows
+
+
+async def predict_latest(client: YieldClient):
+    """The original predict.py flow: latest environment row with the latest item"""
+    env_data, item = await asyncio.gather(client.latest_environment(), client.latest_item())
+    result = await client.predict(
+        env_data["area_id"], item["item_id"], env_data["year"],
+        temp=env_data["temp"], rain=env_data["average_rai"], pesticides=env_data["pesticides_tavg"]
+    )
+    print(f"Preparing prediction for {result['area_name']}, {result['item_name']}, {result['year']}")
+    print(f"Predicted hg/ha_yield: {result['predicted_yield_hg_per_ha']}")
+
+
+async def run(args):
+    async with YieldClient(args.base_url, concurrency=args.concurrency) as client:
+        if args.rows is None and not args.all_items:
+            await predict_latest(client)
+            return
+
+        if args.rows is not None:
+            rows = read_rows(args.rows)
+        else:
+            environment, items = await asyncio.gather(client.environment(), client.items())
+            rows = [
+                {"area_id": env["area_id"], "item_id": item_id, "year": env["year"]}
+                for env in environment if args.year is None or env["year"] == args.year
+                for item_id in items
+            ]
+        result = await client.predict_many(rows, batch_size=args.batch_size)
+        if args.output is None:
+            json.dump(result, sys.stdout, indent=2)
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+        print(f"\nScored {len(result['predictions'])} rows, {len(result['errors'])} errors", file=sys.stderr)
 
-def fetch_latest_item():
-    try:
-        response = requests.get(f"{BASE_URL}/items/latest")
-        response.raise_for_status()
-        return response.json().get("item_name")
-    except requests.RequestException as e:
-        print(f"Error fetching latest item: {e}")
-        return None
 
 def main():
-    # Fetch the latest environment entry
-    env_data = fetch_latest_environment()
-    if not env_data:
-        print("Failed to fetch latest environment data")
-        return
-
-    # Extract data
-    area_id = env_data.get("area_id")
-    year = env_data.get("year")
-    average_rai = env_data.get("average_rai")
-    pesticides_tavg = env_data.get("pesticides_tavg")
-    temp = env_data.get("temp")
-
-    # Fetch area_name
-    area_name = fetch_area_name(area_id)
-    if not area_name:
-        print("Failed to fetch area_name")
-        return
-
-    # Fetch all areas and items for encoding
-    all_areas = fetch_all_areas()
-    all_items = fetch_all_items()
-    if not all_areas or not all_items:
-        print("Failed to fetch areas or items for encoding")
-        return
-
-    # Fetch the latest item
-    item_name = fetch_latest_item()
-    if not item_name:
-        print("Failed to fetch latest item")
-        return
-
-    # Create label encoders
-    area_encoder = LabelEncoder().fit(all_areas)
-    item_encoder = LabelEncoder().fit(all_items)
-
-    # Encode categorical features
-    encoded_area = area_encoder.transform([area_name])[0]
-    encoded_item = item_encoder.transform([item_name])[0]
-
-    # Prepare input for model with correct feature order
-    input_data = pd.DataFrame([{
-        'average_rain_fall_mm_per_year': average_rai,
-        'pesticides_tonnes': pesticides_tavg,
-        'avg_temp': temp,
-        'Item': encoded_item,
-        'Area': encoded_area,
-        'Year': year
-    }])
-
-    # Make prediction
+    parser = argparse.ArgumentParser(description="Yield prediction API client")
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--rows', default=None, help="CSV of rows to score")
+    parser.add_argument('--all-items', action='store_true', help="Score every item for each environment row")
+    parser.add_argument('--year', type=int, default=None, help="With --all-items, only this year")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--output', default=None, help="Write results as JSON here instead of stdout")
+    args = parser.parse_args()
     try:
-        prediction = model.predict(input_data)[0]
-        fetch_latest_item()
-        print(f"Preparing prediction for {area_name}, {item_name}, {year}")
-        print(f"Predicted hg/ha_yield: {float(prediction)}")
-    except Exception as e:
-        print(f"Prediction failed: {e}")
+        asyncio.run(run(args))
+    except httpx.HTTPError as e:
+        print(f"Request failed: {e}")
+
 
 if __name__ == "__main__":
     main()
@@ -1,35 +1,137 @@
 from dotenv import load_dotenv
 import os
-from pymongo import MongoClient
-from datetime import datetime
-from typing import Dict, Any
+import threading
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Sequence
 import logging
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Keep per-day rollups up to date as predictions are logged
+ROLLUPS_ENABLED = os.getenv('PREDICTION_ROLLUPS', 'true').lower() == 'true'
+
+# Groupings accepted by get_prediction_stats, as rollup/document field names
+STATS_GROUPS = {
+    'day': ('day',),
+    'area': ('area_id',),
+    'item': ('item_id',),
+    'area_item': ('area_id', 'item_id'),
+    'area_item_day': ('area_id', 'item_id', 'day'),
+    'model': ('model_used',),
+    'model_day': ('model_used', 'day'),
+}
+ROLLUP_KEY = ('day', 'area_id', 'item_id', 'model_used')
+PREDICTED_FIELD = 'predicted_yield_hg_per_ha'
+
 class PredictionLogger:
+    """Logs predictions to MongoDB.
+
+    The client is created on first use (or by connect() from a startup hook),
+    so importing this module neither imports pymongo nor waits on the network.
+    """
+
     def __init__(self):
-        try:
-            mongo_url = os.getenv('MONGO_URL')
-            if not mongo_url:
-                logger.warning("MONGO_URL not found in environment variables")
+        self.client = None
+        self.db = None
+        self._predictions_collection = None
+        self._rollups_collection = None
+        self._connected = False
+        self._connect_lock = threading.Lock()
+
+    @property
+    def predictions_collection(self):
+        if not self._connected:
+            self.connect()
+        return self._predictions_collection
+
+    def connect(self):
+        """Connect once; later calls are no-ops even if the first attempt failed"""
+        with self._connect_lock:
+            if self._connected:
+                return
+            try:
+                mongo_url = os.getenv('MONGO_URL')
+                if not mongo_url:
+                    logger.warning("MONGO_URL not found in environment variables")
+                    return
+
+                from pymongo import MongoClient
+                client = MongoClient(mongo_url)
+                # Test the connection
+                client.admin.command('ismaster')
+                self.use_client(client)
+                logger.info("MongoDB connection established for prediction logging")
+            except Exception as e:
+                logger.warning(f"Failed to connect to MongoDB: {e}")
                 self.client = None
                 self.db = None
-                self.predictions_collection = None
-                return
-                
-            self.client = MongoClient(mongo_url)
-            # Test the connection
-            self.client.admin.command('ismaster')
-            self.db = self.client['agri-yield']
-            self.predictions_collection = self.db.predictions
-            logger.info("MongoDB connection established for prediction logging")
+                self._predictions_collection = None
+                self._rollups_collection = None
+            finally:
+                self._connected = True
+
+    def use_client(self, client):
+        """Log through an existing client (e.g. mongomock in benchmarks)"""
+        self.client = client
+        self.db = client['agri-yield']
+        self._predictions_collection = self.db.predictions
+        self._rollups_collection = self.db.prediction_rollups
+        self._connected = True
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        """Indexes behind history, stats and rollup upserts; create_index is a no-op when they exist"""
+        try:
+            self._predictions_collection.create_index([("timestamp", -1)])
+            self._predictions_collection.create_index([("area_id", 1), ("item_id", 1), ("timestamp", -1)])
+            self._predictions_collection.create_index([("model_used", 1), ("timestamp", -1)])
+            self._rollups_collection.create_index([(field, 1) for field in ROLLUP_KEY], unique=True)
+            self._rollups_collection.create_index([("model_used", 1), ("day", 1)])
+        except Exception as e:
+            logger.warning(f"Failed to create prediction indexes: {e}")
+
+    def _update_rollups(self, entries: Sequence[Dict[str, Any]]):
+        """Fold logged entries into per (day, area, item, model) counters with one bulk upsert"""
+        from pymongo import UpdateOne
+        totals = defaultdict(lambda: [0, 0.0, None, None])
+        for entry in entries:
+            predicted = entry.get(PREDICTED_FIELD)
+            if predicted is None:
+                continue
+            key = (entry["timestamp"].strftime('%Y-%m-%d'), entry.get("area_id"), entry.get("item_id"),
+                   entry.get("model_used"))
+            total = totals[key]
+            total[0] += 1
+            total[1] += predicted
+            total[2] = predicted if total[2] is None else min(total[2], predicted)
+            total[3] = predicted if total[3] is None else max(total[3], predicted)
+        if not totals:
+            return
+        updated_at = datetime.utcnow()
+        self._rollups_collection.bulk_write([
+            UpdateOne(
+                dict(zip(ROLLUP_KEY, key)),
+                {
+                    "$inc": {"count": count, "sum_predicted": total},
+                    "$min": {"min_predicted": low},
+                    "$max": {"max_predicted": high},
+                    "$set": {"updated_at": updated_at}
+                },
+                upsert=True
+            )
+            for key, (count, total, low, high) in totals.items()
+        ], ordered=False)
+
+    def _record_rollups(self, entries: Sequence[Dict[str, Any]]):
+        if not ROLLUPS_ENABLED or self._rollups_collection is None:
+            return
+        try:
+            self._update_rollups(entries)
         except Exception as e:
-            logger.warning(f"Failed to connect to MongoDB: {e}")
-            self.client = None
-            self.db = None
-            self.predictions_collection = None
+            # The raw log is the source of truth; rebuild_rollups() repairs drift
+            logger.warning(f"Failed to update prediction rollups: {e}")
     
     def log_prediction(self, prediction_data: Dict[str, Any]) -> bool:
         """Log prediction to MongoDB"""
@@ -45,12 +147,33 @@ class PredictionLogger:
             
             result = self.predictions_collection.insert_one(log_entry)
             logger.info(f"Prediction logged with ID: {result.inserted_id}")
+            self._record_rollups([log_entry])
             return True
             
         except Exception as e:
             logger.error(f"Failed to log prediction: {e}")
             return False
     
+    def log_predictions(self, predictions: List[Dict[str, Any]]) -> int:
+        """Log many predictions with one insert; returns how many were written"""
+        if self.predictions_collection is None or not predictions:
+            return 0
+
+        try:
+            timestamp = datetime.utcnow()
+            entries = [
+                {**prediction, "timestamp": timestamp, "prediction_type": prediction.get("model_used", "unknown")}
+                for prediction in predictions
+            ]
+            result = self.predictions_collection.insert_many(entries, ordered=False)
+            self._record_rollups(entries)
+            # insert_many adds _id to the dicts it was given, not to `predictions`
+            return len(result.inserted_ids)
+
+        except Exception as e:
+            logger.error(f"Failed to log predictions: {e}")
+            return 0
+    
     def get_prediction_history(self, area_id: int = None, item_id: int = None, limit: int = 100):
         """Retrieve prediction history from MongoDB"""
         if self.predictions_collection is None:
@@ -75,10 +198,178 @@ class PredictionLogger:
             logger.error(f"Failed to retrieve prediction history: {e}")
             return []
     
+    def get_prediction_stats(self, group_by: str = 'area_item_day', area_id: int = None, item_id: int = None,
+                             model: str = None, start: Optional[date] = None, end: Optional[date] = None,
+                             source: str = 'rollup', limit: int = 1000) -> List[Dict[str, Any]]:
+        """Count/avg/min/max predicted yield per group, computed by MongoDB.
+
+        source='rollup' reads the per-day rollup collection (fast, day granularity);
+        source='raw' aggregates the prediction log itself. `start`/`end` are
+        inclusive UTC dates.
+        """
+        if group_by not in STATS_GROUPS:
+            raise ValueError(f"Unknown group_by {group_by}; use one of {', '.join(STATS_GROUPS)}")
+        if source not in ('rollup', 'raw'):
+            raise ValueError("source must be 'rollup' or 'raw'")
+        # Touching predictions_collection connects on first use
+        raw = self.predictions_collection
+        collection = self._rollups_collection if source == 'rollup' else raw
+        if collection is None:
+            return []
+
+        fields = STATS_GROUPS[group_by]
+        match = self._stats_match(area_id, item_id, model, start, end, rollup=source == 'rollup')
+        if source == 'rollup':
+            group_id = {field: f"${field}" for field in fields}
+            accumulators = {
+                "count": {"$sum": "$count"},
+                "sum": {"$sum": "$sum_predicted"},
+                "min": {"$min": "$min_predicted"},
+                "max": {"$max": "$max_predicted"},
+            }
+        else:
+            group_id = {
+                field: {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}} if field == 'day' else f"${field}"
+                for field in fields
+            }
+            accumulators = {
+                "count": {"$sum": 1},
+                "sum": {"$sum": f"${PREDICTED_FIELD}"},
+                "min": {"$min": f"${PREDICTED_FIELD}"},
+                "max": {"$max": f"${PREDICTED_FIELD}"},
+            }
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": group_id, **accumulators}},
+            {"$sort": {f"_id.{field}": 1 for field in fields}},
+            {"$limit": limit},
+            {"$project": {
+                "_id": 0,
+                **{field: f"$_id.{field}" for field in fields},
+                "count": 1,
+                "avg_predicted": {"$cond": [{"$gt": ["$count", 0]}, {"$divide": ["$sum", "$count"]}, None]},
+                "min_predicted": "$min",
+                "max_predicted": "$max",
+            }},
+        ]
+        return list(collection.aggregate(pipeline))
+
+    def get_prediction_distribution(self, boundaries: Sequence[float], area_id: int = None, item_id: int = None,
+                                    model: str = None, start: Optional[date] = None,
+                                    end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Histogram of predicted yields over `boundaries` ($bucket on the raw log)"""
+        if self.predictions_collection is None:
+            return []
+        pipeline = [
+            {"$match": {
+                **self._stats_match(area_id, item_id, model, start, end, rollup=False),
+                PREDICTED_FIELD: {"$type": "number"}
+            }},
+            {"$bucket": {
+                "groupBy": f"${PREDICTED_FIELD}",
+                "boundaries": list(boundaries),
+                # Everything at or above the last boundary
+                "default": "overflow",
+                "output": {"count": {"$sum": 1}, "avg_predicted": {"$avg": f"${PREDICTED_FIELD}"}}
+            }},
+        ]
+        buckets = []
+        for bucket in self.predictions_collection.aggregate(pipeline):
+            lower = bucket.pop("_id")
+            buckets.append({"lower_bound": lower, **bucket})
+        return buckets
+
+    @staticmethod
+    def _stats_match(area_id, item_id, model, start, end, rollup: bool) -> Dict[str, Any]:
+        match: Dict[str, Any] = {}
+        if area_id is not None:
+            match["area_id"] = area_id
+        if item_id is not None:
+            match["item_id"] = item_id
+        if model is not None:
+            match["model_used"] = model
+        if start is not None or end is not None:
+            if rollup:
+                match["day"] = {
+                    **({"$gte": start.isoformat()} if start else {}),
+                    **({"$lte": end.isoformat()} if end else {})
+                }
+            else:
+                match["timestamp"] = {
+                    **({"$gte": datetime.combine(start, time.min)} if start else {}),
+                    **({"$lt": datetime.combine(end + timedelta(days=1), time.min)} if end else {})
+                }
+        return match
+
+    def refresh_rollups(self, start: Optional[date] = None, end: Optional[date] = None):
+        """Recompute rollups for UTC days in [start, end) from the raw log, server-side ($merge, MongoDB 4.2+)"""
+        if self.predictions_collection is None:
+            return
+        day_range: Dict[str, Any] = {}
+        time_range: Dict[str, Any] = {}
+        if start is not None:
+            day_range["$gte"] = start.isoformat()
+            time_range["$gte"] = datetime.combine(start, time.min)
+        if end is not None:
+            day_range["$lt"] = end.isoformat()
+            time_range["$lt"] = datetime.combine(end, time.min)
+        # Compacted days (raw documents archived and deleted) are never recomputed
+        self._rollups_collection.delete_many({"compacted": {"$ne": True}, **({"day": day_range} if day_range else {})})
+        match: Dict[str, Any] = {PREDICTED_FIELD: {"$type": "number"}}
+        if time_range:
+            match["timestamp"] = time_range
+        self.predictions_collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                    "area_id": "$area_id",
+                    "item_id": "$item_id",
+                    "model_used": "$model_used"
+                },
+                "count": {"$sum": 1},
+                "sum_predicted": {"$sum": f"${PREDICTED_FIELD}"},
+                "min_predicted": {"$min": f"${PREDICTED_FIELD}"},
+                "max_predicted": {"$max": f"${PREDICTED_FIELD}"},
+            }},
+            {"$project": {
+                "_id": 0,
+                **{field: f"$_id.{field}" for field in ROLLUP_KEY},
+                "count": 1, "sum_predicted": 1, "min_predicted": 1, "max_predicted": 1,
+                "updated_at": "$$NOW"
+            }},
+            {"$merge": {
+                "into": self._rollups_collection.name,
+                "on": list(ROLLUP_KEY),
+                "whenMatched": [{"$replaceWith": {"$cond": [{"$eq": ["$compacted", True]}, "$$ROOT", "$$new"]}}]
+            }},
+        ], allowDiskUse=True)
+
+    def mark_compacted(self, day: date):
+        """Freeze a day's rollups once its raw documents are being archived and deleted"""
+        self._rollups_collection.update_many({"day": day.isoformat()}, {"$set": {"compacted": True}})
+
+    def rebuild_rollups(self):
+        """Recompute rollups for every day still in the raw log.
+
+        Rollups of days compacted by prediction_retention.py are kept as they
+        are, since their raw documents have been archived and deleted.
+        """
+        if self.predictions_collection is None:
+            return
+        oldest = self.predictions_collection.find_one({}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        if oldest is None:
+            return
+        self.refresh_rollups(start=oldest["timestamp"].date())
+
     def close(self):
         """Close MongoDB connection"""
         if self.client:
             self.client.close()
+        self.client = None
+        self.db = None
+        self._predictions_collection = None
+        self._rollups_collection = None
 
 # Global instance
 prediction_logger = PredictionLogger()
@@ -0,0 +1,224 @@
+"""Retention for the MongoDB prediction log.
+
+Usage: python prediction_retention.py [--days 90] [--format ndjson|parquet] [--archive-dir archive]
+       python prediction_retention.py restore archive/predictions/2026/01/predictions-2026-01-31.ndjson.gz
+
+Every UTC day older than --days is handled on its own, oldest first:
+  1. its daily aggregates per (area_id, item_id, model) are recomputed in
+     prediction_rollups;
+  2. its raw documents are streamed to a compressed archive file, written
+     under a temporary name and renamed once complete;
+  3. the day's rollups are marked compacted, so later rebuilds keep them;
+  4. the archived documents are deleted from the hot collection in batches.
+If a run stops part way, the next run finds the day's archive file and only
+marks the rollups and finishes the deletes.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import time as clock
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from prediction_logger import PredictionLogger, prediction_logger
+from serialization import dumps
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.getenv('PREDICTION_RETENTION_DAYS', '90'))
+ARCHIVE_DIR = os.getenv('PREDICTION_ARCHIVE_DIR', 'archive')
+DELETE_BATCH_SIZE = int(os.getenv('PREDICTION_DELETE_BATCH_SIZE', '10000'))
+ARCHIVE_FORMATS = {'ndjson': '.ndjson.gz', 'parquet': '.parquet'}
+
+
+def archive_path(archive_dir: str, day: date, fmt: str) -> str:
+    return os.path.join(archive_dir, 'predictions', f"{day:%Y}", f"{day:%m}",
+                        f"predictions-{day.isoformat()}{ARCHIVE_FORMATS[fmt]}")
+
+
+def _day_filter(day: date) -> Dict[str, Any]:
+    start = datetime.combine(day, time.min)
+    return {"timestamp": {"$gte": start, "$lt": start + timedelta(days=1)}}
+
+
+def _archivable(document: Dict[str, Any]) -> Dict[str, Any]:
+    # ObjectId has no JSON/Arrow form; keep it as its hex string
+    return {**document, "_id": str(document["_id"])}
+
+
+def _write_ndjson(documents: Iterator[Dict[str, Any]], path: str) -> int:
+    count = 0
+    with gzip.open(path, 'wb', compresslevel=6) as f:
+        for document in documents:
+            f.write(dumps(_archivable(document)) + b'\n')
+            count += 1
+    return count
+
+
+def archive_schema():
+    import pyarrow as pa
+    # Queryable columns, plus the whole document so fields that vary between documents are kept
+    return pa.schema([
+        ('_id', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('area_id', pa.int64()),
+        ('item_id', pa.int64()),
+        ('year', pa.int64()),
+        ('model_used', pa.string()),
+        ('predicted_yield_hg_per_ha', pa.float64()),
+        ('document', pa.string()),
+    ])
+
+
+def _write_parquet(documents: Iterator[Dict[str, Any]], path: str, batch_size: int) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = archive_schema()
+    count, batch = 0, []
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        def flush():
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+        for document in documents:
+            document = _archivable(document)
+            row = {name: document.get(name) for name in schema.names if name != 'document'}
+            row['document'] = dumps(document).decode('utf-8')
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+                count += len(batch)
+                batch = []
+        if batch:
+            flush()
+            count += len(batch)
+    return count
+
+
+def read_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the documents stored in an archive file (timestamps as ISO strings)"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(columns=['document']):
+            for document in batch.column(0).to_pylist():
+                yield json.loads(document)
+        return
+    with gzip.open(path, 'rb') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _delete_in_batches(collection, query: Dict[str, Any], batch_size: int) -> int:
+    """Delete matching documents a batch of _ids at a time so each delete stays short"""
+    deleted = 0
+    while True:
+        ids = [document["_id"] for document in collection.find(query, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return deleted
+        deleted += collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+
+def compact_day(day: date, log: PredictionLogger = prediction_logger, archive_dir: str = ARCHIVE_DIR,
+                fmt: str = 'ndjson', batch_size: int = DELETE_BATCH_SIZE) -> Dict[str, Any]:
+    """Roll up, archive and delete one UTC day of predictions"""
+    collection = log.predictions_collection
+    query = _day_filter(day)
+    path = archive_path(archive_dir, day, fmt)
+    summary: Dict[str, Any] = {"day": day.isoformat(), "archive": path}
+    start = clock.perf_counter()
+
+    if os.path.exists(path):
+        # A previous run archived and rolled up this day, then stopped before or while deleting
+        summary["resumed"] = True
+        summary["archived"] = None
+    else:
+        log.refresh_rollups(start=day, end=day + timedelta(days=1))
+
+        expected = collection.count_documents(query)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        documents = collection.find(query).sort("_id", 1).batch_size(batch_size)
+        if fmt == 'parquet':
+            archived = _write_parquet(documents, tmp_path, batch_size)
+        else:
+            archived = _write_ndjson(documents, tmp_path)
+        if archived != expected:
+            os.remove(tmp_path)
+            raise RuntimeError(f"Archived {archived} of {expected} predictions for {day}; nothing deleted")
+        os.replace(tmp_path, path)
+        summary["archived"] = archived
+        summary["archive_bytes"] = os.path.getsize(path)
+
+    # Only once the archive is complete; a frozen rollup must never outlive its raw documents
+    log.mark_compacted(day)
+    summary["deleted"] = _delete_in_batches(collection, query, batch_size)
+    summary["seconds"] = clock.perf_counter() - start
+    logger.info(f"Compacted predictions for {day}: {summary}")
+    return summary
+
+
+def run_retention(days: int = RETENTION_DAYS, log: PredictionLogger = prediction_logger,
+                  archive_dir: str = ARCHIVE_DIR, fmt: str = 'ndjson', batch_size: int = DELETE_BATCH_SIZE,
+                  today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Compact every day strictly older than `days` days before today (UTC)"""
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format {fmt}; use {', '.join(ARCHIVE_FORMATS)}")
+    collection = log.predictions_collection
+    if collection is None:
+        raise RuntimeError("MongoDB is not available")
+    cutoff = (today or datetime.utcnow().date()) - timedelta(days=days)
+    summaries = []
+    while True:
+        # Oldest remaining document decides the next day, so empty days are skipped
+        oldest = collection.find_one(
+            {"timestamp": {"$lt": datetime.combine(cutoff, time.min)}}, {"timestamp": 1}, sort=[("timestamp", 1)]
+        )
+        if oldest is None:
+            return summaries
+        summaries.append(compact_day(oldest["timestamp"].date(), log, archive_dir, fmt, batch_size))
+
+
+def restore(path: str, log: PredictionLogger = prediction_logger, batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """Re-insert an archive into the hot collection (the day's rollups are left as they are)"""
+    from bson import ObjectId
+    collection = log.predictions_collection
+    restored, batch = 0, []
+    for document in read_archive(path):
+        document["_id"] = ObjectId(document["_id"])
+        if isinstance(document.get("timestamp"), str):
+            document["timestamp"] = datetime.fromisoformat(document["timestamp"])
+        batch.append(document)
+        if len(batch) >= batch_size:
+            restored += len(collection.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        restored += len(collection.insert_many(batch, ordered=False).inserted_ids)
+    return restored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact, archive and delete old predictions")
+    parser.add_argument('command', nargs='?', default='compact', choices=['compact', 'restore'])
+    parser.add_argument('path', nargs='?', help="Archive file to restore")
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS, help="Keep this many days of raw predictions")
+    parser.add_argument('--format', default='ndjson', choices=sorted(ARCHIVE_FORMATS))
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--batch-size', type=int, default=DELETE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'restore':
+        if not args.path:
+            parser.error("restore needs an archive path")
+        print(f"Restored {restore(args.path, batch_size=args.batch_size)} predictions from {args.path}")
+        return
+    summaries = run_retention(args.days, archive_dir=args.archive_dir, fmt=args.format, batch_size=args.batch_size)
+    print(json.dumps(summaries, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
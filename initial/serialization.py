@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import select
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Payloads smaller than this are sent uncompressed; compressing them costs more than it saves
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    # Mongo ObjectId, Decimal and anything else without a JSON form
+    return str(obj)
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize to compact JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def fetch_rows(session, model, *where) -> List[Dict[str, Any]]:
+    """Read a table as plain dicts straight from the cursor, skipping ORM objects"""
+    columns = list(model.__table__.columns)
+    keys = [column.name for column in columns]
+    result = session.execute(select(*columns).where(*where))
+    return [dict(zip(keys, row)) for row in result]
+
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    encodings = {}
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[token.strip().lower()] = quality
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, preferring br when available"""
+    if not accept_encoding:
+        return None
+    accepted = _accepted_encodings(accept_encoding)
+    wildcard = accepted.get('*', 0.0)
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def json_response(request: Request, payload: Any, status_code: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """Serialize payload and compress it if it is large and the client accepts it"""
+    body = dumps(payload)
+    headers = dict(headers or {})
+    headers['Vary'] = 'Accept-Encoding'
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+        if encoding:
+            body = compress(body, encoding)
+            headers['Content-Encoding'] = encoding
+    return Response(content=body, status_code=status_code, headers=headers, media_type='application/json')
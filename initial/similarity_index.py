@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from environment_index import MAX_YEAR, YEAR_BITS, environment_index, pack_key
+from table_versions import table_versions
+
+logger = logging.getLogger(__name__)
+
+# Changed or new environment rows are searched by brute force next to the tree;
+# past this many (or this share of the tree) the tree is rebuilt instead
+DELTA_MAX_ROWS = int(os.getenv('SIMILARITY_DELTA_MAX_ROWS', '256'))
+DELTA_MAX_SHARE = 0.1
+LEAF_SIZE = 16
+MAX_NEIGHBOURS = 100
+
+
+class _Tree:
+    """KD-tree over standardized (rain, pesticides, temp) of one environment snapshot"""
+
+    __slots__ = ('keys', 'values', 'mean', 'scale', 'tree', 'max_rows_per_area', 'built_at')
+
+    def __init__(self, keys, values):
+        import numpy as np
+        from sklearn.neighbors import KDTree
+        self.keys = keys
+        self.values = values
+        self.mean = values.mean(axis=0) if len(values) else np.zeros(3)
+        scale = values.std(axis=0) if len(values) else np.ones(3)
+        self.scale = np.where(scale > 0, scale, 1.0)
+        self.tree = KDTree(self.standardize(values), leaf_size=LEAF_SIZE) if len(values) else None
+        areas = keys >> YEAR_BITS
+        self.max_rows_per_area = int(np.bincount(areas).max()) if len(areas) else 0
+        self.built_at = time.time()
+
+    def standardize(self, values):
+        return (values - self.mean) / self.scale
+
+
+class SimilarityIndex:
+    """Nearest (area, year) environment profiles to a given one, with their yields.
+
+    The tree is built from the environment index snapshot. When environment
+    rows change, the difference against the tree's snapshot is kept as a
+    small delta (rows searched by brute force) plus removed keys (filtered
+    out of tree results), so a write does not force a rebuild until the
+    delta grows past DELTA_MAX_ROWS.
+    """
+
+    def __init__(self):
+        self._engine = None
+        # (source snapshot, tree, delta keys, delta values, delta points, removed keys), swapped whole
+        self._generation: Optional[Tuple] = None
+        self._yields: Optional[Tuple[Tuple[int, ...], Dict[int, List[Tuple[int, float]]]]] = None
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        self.delta_refreshes = 0
+
+    def attach(self, engine):
+        self._engine = engine
+
+    def _refresh(self, snapshot):
+        import numpy as np
+        tree = self._generation[1] if self._generation is not None else None
+        # An empty tree (warmed before ingestion) has nothing to diff against; rebuild
+        if tree is not None and len(tree.keys):
+            # Rows of the new snapshot that are new or changed relative to the tree
+            position = np.minimum(np.searchsorted(tree.keys, snapshot.keys), len(tree.keys) - 1)
+            same = (tree.keys[position] == snapshot.keys) & (tree.values[position] == snapshot.values).all(axis=1)
+            removed = np.setdiff1d(tree.keys, snapshot.keys[same], assume_unique=True)
+            changed = (~same).sum() + len(removed)
+            # A delta larger than the tree would be slower to search than a rebuilt tree
+            if changed <= min(max(DELTA_MAX_ROWS, DELTA_MAX_SHARE * len(tree.keys)), len(tree.keys)):
+                delta_values = snapshot.values[~same]
+                self._generation = (snapshot, tree, snapshot.keys[~same], delta_values,
+                                    tree.standardize(delta_values), frozenset(removed.tolist()))
+                self.delta_refreshes += 1
+                return
+        start = time.perf_counter()
+        tree = _Tree(snapshot.keys, snapshot.values)
+        self._generation = (snapshot, tree, snapshot.keys[:0], snapshot.values[:0], snapshot.values[:0], frozenset())
+        self.rebuilds += 1
+        logger.info(f"Built similarity tree over {len(snapshot.keys)} environment rows "
+                    f"in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    def _current(self) -> Tuple:
+        snapshot = environment_index.snapshot()
+        generation = self._generation
+        if generation is None or generation[0] is not snapshot:
+            with self._lock:
+                generation = self._generation
+                if generation is None or generation[0] is not snapshot:
+                    self._refresh(snapshot)
+                    generation = self._generation
+        return generation
+
+    def _yields_by_key(self) -> Dict[int, List[Tuple[int, float]]]:
+        versions = table_versions.current(('yield',))
+        cached = self._yields
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+        yields: Dict[int, List[Tuple[int, float]]] = {}
+        with self._engine.connect() as conn:
+            for area_id, year, item_id, value in conn.execute(text(
+                "SELECT area_id, year, item_id, hg_per_ha_yield FROM yield"
+            )):
+                key = pack_key(area_id, year)
+                if key is not None:
+                    yields.setdefault(key, []).append((item_id, value))
+        self._yields = (versions, yields)
+        return yields
+
+    def warm(self):
+        self._current()
+        self._yields_by_key()
+
+    def similar(self, area_id: int, year: int, k: int = 10, item_id: Optional[int] = None,
+                exclude_same_area: bool = True) -> Optional[Dict[str, Any]]:
+        """The k (area, year) rows closest to area_id's environment in year, or None if it has no row"""
+        import numpy as np
+        key = pack_key(area_id, year)
+        if key is None:
+            return None
+        snapshot, tree, delta_keys, delta_values, delta_points, removed = self._current()
+        position = int(np.searchsorted(snapshot.keys, key))
+        if position >= len(snapshot.keys) or snapshot.keys[position] != key:
+            return None
+        query = tree.standardize(snapshot.values[position])
+
+        def wanted(candidate: int) -> bool:
+            if candidate == key:
+                return False
+            return not exclude_same_area or candidate >> YEAR_BITS != area_id
+
+        # Over-fetch by what filtering can drop: removed rows and the query area's own years
+        fetch = k + len(removed) + (tree.max_rows_per_area if exclude_same_area else 1)
+        fetch = min(fetch, len(tree.keys))
+        candidates: List[Tuple[float, int, Any]] = []
+        if fetch:
+            distances, indices = tree.tree.query(query.reshape(1, -1), k=fetch)
+            for distance, index in zip(distances[0].tolist(), indices[0].tolist()):
+                candidate = int(tree.keys[index])
+                if candidate not in removed and wanted(candidate):
+                    candidates.append((distance, candidate, tree.values[index]))
+        if len(delta_keys):
+            distances = np.sqrt(((delta_points - query) ** 2).sum(axis=1))
+            for distance, candidate, values in zip(distances.tolist(), delta_keys.tolist(), delta_values):
+                if wanted(candidate):
+                    candidates.append((distance, candidate, values))
+        candidates.sort(key=lambda entry: entry[0])
+
+        yields = self._yields_by_key()
+        neighbours = []
+        for distance, candidate, values in candidates[:k]:
+            rain, pesticides, temp = (float(value) for value in values)
+            found = yields.get(candidate, [])
+            if item_id is not None:
+                found = [entry for entry in found if entry[0] == item_id]
+            neighbours.append({
+                "area_id": candidate >> YEAR_BITS,
+                "area_name": snapshot.area_names.get(candidate >> YEAR_BITS),
+                "year": candidate & MAX_YEAR,
+                "distance": distance,
+                "average_rai": rain,
+                "pesticides_tavg": pesticides,
+                "temp": temp,
+                "yields": [{"item_id": found_item, "item_name": snapshot.item_names.get(found_item),
+                            "hg_per_ha_yield": value} for found_item, value in found]
+            })
+        rain, pesticides, temp = (float(value) for value in snapshot.values[position])
+        return {
+            "area_id": area_id,
+            "area_name": snapshot.area_names.get(area_id),
+            "year": year,
+            "average_rai": rain,
+            "pesticides_tavg": pesticides,
+            "temp": temp,
+            "neighbours": neighbours
+        }
+
+    def status(self) -> Dict[str, Any]:
+        generation = self._generation
+        if generation is None:
+            return {"loaded": False}
+        tree = generation[1]
+        return {
+            "loaded": True,
+            "tree_rows": len(tree.keys),
+            "delta_rows": len(generation[2]),
+            "removed_rows": len(generation[5]),
+            "rebuilds": self.rebuilds,
+            "delta_refreshes": self.delta_refreshes,
+            "built_at": tree.built_at
+        }
+
+
+# Global instance
+similarity_index = SimilarityIndex()
@@ -0,0 +1,119 @@
+"""Request coalescing for identical concurrent calls.
+
+The first caller for a key runs the computation; callers that arrive with the
+same key while it is running wait for it and share its result (or exception)
+instead of running their own. With SINGLE_FLIGHT_TTL > 0 the result is also
+kept for that many seconds, so near-simultaneous repeats are served from
+memory. Keys should include the table versions (and model version) the result
+depends on, so a write never serves a stale result.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from dotenv import load_dotenv
+
+from metrics import registry
+
+load_dotenv()
+
+SINGLE_FLIGHT_TTL = float(os.getenv('SINGLE_FLIGHT_TTL', '0'))
+SINGLE_FLIGHT_MAX_RESULTS = int(os.getenv('SINGLE_FLIGHT_MAX_RESULTS', '10000'))
+
+calls_total = registry.counter(
+    'yield_api_single_flight_calls_total', 'Coalesced calls by outcome (executed, collapsed, cached)',
+    ('group', 'outcome')
+)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, ttl: float = SINGLE_FLIGHT_TTL, max_results: int = SINGLE_FLIGHT_MAX_RESULTS):
+        self.ttl = ttl
+        self.max_results = max_results
+        self._calls: Dict[Tuple, _Call] = {}
+        self._results: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, group: str, outcome: str):
+        calls_total.inc(group=group, outcome=outcome)
+        with self._lock:
+            self._counts[(group, outcome)] = self._counts.get((group, outcome), 0) + 1
+
+    def do(self, group: str, key: Tuple[Hashable, ...], fn: Callable[[], Any]) -> Any:
+        """fn() for the first caller with (group, key); concurrent callers with the same key get its outcome"""
+        key = (group,) + tuple(key)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > now:
+                outcome = 'cached'
+            else:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    outcome = 'executed'
+                else:
+                    call.followers += 1
+                    outcome = 'collapsed'
+        self._count(group, outcome)
+        if outcome == 'cached':
+            return cached[1]
+        if outcome == 'collapsed':
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and self.ttl > 0:
+                    self._remember(key, call.result)
+            call.done.set()
+        return call.result
+
+    def _remember(self, key: Tuple, result: Any):
+        """Store a result for ttl seconds; called with the lock held"""
+        now = time.monotonic()
+        self._results.pop(key, None)
+        self._results[key] = (now + self.ttl, result)
+        # Every entry has the same ttl, so insertion order is expiry order
+        while self._results:
+            oldest_key, (expires, _) = next(iter(self._results.items()))
+            if expires > now and len(self._results) <= self.max_results:
+                break
+            del self._results[oldest_key]
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            groups: Dict[str, Dict[str, int]] = {}
+            for (group, outcome), count in self._counts.items():
+                groups.setdefault(group, {"executed": 0, "collapsed": 0, "cached": 0})[outcome] = count
+            return {
+                "ttl_seconds": self.ttl,
+                "in_flight": len(self._calls),
+                "cached_results": len(self._results),
+                "groups": groups,
+            }
+
+
+# Global instance
+single_flight = SingleFlight()
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+TABLES = ('items', 'areas', 'environment', 'yield')
+
+# How often (seconds) the background thread re-reads the shared counters written by
+# other workers. Bounds how long another worker can keep answering 304 after a write elsewhere.
+SYNC_INTERVAL = float(os.getenv('ETAG_SYNC_INTERVAL', '1'))
+READ_CACHE_MAX_AGE = int(os.getenv('READ_CACHE_MAX_AGE', '0'))
+CACHE_CONTROL = f"private, max-age={READ_CACHE_MAX_AGE}, must-revalidate"
+
+# Read routes and the tables their responses are derived from
+ROUTE_TABLES: List[Tuple[re.Pattern, Tuple[str, ...]]] = [
+    (re.compile(r'^/items(/latest|/[^/]+)?$'), ('items',)),
+    (re.compile(r'^/areas(/latest|/[^/]+)?$'), ('areas',)),
+    (re.compile(r'^/environment/similar$'), ('environment', 'areas', 'items', 'yield')),
+    (re.compile(r'^/environment(/latest|/[^/]+)?$'), ('environment',)),
+    (re.compile(r'^/yield(/latest|/[^/]+)?$'), ('yield',)),
+    (re.compile(r'^/procedures/item_yield_average/'), ('yield', 'items')),
+    (re.compile(r'^/procedures/area_environment_stats/'), ('environment', 'areas')),
+    (re.compile(r'^/procedures/predict_yield/'), ('yield',)),
+    (re.compile(r'^/procedures/top_producing_areas/'), ('yield', 'areas')),
+    (re.compile(r'^/export/'), ('yield', 'environment', 'areas', 'items')),
+]
+
+
+class TableVersions:
+    """Per-table change counters used to derive ETags for read endpoints.
+
+    Writes call bump() after they commit. Counters live in memory; once
+    attach() is called they are also kept in the `table_versions` SQL table
+    so every worker process (and CLI ingestion) sees the same versions.
+    start() re-reads the shared table from a background thread, so current()
+    never touches the database on the request path.
+    """
+
+    def __init__(self, sync_interval: float = SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        # Changes on every restart so ETags from a previous process never match
+        self.epoch = uuid.uuid4().hex[:8]
+        self._versions: Dict[str, int] = {table: 0 for table in TABLES}
+        self._lock = threading.Lock()
+        self._engine = None
+        self._listeners: List[Callable[[Tuple[str, ...]], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def attach(self, engine):
+        """Share counters through the database; creates and seeds the table if needed"""
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS table_versions ("
+                "table_name VARCHAR(50) PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0)"
+            ))
+            existing = {row[0] for row in conn.execute(text("SELECT table_name FROM table_versions"))}
+            for table in TABLES:
+                if table not in existing:
+                    conn.execute(text("INSERT INTO table_versions (table_name, version) VALUES (:t, 0)"), {"t": table})
+        self._engine = engine
+        # The epoch only guards in-memory counters; shared ones survive restarts
+        self.epoch = 'db'
+        self.sync()
+
+    def sync(self):
+        if self._engine is None:
+            return
+        try:
+            with self._engine.connect() as conn:
+                rows = conn.execute(text("SELECT table_name, version FROM table_versions")).fetchall()
+            with self._lock:
+                for table, version in rows:
+                    self._versions[table] = int(version)
+        except Exception as e:
+            logger.warning(f"Failed to sync table versions: {e}")
+
+    def bump(self, *tables: str):
+        """Record that `tables` changed; call after the write has committed"""
+        shared = False
+        if self._engine is not None:
+            try:
+                with self._engine.begin() as conn:
+                    for table in tables:
+                        conn.execute(
+                            text("UPDATE table_versions SET version = version + 1 WHERE table_name = :t"),
+                            {"t": table}
+                        )
+                self.sync()
+                shared = True
+            except Exception as e:
+                logger.warning(f"Failed to bump shared table versions: {e}")
+        if not shared:
+            with self._lock:
+                for table in tables:
+                    self._versions[table] = self._versions.get(table, 0) + 1
+                if self._engine is not None:
+                    # Local counters have now diverged from the shared ones; a fresh
+                    # epoch keeps this worker's ETags from ever matching theirs
+                    self.epoch = uuid.uuid4().hex[:8]
+        for listener in list(self._listeners):
+            try:
+                listener(tables)
+            except Exception as e:
+                logger.warning(f"Table change listener failed: {e}")
+
+    def on_change(self, listener: Callable[[Tuple[str, ...]], None]):
+        """Call listener(tables) after every bump"""
+        self._listeners.append(listener)
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def start(self):
+        """Keep the counters in step with other workers' writes; a no-op until attach()"""
+        if self._engine is None or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='table-versions', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def current(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        """Counters as of the last sync; memory only, safe to call from the event loop"""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._versions)
+
+
+def tables_for_path(path: str) -> Optional[Tuple[str, ...]]:
+    for pattern, tables in ROUTE_TABLES:
+        if pattern.match(path):
+            return tables
+    return None
+
+
+def make_etag(path: str, query: str, encoding: Optional[str], tables: Tuple[str, ...], versions: Tuple[int, ...],
+              epoch: str) -> str:
+    """Strong ETag for one representation: the URL, its content encoding and the table versions"""
+    key = f"{epoch}|{path}?{query}|{encoding or 'identity'}|" + ','.join(
+        f"{table}:{version}" for table, version in zip(tables, versions)
+    )
+    return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        # If-None-Match uses weak comparison
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+# Global instance
+table_versions = TableVersions()
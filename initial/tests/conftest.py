@@ -0,0 +1,77 @@
+"""Shared fixtures for the tests in this directory.
+
+Run with `python -m pytest initial/tests` from anywhere. Like benchmarks/common.py,
+importing this module puts the `initial/` package directory on sys.path, makes
+it the working directory so yield_df.csv resolves, and points every setting
+that writes to disk at a temp dir. That has to happen before anything imports
+db_schema_file or the other modules that read their settings at import time.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+INITIAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if INITIAL_DIR not in sys.path:
+    sys.path.insert(0, INITIAL_DIR)
+os.chdir(INITIAL_DIR)
+
+WORK_DIR = tempfile.mkdtemp(prefix='yield-tests-')
+atexit.register(shutil.rmtree, WORK_DIR, True)
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(WORK_DIR, 'primary.db')}",
+    'DATABASE_READ_URLS': '',
+    'MODELS_DIR': os.path.join(WORK_DIR, 'models'),
+    'DRIFT_STATE_DIR': os.path.join(WORK_DIR, 'drift'),
+    'BACKTEST_CACHE_DIR': os.path.join(WORK_DIR, 'backtest'),
+    'ADMISSION_ENABLED': 'false',
+    'PREDICTION_ROLLUPS': 'false',
+    'MONGO_URL': '',
+})
+
+
+@pytest.fixture(scope='session')
+def training_data():
+    from train_model import load_training_data_from_csv
+    return load_training_data_from_csv()
+
+
+@pytest.fixture(scope='session')
+def artifact(training_data):
+    """A small forest trained on yield_df.csv and published as the registry's active model"""
+    from model_artifact import save_artifact
+    from model_registry import MODELS_DIR, publish
+    from train_model import train
+    artifact = train(training_data, n_jobs=1, n_estimators=10, version='rf-test')
+    save_artifact(artifact, os.path.join(MODELS_DIR, f"{artifact.version}.joblib"))
+    publish(f"{artifact.version}.joblib")
+    return artifact
+
+
+@pytest.fixture(scope='session')
+def app(artifact):
+    """The API with its startup hooks run and yield_df.csv loaded"""
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        response = client.post('/enter_recs')
+        assert response.status_code == 200, response.text
+        yield main.app
+
+
+@pytest.fixture
+def mongo_logger(monkeypatch):
+    """A PredictionLogger on a fresh mongomock client, with rollups on"""
+    import mongomock
+    import prediction_logger as logger_module
+    # mongomock's bulk builder predates the `sort` argument current pymongo operations pass
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, 'add_update',
+                        lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs))
+    monkeypatch.setattr(logger_module, 'ROLLUPS_ENABLED', True)
+    mongo_logger = logger_module.PredictionLogger()
+    mongo_logger.use_client(mongomock.MongoClient())
+    return mongo_logger
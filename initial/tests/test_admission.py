@@ -0,0 +1,127 @@
+"""Per-client rate limits (429) and per-class load shedding (503) in the admission middleware"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+import admission as admission_module
+from admission import AdmissionController, AdmissionMiddleware, TokenBucket
+
+
+def controller(monkeypatch, *classes, **kwargs):
+    """Install an enabled controller with the given classes as the middleware's global"""
+    installed = AdmissionController(classes=classes, enabled=True, **kwargs)
+    monkeypatch.setattr(admission_module, 'admission', installed)
+    return installed
+
+
+@pytest.fixture
+def held_app():
+    """A bare app whose /slow requests stay in flight until `release` is set"""
+    state = {}
+
+    async def slow(request):
+        state['started'].set()
+        await state['release'].wait()
+        return PlainTextResponse('slow')
+
+    async def fast(request):
+        return PlainTextResponse('fast')
+
+    app = AdmissionMiddleware(Starlette(routes=[Route('/slow', slow), Route('/fast', fast)]))
+    return app, state
+
+
+def test_token_bucket_refills_at_the_rate():
+    bucket = TokenBucket(burst=2, now=0.0)
+    assert bucket.take(rate=1.0, burst=2, now=0.0) == 0.0
+    assert bucket.take(rate=1.0, burst=2, now=0.0) == 0.0
+    assert bucket.take(rate=1.0, burst=2, now=0.0) == pytest.approx(1.0)
+    assert bucket.take(rate=1.0, burst=2, now=0.5) == pytest.approx(0.5)
+    assert bucket.take(rate=1.0, burst=2, now=1.0) == 0.0
+
+
+def test_full_pool_queues_until_the_budget_then_sheds(held_app, monkeypatch):
+    app, state = held_app
+    limits = controller(monkeypatch, ('slow', r'^/slow', 1, 1000.0, 1000, 50))
+
+    async def main():
+        state['started'], state['release'] = asyncio.Event(), asyncio.Event()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            holder = asyncio.ensure_future(client.get('/slow'))
+            await state['started'].wait()
+            # Waits in the queue for the 50ms budget, then gives up
+            timed_out = await client.get('/slow')
+            # CRUD-style routes outside every class are never limited
+            fast = await client.get('/fast')
+            state['release'].set()
+            held = await holder
+            # The slot is free again
+            after = await client.get('/slow')
+            return timed_out, fast, held, after
+
+    timed_out, fast, held, after = asyncio.run(main())
+    assert timed_out.status_code == 503
+    assert int(timed_out.headers['retry-after']) >= 1
+    assert fast.status_code == held.status_code == after.status_code == 200
+    status = limits.status()["classes"]["slow"]
+    assert (status["admitted"], status["timed_out"], status["in_flight"], status["waiting"]) == (2, 1, 0, 0)
+
+
+def test_expected_wait_over_budget_is_shed_without_queueing(held_app, monkeypatch):
+    app, state = held_app
+    limits = controller(monkeypatch, ('slow', r'^/slow', 1, 1000.0, 1000, 50))
+    # Recent requests took a second each; a queued request could not finish within 50ms
+    limits.classes[0].service_time = 1.0
+
+    async def main():
+        state['started'], state['release'] = asyncio.Event(), asyncio.Event()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+            holder = asyncio.ensure_future(client.get('/slow'))
+            await state['started'].wait()
+            shed = await client.get('/slow')
+            state['release'].set()
+            await holder
+            return shed
+
+    shed = asyncio.run(main())
+    assert shed.status_code == 503
+    assert shed.headers['retry-after'] == '1'
+    assert limits.status()["classes"]["slow"]["shed"] == 1
+
+
+def test_rate_limits_are_per_client_and_per_api_key(held_app, monkeypatch):
+    app, state = held_app
+    limits = controller(monkeypatch, ('fast', r'^/fast', 4, 0.5, 2, 1000), api_keys={'partner'})
+
+    async def requests(address, headers=None, count=3):
+        transport = httpx.ASGITransport(app=app, client=(address, 50000))
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return [(await client.get('/fast', headers=headers)) for _ in range(count)]
+
+    first = asyncio.run(requests('10.1.0.1'))
+    assert [response.status_code for response in first] == [200, 200, 429]
+    assert first[-1].headers['retry-after'] == '2'
+    # Another address has its own bucket
+    assert [response.status_code for response in asyncio.run(requests('10.1.0.2', count=1))] == [200]
+    # A known API key is its own client wherever it comes from; an unknown one is just the address
+    assert [response.status_code for response in asyncio.run(requests('10.1.0.1', {'x-api-key': 'partner'}))] == \
+        [200, 200, 429]
+    assert asyncio.run(requests('10.1.0.1', {'x-api-key': 'made-up'}, count=1))[0].status_code == 429
+    assert limits.status()["classes"]["fast"]["rate_limited"] == 3
+
+
+def test_api_predictions_are_rate_limited(app, monkeypatch):
+    controller(monkeypatch, ('predictions', r'^/(predict/|forecast|backtest/)', 8, 0.01, 1, 500))
+    client = TestClient(app, client=('10.1.0.9', 50000))
+    params = {"area_id": 10 ** 6, "item_id": 1, "year": 2000}
+    assert client.post('/predict/ml', params=params).status_code != 429
+    limited = client.post('/predict/ml', params=params)
+    assert limited.status_code == 429
+    assert 'predictions' in limited.json()["detail"]
+    assert client.get('/items').status_code == 200
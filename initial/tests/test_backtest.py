@@ -0,0 +1,92 @@
+"""Backtest folds, error metrics, and the cached /backtest/summary endpoint"""
+import os
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from backtest import BacktestData, error_metrics, fold_years, load_data, run_backtest
+
+
+@pytest.fixture(scope='module')
+def data(app, artifact):
+    from db_schema_file import engine
+    return load_data(engine, artifact)
+
+
+def subset(data, rows):
+    """The first `rows` rows of data, small enough to refit every fold quickly"""
+    take = slice(0, rows)
+    return BacktestData(data.area_ids[take], data.item_ids[take], data.years[take], data.X[take], data.y[take],
+                        data.area_names, data.item_names, 0)
+
+
+def wait_for_summary(client, **params):
+    for _ in range(600):
+        response = client.get('/backtest/summary', params=params)
+        if response.status_code != 202:
+            return response
+        assert response.headers['retry-after']
+        time.sleep(0.05)
+    pytest.fail("backtest did not finish")
+
+
+def test_fold_years():
+    years = np.array([2000, 2001, 2001, 2002, 2003, 2004, 2005, 2006])
+    assert fold_years(years, 'loyo') == [2000, 2001, 2002, 2003, 2004, 2005, 2006]
+    assert fold_years(years, 'rolling') == [2005, 2006]
+    with pytest.raises(ValueError):
+        fold_years(years, 'deployed')
+
+
+def test_error_metrics_per_group():
+    actual = np.array([100.0, 200.0, 0.0, 50.0])
+    predicted = np.array([110.0, 180.0, 10.0, 50.0])
+    metrics = error_metrics(actual, predicted, np.array([0, 0, 1, 1]), 2)
+    assert metrics["n"] == [2, 2]
+    assert metrics["mae"] == [15.0, 5.0]
+    assert metrics["bias"] == [-5.0, 5.0]
+    assert metrics["rmse"][0] == pytest.approx(np.sqrt((100 + 400) / 2))
+    # Zero actuals are left out of MAPE
+    assert metrics["mape"] == pytest.approx([10.0, 0.0])
+
+
+@pytest.mark.parametrize('mode', ['loyo', 'rolling'])
+def test_folds_score_each_held_out_year_once(data, artifact, mode):
+    small = subset(data, 600)
+    summary = run_backtest(small, artifact, mode)
+    held_out = fold_years(small.years, mode)
+    assert summary["folds"] == len(held_out)
+    assert [entry["key"] for entry in summary["by_year"]] == held_out
+    assert summary["scored"] == int(np.isin(small.years, held_out).sum())
+    assert summary["overall"]["n"] == summary["scored"]
+    assert summary["residuals"]["overall"]["n"] == summary["scored"]
+
+
+def test_deployed_summary_is_computed_once_and_cached(app, artifact, data):
+    from backtest import BACKTEST_CACHE_DIR, cache_path
+    from table_versions import table_versions
+    client = TestClient(app)
+    summary = wait_for_summary(client, mode='deployed')
+    assert summary.status_code == 200, summary.text
+    body = summary.json()
+    assert body["model_version"] == artifact.version
+    assert body["scored"] == body["rows"] == len(data.y)
+    assert body["folds"] == 0
+    assert {entry["name"] for entry in body["by_area"]} >= {'India'}
+    assert os.path.exists(cache_path(BACKTEST_CACHE_DIR, 'deployed', artifact.version, data.fingerprint))
+
+    # Same tables: answered from memory
+    assert client.get('/backtest/summary', params={"mode": 'deployed'}).json()["computed_at"] == body["computed_at"]
+    # A write starts a new run, which finds the unchanged data in the disk cache
+    table_versions.bump('yield')
+    assert client.get('/backtest/summary', params={"mode": 'deployed'}).status_code == 202
+    assert wait_for_summary(client, mode='deployed').json()["computed_at"] == body["computed_at"]
+
+    only_years = client.get('/backtest/summary', params={"mode": 'deployed', "breakdown": 'year'}).json()
+    assert 'by_year' in only_years and 'by_area' not in only_years and 'residuals' not in only_years
+
+
+def test_unknown_mode_is_rejected(app):
+    assert TestClient(app).get('/backtest/summary', params={"mode": 'weekly'}).status_code == 422
@@ -0,0 +1,73 @@
+"""Offline batch scoring into the predictions table and the precomputed lookup"""
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from batch_scoring import SCORING_QUERY, score_all, score_chunk
+
+
+@pytest.fixture(scope='module')
+def scored(app, artifact):
+    from db_schema_file import engine
+    from model_registry import MODELS_DIR
+    summary = score_all(engine, os.path.join(MODELS_DIR, f"{artifact.version}.joblib"), chunk_rows=4000)
+    yield summary
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM predictions WHERE model_version = :version"), {"version": artifact.version})
+
+
+def stored(version):
+    from db_schema_file import engine
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM predictions WHERE model_version = :version"),
+                            {"version": version}).scalar()
+
+
+def test_every_yield_row_is_scored_once(scored, artifact):
+    assert scored["model_version"] == artifact.version
+    assert scored["rows"] > 4000
+    assert scored["scored"] == scored["rows"]
+    assert scored["skipped"] == 0
+    assert stored(artifact.version) == scored["scored"]
+
+
+def test_rerun_replaces_the_versions_rows(scored, artifact):
+    from db_schema_file import engine
+    from model_registry import MODELS_DIR
+    again = score_all(engine, os.path.join(MODELS_DIR, f"{artifact.version}.joblib"))
+    assert again["scored"] == scored["scored"]
+    assert stored(artifact.version) == scored["scored"]
+
+
+def test_unknown_areas_are_skipped(artifact):
+    row = (1, 1, 2000, 'Atlantis', 'Maize', 1000.0, 10.0, 20.0)
+    known = (2, 1, 2000, next(iter(artifact.area_codes)), 'Maize', 1000.0, 10.0, 20.0)
+    keys, predictions = score_chunk(artifact, [row, known], artifact.area_codes, artifact.item_codes)
+    assert keys == [(2, 1, 2000)]
+    assert len(predictions) == 1
+
+
+def test_precomputed_lookup_matches_the_model(app, artifact, scored):
+    from db_schema_file import engine
+    with engine.connect() as conn:
+        row = conn.execute(text(SCORING_QUERY + " LIMIT 1")).first()
+        actual = conn.execute(text(
+            "SELECT hg_per_ha_yield FROM yield WHERE area_id = :area AND item_id = :item AND year = :year"
+        ), {"area": row[0], "item": row[1], "year": row[2]}).scalar()
+    _, (expected,) = score_chunk(artifact, [tuple(row)], artifact.area_codes, artifact.item_codes)
+
+    response = TestClient(app).get(f'/predictions/precomputed/{row[0]}/{row[1]}/{row[2]}')
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["model_used"] == artifact.version
+    assert body["predicted_yield_hg_per_ha"] == pytest.approx(expected)
+    assert body["actual_yield_hg_per_ha"] == actual
+    assert body["residual"] == pytest.approx(actual - expected)
+
+
+def test_missing_precomputed_prediction_is_404(app, scored):
+    response = TestClient(app).get('/predictions/precomputed/1/1/1800')
+    assert response.status_code == 404
+    assert 'batch_scoring.py' in response.json()["detail"]
@@ -0,0 +1,69 @@
+"""ETag / If-None-Match on the read endpoints, and invalidation by writes"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from table_versions import etag_matches, tables_for_path
+
+WRITTEN_ITEM = 'Conditional GET Item'
+
+
+@pytest.fixture
+def client(app):
+    yield TestClient(app)
+    from db_schema_file import engine
+    from table_versions import table_versions
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM items WHERE item_name = :name"), {"name": WRITTEN_ITEM})
+    table_versions.bump('items')
+
+
+def test_matching_etag_gets_304_until_a_write(client):
+    first = client.get('/items')
+    etag = first.headers['etag']
+    assert first.headers['cache-control']
+
+    cached = client.get('/items', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.content == b''
+    assert cached.headers['etag'] == etag
+
+    assert client.post('/items/add', json={"item_name": WRITTEN_ITEM}).status_code == 200
+    fresh = client.get('/items', headers={'If-None-Match': etag})
+    assert fresh.status_code == 200
+    assert fresh.headers['etag'] != etag
+    assert WRITTEN_ITEM in {row["item_name"] for row in fresh.json()}
+    assert client.get('/items', headers={'If-None-Match': fresh.headers['etag']}).status_code == 304
+
+
+def test_writes_only_invalidate_the_tables_they_touch(client):
+    areas = client.get('/areas').headers['etag']
+    items = client.get('/items').headers['etag']
+    client.post('/items/add', json={"item_name": WRITTEN_ITEM})
+    assert client.get('/areas', headers={'If-None-Match': areas}).status_code == 304
+    assert client.get('/items', headers={'If-None-Match': items}).status_code == 200
+
+
+def test_etag_depends_on_url_and_encoding(client):
+    gzipped = client.get('/environment', headers={'Accept-Encoding': 'gzip'}).headers['etag']
+    plain = client.get('/environment', headers={'Accept-Encoding': 'identity'}).headers['etag']
+    assert gzipped != plain
+    assert client.get('/environment', headers={'Accept-Encoding': 'identity',
+                                               'If-None-Match': gzipped}).status_code == 200
+    assert client.get('/items').headers['etag'] != client.get('/areas').headers['etag']
+
+
+def test_unmapped_routes_and_writes_get_no_etag(client):
+    assert 'etag' not in client.get('/models').headers
+    response = client.post('/items/add', json={"item_name": WRITTEN_ITEM})
+    assert 'etag' not in response.headers
+
+
+def test_etag_matching_rules():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('W/"b"', '"b"')
+    assert etag_matches('*', '"b"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"b"')
+    assert tables_for_path('/items') == ('items',)
+    assert tables_for_path('/predict/ml') is None
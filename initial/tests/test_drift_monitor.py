@@ -0,0 +1,91 @@
+"""Input drift against the training profile, merged across workers through the state directory"""
+import pytest
+from fastapi.testclient import TestClient
+
+from drift_monitor import DRIFT_MIN_OBSERVATIONS, DriftMonitor, psi
+
+
+@pytest.fixture
+def monitors(tmp_path, artifact):
+    """Two workers' monitors sharing one state directory, both serving the session artifact"""
+    def worker():
+        monitor = DriftMonitor(state_dir=str(tmp_path), reference_path=str(tmp_path / 'missing.json'))
+        monitor._active_model = lambda: artifact
+        monitor.profile()
+        return monitor
+    return worker(), worker()
+
+
+def observe_rows(monitor, rows, temp_shift=0.0):
+    for row in rows.itertuples(index=False):
+        monitor.observe(row.Area, row.Item, row.Year, row.avg_temp + temp_shift, row.average_rain_fall_mm_per_year,
+                        row.pesticides_tonnes)
+
+
+@pytest.fixture(scope='module')
+def sample(training_data):
+    return training_data.sample(2 * DRIFT_MIN_OBSERVATIONS, random_state=0)
+
+
+def test_psi_bands():
+    shares = [0.25, 0.25, 0.25, 0.25]
+    assert psi(shares, shares) == 0.0
+    assert psi(shares, [0.7, 0.1, 0.1, 0.1]) > 0.25
+
+
+def test_training_like_inputs_are_stable(monitors, sample, artifact):
+    monitor, _ = monitors
+    observe_rows(monitor, sample)
+    report = monitor.report()
+    assert report["observations"] == len(sample)
+    assert report["reference"]["id"] == artifact.metadata["reference_profile"]["id"]
+    assert report["features"]["temp"]["status"] == 'stable'
+    assert report["features"]["area"]["unseen_share"] == 0.0
+
+
+def test_shifted_temperatures_are_significant(monitors, sample):
+    monitor, _ = monitors
+    observe_rows(monitor, sample, temp_shift=15.0)
+    report = monitor.report()
+    assert report["features"]["temp"]["status"] == 'significant'
+    assert report["features"]["rain"]["status"] == 'stable'
+    assert report["status"] == 'significant'
+
+
+def test_too_few_observations_are_not_judged(monitors, sample):
+    monitor, _ = monitors
+    observe_rows(monitor, sample.head(5), temp_shift=15.0)
+    assert monitor.report()["status"] == 'insufficient_data'
+
+
+def test_report_merges_workers_until_reset(monitors, sample):
+    first, second = monitors
+    observe_rows(first, sample.head(30))
+    observe_rows(second, sample.tail(20))
+    first.persist()
+    assert second.report()["observations"] == 50
+    observed = sample.head(30)["avg_temp"].tolist() + sample.tail(20)["avg_temp"].tolist()
+    assert second.report()["features"]["temp"]["mean"] == pytest.approx(sum(observed) / 50)
+
+    second.reset()
+    second.profile()
+    assert second.report()["observations"] == 0
+    # The other worker's in-memory counts predate the reset and are dropped on its next persist
+    first.persist()
+    assert second.report()["observations"] == 0
+
+
+def test_drift_endpoint_counts_served_predictions(app):
+    from drift_monitor import drift_monitor
+    client = TestClient(app)
+    assert client.post('/drift/reset').json() == {"reset": True}
+    drift_monitor.profile()
+    areas = {row["area_name"]: row["area_id"] for row in client.get('/areas').json()}
+    items = {row["item_name"]: row["item_id"] for row in client.get('/items').json()}
+    for year in (1990, 1991, 1992):
+        params = {"area_id": areas['India'], "item_id": items['Maize'], "year": year}
+        assert client.post('/predict/ml', params=params).status_code == 200
+    report = client.get('/drift').json()
+    assert report["observations"] == 3
+    assert report["features"]["area"]["categories_seen"] == 1
+    assert report["status"] == 'insufficient_data'
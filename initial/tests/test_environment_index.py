@@ -0,0 +1,60 @@
+"""The in-memory (area, year) environment index against the environment table"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from environment_index import MAX_YEAR, environment_index, pack_key
+
+
+@pytest.fixture(scope='module')
+def india(app):
+    from db_schema_file import engine
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT a.area_id, e.average_rai, e.pesticides_tavg, e.temp FROM environment e "
+            "JOIN areas a ON a.area_id = e.area_id WHERE a.area_name = 'India' AND e.year = 2000"
+        )).one()
+
+
+def test_lookup_matches_the_environment_table(india):
+    area_id, rain, pesticides, temp = india
+    assert environment_index.lookup(area_id, 2000) == pytest.approx((rain, pesticides, temp))
+    assert environment_index.lookup(area_id, 1800) is None
+
+
+def test_out_of_range_years_do_not_alias_other_rows(india):
+    area_id = india[0]
+    # 67536 = 2000 + 2 ** 16 used to pack to area_id + 1's row for 2000
+    assert pack_key(area_id, 2000 + MAX_YEAR + 1) is None
+    assert pack_key(area_id, -1) is None
+    assert environment_index.lookup(area_id - 1, 2000 + MAX_YEAR + 1) is None
+    assert environment_index.lookup(area_id, -1) is None
+
+
+def test_index_follows_writes_to_the_environment_table(app, india):
+    from db_schema_file import engine
+    from table_versions import table_versions
+    area_id = india[0]
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO environment (area_id, year, average_rai, pesticides_tavg, temp) "
+            "VALUES (:area_id, 1800, 1.0, 2.0, 3.0)"
+        ), {"area_id": area_id})
+    table_versions.bump('environment')
+    try:
+        assert environment_index.lookup(area_id, 1800) == (1.0, 2.0, 3.0)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM environment WHERE year = 1800"))
+        table_versions.bump('environment')
+    assert environment_index.lookup(area_id, 1800) is None
+
+
+@pytest.mark.parametrize('year', [-1, MAX_YEAR + 1])
+def test_requests_with_out_of_range_years_are_rejected(app, india, year):
+    client = TestClient(app)
+    area_id = india[0]
+    assert client.get('/environment/similar', params={"area_id": area_id, "year": year}).status_code == 422
+    assert client.post('/predict/ml', params={"area_id": area_id, "item_id": 1, "year": year}).status_code == 422
+    response = client.post('/predict/ml/batch', json={"rows": [{"area_id": area_id, "item_id": 1, "year": year}]})
+    assert response.status_code == 422
@@ -0,0 +1,93 @@
+"""Trend extrapolation, forecast scoring and the paged /forecast endpoint"""
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from environment_index import MAX_YEAR, YEAR_BITS
+from forecast import FORECAST_MAX_YEARS, fit_trends
+
+
+@pytest.fixture(scope='module')
+def india(app):
+    from db_schema_file import engine
+    with engine.connect() as conn:
+        area_id = conn.execute(text("SELECT area_id FROM areas WHERE area_name = 'India'")).scalar()
+        items = conn.execute(text("SELECT COUNT(DISTINCT item_id) FROM yield WHERE area_id = :area_id"),
+                             {"area_id": area_id}).scalar()
+    return area_id, items
+
+
+def test_fit_trends_per_area_over_the_last_window():
+    area_ids = np.array([1] * 6 + [2])
+    years = np.array([1990, 1991, 1992, 2000, 2001, 2002, 1995])
+    # Area 1 followed a different trend before 2000; only its last three years are in the window
+    values = np.column_stack([
+        np.where(years < 2000, 0.0, 2.0 * years - 3000.0),
+        np.full(len(years), 7.0),
+    ])
+    areas, slopes, intercepts, last_years = fit_trends(area_ids, years, values, window=3)
+    assert areas.tolist() == [1, 2]
+    assert last_years.tolist() == [2002, 1995]
+    assert slopes[0].tolist() == pytest.approx([2.0, 0.0])
+    assert intercepts[0].tolist() == pytest.approx([-3000.0, 7.0])
+    # A single year is a flat trend through it
+    assert slopes[1].tolist() == [0.0, 0.0]
+    assert intercepts[1].tolist() == pytest.approx([values[6, 0], 7.0])
+
+
+def test_forecast_rows_are_the_model_on_trended_environment(app, artifact, india):
+    from db_schema_file import engine
+    from environment_index import environment_index
+    from forecast import build_forecast
+    area_id, items = india
+    forecast = build_forecast(engine, artifact, 2014, 2016)
+    rows = forecast.select(area_id=area_id)
+    assert len(rows) == items * 3
+    assert forecast.columns['year'][rows].tolist() == [2014, 2015, 2016] * items
+
+    snapshot = environment_index.snapshot()
+    areas, slopes, intercepts, _ = fit_trends(snapshot.keys >> YEAR_BITS, snapshot.keys & MAX_YEAR, snapshot.values)
+    index = int(np.searchsorted(areas, area_id))
+    first = rows[0]
+    expected_temp = intercepts[index, 2] + slopes[index, 2] * 2014
+    assert forecast.columns['temp'][first] == pytest.approx(expected_temp)
+
+    features = {
+        'average_rain_fall_mm_per_year': forecast.columns['average_rai'][rows],
+        'pesticides_tonnes': forecast.columns['pesticides_tavg'][rows],
+        'avg_temp': forecast.columns['temp'][rows],
+        'Item': [artifact.item_codes[snapshot.item_names[item]] for item in forecast.columns['item_id'][rows]],
+        'Area': [artifact.area_codes['India']] * len(rows),
+        'Year': forecast.columns['year'][rows],
+    }
+    expected = artifact.model.predict(pd.DataFrame(features, columns=artifact.features))
+    np.testing.assert_allclose(forecast.columns['predicted_yield_hg_per_ha'][rows], expected)
+
+
+def test_forecast_endpoint_pages_and_caches(app, artifact, india):
+    from forecast import forecaster
+    area_id, items = india
+    client = TestClient(app)
+    params = {"start_year": 2014, "end_year": 2016, "area_id": area_id}
+    first = client.get('/forecast', params={**params, "limit": 2})
+    assert first.status_code == 200, first.text
+    body = first.json()
+    assert body["model_version"] == artifact.version
+    assert body["total"] == items * 3
+    assert body["next_offset"] == 2
+    assert [row["year"] for row in body["rows"]] == [2014, 2015]
+
+    hits = forecaster.hits
+    columns = client.get('/forecast', params={**params, "offset": 2, "format": 'columns'}).json()
+    assert forecaster.hits == hits + 1
+    assert len(columns["columns"]["year"]) == items * 3 - 2
+    assert columns["next_offset"] is None
+    assert set(columns["columns"]["area_id"]) == {area_id}
+
+
+@pytest.mark.parametrize('start_year, end_year', [(2016, 2014), (2014, 2014 + FORECAST_MAX_YEARS)])
+def test_forecast_range_is_validated(app, start_year, end_year):
+    response = TestClient(app).get('/forecast', params={"start_year": start_year, "end_year": end_year})
+    assert response.status_code == 422
@@ -0,0 +1,59 @@
+"""Prometheus exposition of the in-process metrics and the request/stage instrumentation"""
+import re
+
+from fastapi.testclient import TestClient
+
+from metrics import MetricsRegistry, server_timing
+
+
+def sample(text, name, **labels):
+    """Value of the series `name{labels}` in an exposition, or None"""
+    wanted = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    pattern = rf'^{re.escape(name)}(?:\{{{re.escape(wanted)}\}})? (\S+)$' if wanted else rf'^{re.escape(name)} (\S+)$'
+    match = re.search(pattern, text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('test_seconds', 'Test latency', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.observe(value, route='/a')
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert sample(text, 'test_seconds_bucket', route='/a', le='0.1') == 1
+    assert sample(text, 'test_seconds_bucket', route='/a', le='1.0') == 3
+    assert sample(text, 'test_seconds_bucket', route='/a', le='+Inf') == 4
+    assert sample(text, 'test_seconds_count', route='/a') == 4
+    assert sample(text, 'test_seconds_sum', route='/a') == 6.05
+
+
+def test_counters_gauges_and_label_escaping():
+    registry = MetricsRegistry()
+    refused = registry.counter('test_refused_total', 'Refusals', ('reason',))
+    refused.inc(reason='queue "full"\n')
+    refused.inc(2, reason='queue "full"\n')
+    registry.gauge('test_depth', 'Queue depth', callback=lambda: 7)
+    # Registering a name again returns the existing metric
+    assert registry.counter('test_refused_total', 'Refusals', ('reason',)) is refused
+    text = registry.render()
+    assert 'test_refused_total{reason="queue \\"full\\"\\n"} 3' in text
+    assert sample(text, 'test_depth') == 7
+
+
+def test_server_timing_sums_repeated_stages():
+    header = server_timing([('db_query', 0.001), ('model', 0.002), ('db_query', 0.003)], 0.01)
+    assert header == 'db_query;dur=4.000, model;dur=2.000, total;dur=10.000'
+
+
+def test_requests_are_recorded_by_route_template(app):
+    client = TestClient(app)
+    before = sample(client.get('/metrics').text, 'yield_api_request_seconds_count',
+                    route='/items/{id}', method='GET', status='200') or 0
+    item_id = client.get('/items').json()[0]["item_id"]
+    for _ in range(3):
+        assert client.get(f'/items/{item_id}').status_code == 200
+    text = client.get('/metrics').text
+    assert sample(text, 'yield_api_request_seconds_count',
+                  route='/items/{id}', method='GET', status='200') == before + 3
+    assert sample(text, 'yield_api_stage_seconds_count', route='/items/{id}', stage='db_query') >= 3
@@ -0,0 +1,70 @@
+"""Publishing, canary routing and rollback through the model manifest"""
+import copy
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from model_artifact import save_artifact
+from model_registry import ModelRegistry, publish, read_manifest
+
+
+@pytest.fixture
+def models_dir(tmp_path, artifact):
+    """A models directory holding rf-v1 and rf-v2 copies of the session artifact"""
+    for version in ('rf-v1', 'rf-v2'):
+        versioned = copy.copy(artifact)
+        versioned.version = version
+        save_artifact(versioned, str(tmp_path / f"{version}.joblib"))
+    return str(tmp_path)
+
+
+def served(registry):
+    registry.refresh()
+    return registry.active.version, registry.candidate.version if registry.candidate else None
+
+
+def test_no_manifest_serves_the_fallback(models_dir):
+    registry = ModelRegistry(models_dir, fallback_path=os.path.join(models_dir, 'rf-v1.joblib'))
+    assert served(registry) == ('rf-v1', None)
+
+
+def test_publish_canary_promote_and_roll_back(models_dir):
+    registry = ModelRegistry(models_dir, fallback_path=os.path.join(models_dir, 'missing.pkl.gz'))
+    publish('rf-v1.joblib', models_dir=models_dir)
+    assert served(registry) == ('rf-v1', None)
+
+    publish('rf-v2.joblib', role='candidate', traffic=1.0, models_dir=models_dir)
+    assert served(registry) == ('rf-v1', 'rf-v2')
+    assert registry.choose()[0].version == 'rf-v2'
+    assert registry.choose()[1] == 'candidate'
+
+    # Promoting the candidate ends the experiment
+    publish('rf-v2.joblib', models_dir=models_dir)
+    assert served(registry) == ('rf-v2', None)
+    assert read_manifest(models_dir)['candidate_traffic'] == 0.0
+
+    # Rolling back is publishing the previous file again; it is reloaded from disk
+    publish('rf-v1.joblib', models_dir=models_dir)
+    assert served(registry) == ('rf-v1', None)
+    assert registry.choose() == (registry.active, 'active')
+    assert registry.cached_models == 1
+
+
+def test_bad_publish_keeps_serving_the_previous_model(models_dir):
+    registry = ModelRegistry(models_dir, fallback_path=os.path.join(models_dir, 'missing.pkl.gz'))
+    publish('rf-v1.joblib', models_dir=models_dir)
+    assert served(registry) == ('rf-v1', None)
+
+    publish('rf-v3.joblib', models_dir=models_dir)
+    assert not registry.refresh()
+    assert 'rf-v3.joblib' in registry.last_error
+    assert registry.choose()[0].version == 'rf-v1'
+
+
+def test_models_endpoint_reports_the_published_model(app, artifact):
+    client = TestClient(app)
+    response = client.post('/models/reload')
+    assert response.status_code == 200, response.text
+    assert response.json()["active"]["version"] == artifact.version
+    assert client.get('/models').json()["candidate"] is None
@@ -0,0 +1,116 @@
+"""Partitioned ingestion: resuming from chunk checkpoints and the per-area count check"""
+import pytest
+from sqlalchemy import event, text
+
+from parallel_ingest import build_partitions, check_counts, ingest_parallel
+
+AREAS = ['Montenegro', 'Sudan', 'Bahrain']
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    from data_proces_file import load_data, prepare_data
+    data = load_data()
+    data = data[data['Area'].isin(AREAS)].reset_index(drop=True)
+    rows, env_rows = prepare_data(data)
+    return data, len(rows) + len(env_rows)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """An empty database of its own, so the session database is left alone"""
+    import models  # noqa: F401  (registers the tables)
+    from db_schema_file import make_engine
+    from sqlmodel import SQLModel
+    engine = make_engine(f"sqlite:///{tmp_path / 'ingest.db'}")
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def fail_yield_insert(engine, after):
+    """Make the yield INSERT after the first `after` ones raise"""
+    seen = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO yield'):
+            seen.append(statement)
+            if len(seen) > after:
+                raise RuntimeError('connection lost')
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return lambda: event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_full_load_matches_the_dataset(engine, dataset):
+    data, total = dataset
+    report = ingest_parallel(data, engine=engine, workers=2, chunk_rows=10)
+    assert report["partitions"] == len(AREAS)
+    assert report["resumed_partitions"] == report["skipped_partitions"] == 0
+    assert report["rows_written"] == total
+    assert sum(worker["rows"] for worker in report["per_worker"].values()) == total
+    consistency = report["consistency"]
+    assert consistency["consistent"], consistency["mismatches"]
+    assert sum(table["found"] for table in consistency["totals"].values()) == total
+
+
+def test_interrupted_load_resumes_after_the_last_committed_chunk(engine, dataset):
+    data, total = dataset
+    restore = fail_yield_insert(engine, after=1)
+    with pytest.raises(RuntimeError):
+        ingest_parallel(data, engine=engine, workers=1, chunk_rows=10)
+    restore()
+
+    with engine.connect() as conn:
+        done = conn.execute(text("SELECT area_id, environment_rows, yield_rows, finished_at "
+                                 "FROM ingest_checkpoints")).fetchall()
+        written = conn.execute(text("SELECT (SELECT COUNT(*) FROM environment) + "
+                                    "(SELECT COUNT(*) FROM yield)")).scalar()
+    # Only one yield chunk got through; every failed chunk rolled back with its checkpoint
+    assert sorted(row.yield_rows for row in done) == [0] * (len(AREAS) - 1) + [10]
+    assert all(row.finished_at is None for row in done)
+    assert written == sum(row.environment_rows + row.yield_rows for row in done)
+    started = sum(1 for row in done if row.environment_rows or row.yield_rows)
+
+    report = ingest_parallel(data, engine=engine, workers=2, chunk_rows=10)
+    assert report["resumed_partitions"] == started >= 1
+    assert report["skipped_partitions"] == 0
+    assert report["rows_written"] == total - written
+    assert report["consistency"]["consistent"], report["consistency"]["mismatches"]
+
+    # Everything is checkpointed as finished: nothing left to write
+    again = ingest_parallel(data, engine=engine, workers=2, chunk_rows=10)
+    assert again["skipped_partitions"] == len(AREAS)
+    assert again["rows_written"] == 0
+    assert again["consistency"]["consistent"]
+
+
+def test_other_data_is_not_loaded_over_an_existing_database(engine, dataset):
+    from data_proces_file import load_data
+    data, _ = dataset
+    ingest_parallel(data, engine=engine, workers=2)
+    other = load_data()
+    other = other[other['Area'] == 'Belgium']
+    assert ingest_parallel(other, engine=engine)["skipped"] == 'Data already inserted'
+
+
+def test_count_check_reports_missing_rows(engine, dataset):
+    from data_proces_file import prepare_data
+    data, _ = dataset
+    ingest_parallel(data, engine=engine, workers=2)
+    with engine.begin() as conn:
+        area_id = conn.execute(text("SELECT area_id FROM areas WHERE area_name = 'Sudan'")).scalar()
+        conn.execute(text("DELETE FROM yield WHERE rowid IN "
+                          "(SELECT rowid FROM yield WHERE area_id = :area_id LIMIT 2)"), {"area_id": area_id})
+        area_ids = dict(conn.execute(text("SELECT area_name, area_id FROM areas")).fetchall())
+        item_ids = dict(conn.execute(text("SELECT item_name, item_id FROM items")).fetchall())
+
+    rows, env_rows = prepare_data(data)
+    partitions = build_partitions(rows, env_rows, area_ids, item_ids)
+    expected = next(len(partition.rows['yield']) for partition in partitions if partition.area_id == area_id)
+    result = check_counts(engine, partitions)
+    assert not result["consistent"]
+    assert result["mismatches"] == [{"table": 'yield', "area_id": area_id, "expected": expected,
+                                     "found": expected - 2}]
+    assert result["totals"]["yield"]["expected"] - result["totals"]["yield"]["found"] == 2
+    assert result["totals"]["environment"]["expected"] == result["totals"]["environment"]["found"]
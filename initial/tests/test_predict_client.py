@@ -0,0 +1,63 @@
+"""YieldClient against the app in-process over httpx.ASGITransport"""
+import asyncio
+
+import httpx
+import pytest
+
+from predict import YieldClient
+
+
+def run_with_client(app, work):
+    async def main():
+        async with YieldClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+            return await work(client)
+    return asyncio.run(main())
+
+
+def test_reference_data_is_fetched_once(app):
+    async def work(client):
+        areas = await client.areas()
+        items = await client.items()
+        return areas, items, await client.areas() is areas
+
+    areas, items, cached = run_with_client(app, work)
+    assert 'India' in areas.values()
+    assert 'Maize' in items.values()
+    assert cached
+
+
+def test_predict_latest_environment_row(app, artifact):
+    async def work(client):
+        env, item = await asyncio.gather(client.latest_environment(), client.latest_item())
+        return env, item, await client.predict(env["area_id"], item["item_id"], env["year"])
+
+    env, item, result = run_with_client(app, work)
+    assert result["area_id"] == env["area_id"]
+    assert result["item_id"] == item["item_id"]
+    assert result["model_used"] == artifact.version
+    assert result["filled_from_environment"]
+    assert result["predicted_yield_hg_per_ha"] > 0
+
+
+def test_predict_many_keeps_row_positions_across_batches(app):
+    async def work(client):
+        areas, items = await client.areas(), await client.items()
+        area_id = next(id_ for id_, name in areas.items() if name == 'India')
+        item_id = next(id_ for id_, name in items.items() if name == 'Maize')
+        rows = [{"area_id": area_id, "item_id": item_id, "year": year} for year in range(1990, 1997)]
+        rows.insert(4, {"area_id": 10 ** 6, "item_id": item_id, "year": 1990})
+        return rows, await client.predict_many(rows, batch_size=3)
+
+    rows, result = run_with_client(app, work)
+    assert [error["index"] for error in result["errors"]] == [4]
+    assert [prediction["index"] for prediction in result["predictions"]] == [0, 1, 2, 3, 5, 6, 7]
+    for prediction in result["predictions"]:
+        assert prediction["year"] == rows[prediction["index"]]["year"]
+
+
+def test_http_errors_are_raised(app):
+    async def work(client):
+        await client.predict(10 ** 6, 10 ** 6, 2000)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        run_with_client(app, work)
@@ -0,0 +1,100 @@
+"""Compacting old predictions: rollups frozen, raw documents archived, deleted and restorable"""
+import os
+from datetime import date, datetime
+
+import pytest
+
+import prediction_retention as retention
+from prediction_retention import archive_path, compact_day, read_archive, restore, run_retention
+
+TODAY = date(2024, 3, 1)
+
+
+@pytest.fixture
+def log(mongo_logger, monkeypatch):
+    """Three old days and one recent day of predictions, rolled up as they were logged"""
+    # mongomock has no $merge; the incremental rollups below are already what a refresh would write
+    refreshed = []
+    monkeypatch.setattr(mongo_logger, 'refresh_rollups', lambda start, end: refreshed.append(start))
+    mongo_logger.refreshed = refreshed
+    for day, count in ((date(2024, 1, 1), 3), (date(2024, 1, 2), 2), (date(2024, 1, 4), 1), (TODAY, 2)):
+        entries = [{"timestamp": datetime(day.year, day.month, day.day, 6 + n), "area_id": 1, "item_id": n,
+                    "model_used": 'rf-a', "predicted_yield_hg_per_ha": 1000.0 + n} for n in range(count)]
+        mongo_logger.predictions_collection.insert_many([dict(entry) for entry in entries])
+        mongo_logger._record_rollups(entries)
+    return mongo_logger
+
+
+def remaining(log):
+    return sorted({document["timestamp"].date() for document in log.predictions_collection.find()})
+
+
+def compacted_days(log):
+    return sorted({rollup["day"] for rollup in log._rollups_collection.find({"compacted": True})})
+
+
+@pytest.mark.parametrize('fmt', ['ndjson', 'parquet'])
+def test_old_days_are_archived_deleted_and_frozen(log, tmp_path, fmt):
+    summaries = run_retention(days=30, log=log, archive_dir=str(tmp_path), fmt=fmt, batch_size=2, today=TODAY)
+    assert [(summary["day"], summary["archived"], summary["deleted"]) for summary in summaries] == [
+        ('2024-01-01', 3, 3), ('2024-01-02', 2, 2), ('2024-01-04', 1, 1)]
+    assert log.refreshed == [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 4)]
+    assert remaining(log) == [TODAY]
+    assert compacted_days(log) == ['2024-01-01', '2024-01-02', '2024-01-04']
+    # Stats for compacted days still come from their rollups
+    by_day = log.get_prediction_stats(group_by='day')
+    assert [(row["day"], row["count"]) for row in by_day] == [
+        ('2024-01-01', 3), ('2024-01-02', 2), ('2024-01-04', 1), (TODAY.isoformat(), 2)]
+
+    path = archive_path(str(tmp_path), date(2024, 1, 1), fmt)
+    documents = list(read_archive(path))
+    assert [document["item_id"] for document in documents] == [0, 1, 2]
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_restore_puts_documents_back(log, tmp_path):
+    run_retention(days=30, log=log, archive_dir=str(tmp_path), today=TODAY)
+    path = archive_path(str(tmp_path), date(2024, 1, 2), 'ndjson')
+    assert restore(path, log=log) == 2
+    assert remaining(log) == [date(2024, 1, 2), TODAY]
+    restored = log.predictions_collection.find_one({"timestamp": {"$lt": datetime(2024, 1, 3)}})
+    assert isinstance(restored["timestamp"], datetime)
+
+
+def test_incomplete_archive_deletes_nothing_and_leaves_rollups_unfrozen(log, tmp_path, monkeypatch):
+    write = retention._write_ndjson
+    monkeypatch.setattr(retention, '_write_ndjson', lambda documents, path: write(list(documents)[:-1], path))
+    with pytest.raises(RuntimeError, match='Archived 2 of 3'):
+        compact_day(date(2024, 1, 1), log=log, archive_dir=str(tmp_path))
+    assert compacted_days(log) == []
+    assert remaining(log)[0] == date(2024, 1, 1)
+    assert os.listdir(os.path.dirname(archive_path(str(tmp_path), date(2024, 1, 1), 'ndjson'))) == []
+
+
+def test_interrupted_run_is_resumed_from_the_archive(log, tmp_path, monkeypatch):
+    day = date(2024, 1, 1)
+    mark_compacted = log.mark_compacted
+
+    def crash(day):
+        raise KeyboardInterrupt
+
+    # Stopped after the archive was renamed into place, before the rollups were frozen
+    monkeypatch.setattr(log, 'mark_compacted', crash)
+    with pytest.raises(KeyboardInterrupt):
+        compact_day(day, log=log, archive_dir=str(tmp_path))
+    assert compacted_days(log) == []
+    assert len(remaining(log)) == 4
+
+    monkeypatch.setattr(log, 'mark_compacted', mark_compacted)
+    summary = compact_day(day, log=log, archive_dir=str(tmp_path))
+    assert summary["resumed"]
+    assert summary["deleted"] == 3
+    # The archive was not rewritten and the day was not rolled up again
+    assert log.refreshed == [day]
+    assert compacted_days(log) == ['2024-01-01']
+    assert day not in remaining(log)
+
+
+def test_unknown_format_is_rejected(log, tmp_path):
+    with pytest.raises(ValueError):
+        run_retention(days=30, log=log, archive_dir=str(tmp_path), fmt='csv', today=TODAY)
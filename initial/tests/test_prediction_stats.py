@@ -0,0 +1,82 @@
+"""Prediction stats aggregated in MongoDB, from the daily rollups and from the raw log"""
+from datetime import date, datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def logged(mongo_logger, entries):
+    """Insert log entries with fixed timestamps and fold them into the rollups"""
+    mongo_logger.predictions_collection.insert_many([dict(entry) for entry in entries])
+    mongo_logger._record_rollups(entries)
+
+
+def entry(day, area_id, predicted, model='rf-a', item_id=1):
+    return {"timestamp": datetime(2024, 1, day, 12), "area_id": area_id, "item_id": item_id,
+            "model_used": model, "predicted_yield_hg_per_ha": predicted}
+
+
+@pytest.fixture
+def history(mongo_logger):
+    logged(mongo_logger, [entry(1, 1, 100.0), entry(1, 1, 300.0), entry(1, 2, 50.0)])
+    logged(mongo_logger, [entry(2, 1, 200.0), entry(2, 2, 70.0, model='rf-b')])
+    return mongo_logger
+
+
+def test_rollups_fold_each_day_area_item_and_model(history):
+    rollups = {(doc["day"], doc["area_id"], doc["model_used"]): doc
+               for doc in history._rollups_collection.find({}, {"_id": 0})}
+    assert set(rollups) == {('2024-01-01', 1, 'rf-a'), ('2024-01-01', 2, 'rf-a'),
+                            ('2024-01-02', 1, 'rf-a'), ('2024-01-02', 2, 'rf-b')}
+    first = rollups[('2024-01-01', 1, 'rf-a')]
+    assert (first["count"], first["sum_predicted"], first["min_predicted"], first["max_predicted"]) == \
+        (2, 400.0, 100.0, 300.0)
+
+
+@pytest.mark.parametrize('source', ['rollup', 'raw'])
+def test_stats_by_area_agree_across_sources(history, source):
+    stats = history.get_prediction_stats(group_by='area', source=source)
+    assert stats == [
+        {"area_id": 1, "count": 3, "avg_predicted": 200.0, "min_predicted": 100.0, "max_predicted": 300.0},
+        {"area_id": 2, "count": 2, "avg_predicted": 60.0, "min_predicted": 50.0, "max_predicted": 70.0},
+    ]
+
+
+@pytest.mark.parametrize('source', ['rollup', 'raw'])
+def test_stats_filters(history, source):
+    by_day = history.get_prediction_stats(group_by='day', source=source, start=date(2024, 1, 2))
+    assert [(row["day"], row["count"]) for row in by_day] == [('2024-01-02', 2)]
+    by_model = history.get_prediction_stats(group_by='model', source=source, area_id=2)
+    assert [(row["model_used"], row["count"]) for row in by_model] == [('rf-a', 1), ('rf-b', 1)]
+    assert history.get_prediction_stats(group_by='area', source=source, end=date(2023, 12, 31)) == []
+
+
+def test_unknown_grouping_is_rejected(history):
+    with pytest.raises(ValueError):
+        history.get_prediction_stats(group_by='week')
+
+
+def test_distribution_buckets_the_raw_log(history):
+    buckets = history.get_prediction_distribution([0, 100, 250])
+    assert [(bucket["lower_bound"], bucket["count"]) for bucket in buckets] == [(0, 2), (100, 2), ('overflow', 1)]
+
+
+def test_stats_endpoint_after_predictions(app, monkeypatch, mongo_logger, artifact):
+    import main
+    monkeypatch.setattr(main, 'prediction_logger', mongo_logger)
+    client = TestClient(app)
+    areas = {row["area_name"]: row["area_id"] for row in client.get('/areas').json()}
+    items = {row["item_name"]: row["item_id"] for row in client.get('/items').json()}
+    for year in (1990, 1991, 1992):
+        response = client.post('/predict/ml', params={"area_id": areas['India'], "item_id": items['Maize'],
+                                                      "year": year})
+        assert response.status_code == 200, response.text
+
+    for source in ('rollup', 'raw'):
+        response = client.get('/predictions/stats', params={"group_by": 'area_item', "source": source})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["groups"] == 1
+        assert body["stats"][0]["area_id"] == areas['India']
+        assert body["stats"][0]["count"] == 3
+    assert client.get('/predictions/stats', params={"group_by": 'week'}).status_code == 422
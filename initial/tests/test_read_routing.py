@@ -0,0 +1,86 @@
+"""Read-your-writes routing with a second SQLite file standing in for a replica"""
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from conftest import WORK_DIR
+from db_router import STICKY_COOKIE
+
+REPLICA_ITEM = 'Replica Only'
+WRITTEN_ITEM = 'Written Through Primary'
+
+
+@pytest.fixture
+def replica(app):
+    """Route the app's reads to a replica whose items table holds a single marker row"""
+    from sqlmodel import SQLModel
+    from db_router import Replica, read_router
+    replica = Replica(f"sqlite:///{os.path.join(WORK_DIR, 'replica.db')}")
+    SQLModel.metadata.create_all(replica.engine)
+    with replica.engine.begin() as conn:
+        conn.execute(text("DELETE FROM items"))
+        conn.execute(text("INSERT INTO items (item_name) VALUES (:name)"), {"name": REPLICA_ITEM})
+    replicas, writers = read_router.replicas, dict(read_router._writers)
+    read_router.replicas, read_router._writers = [replica], {}
+    yield read_router
+    read_router.replicas, read_router._writers = replicas, writers
+    replica.engine.dispose()
+    from db_schema_file import engine
+    from table_versions import table_versions
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM items WHERE item_name = :name"), {"name": WRITTEN_ITEM})
+    table_versions.bump('items')
+
+
+def item_names(client):
+    response = client.get('/items')
+    assert response.status_code == 200
+    return {row["item_name"] for row in response.json()}
+
+
+def test_write_sends_that_clients_next_read_to_the_primary(app, replica):
+    writer = TestClient(app, client=('10.0.0.1', 50000))
+    other = TestClient(app, client=('10.0.0.2', 50000))
+    assert item_names(writer) == {REPLICA_ITEM}
+
+    response = writer.post('/items/add', json={"item_name": WRITTEN_ITEM})
+    assert response.status_code == 200
+    assert STICKY_COOKIE in response.cookies
+
+    assert WRITTEN_ITEM in item_names(writer)
+    # Clients that did not write keep reading the replica
+    assert item_names(other) == {REPLICA_ITEM}
+
+
+def test_cookie_alone_pins_reads_in_another_worker(app, replica):
+    writer = TestClient(app, client=('10.0.0.3', 50000))
+    writer.post('/items/add', json={"item_name": WRITTEN_ITEM})
+    # A worker that did not handle the write only has the cookie to go on
+    replica._writers.clear()
+    assert WRITTEN_ITEM in item_names(writer)
+    writer.cookies.clear()
+    assert item_names(writer) == {REPLICA_ITEM}
+
+
+@pytest.mark.parametrize('cookie', ['inf', 'nan', 'not-a-time', '0'])
+def test_invalid_cookies_read_the_replica(app, replica, cookie):
+    client = TestClient(app, client=('10.0.0.4', 50000), cookies={STICKY_COOKIE: cookie})
+    assert item_names(client) == {REPLICA_ITEM}
+
+
+def test_replica_reads_carry_no_etag(app, replica):
+    writer = TestClient(app, client=('10.0.0.5', 50000))
+    assert 'etag' not in writer.get('/items').headers
+
+    writer.post('/items/add', json={"item_name": WRITTEN_ITEM})
+    # Pinned to the primary, the post-write body gets a validator...
+    pinned = writer.get('/items')
+    assert 'etag' in pinned.headers
+    # ...which a client reading the replica can neither receive nor use for a 304
+    other = TestClient(app, client=('10.0.0.6', 50000))
+    response = other.get('/items', headers={'If-None-Match': pinned.headers['etag']})
+    assert response.status_code == 200
+    assert 'etag' not in response.headers
+    assert {row["item_name"] for row in response.json()} == {REPLICA_ITEM}
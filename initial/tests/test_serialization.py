@@ -0,0 +1,56 @@
+"""JSON serialization and Accept-Encoding negotiation for the read endpoints"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import serialization
+from serialization import COMPRESSION_MIN_BYTES, dumps, negotiate_encoding
+
+
+def test_dumps_is_compact_and_handles_dates_and_numpy():
+    payload = {"day": date(2024, 1, 2), "at": datetime(2024, 1, 2, 3, 4, 5), "values": np.array([1.5, 2.0]),
+               "other": Decimal('1.25')}
+    body = dumps(payload)
+    assert b' ' not in body
+    assert json.loads(body) == {"day": "2024-01-02", "at": "2024-01-02T03:04:05", "values": [1.5, 2.0],
+                                "other": "1.25"}
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('deflate, gzip;q=0.5', 'gzip'),
+    ('gzip;q=0', None),
+    ('gzip;q=bad', None),
+    ('*', 'gzip'),
+    ('*;q=0.1, gzip;q=0', None),
+])
+def test_negotiate_encoding(monkeypatch, header, expected):
+    monkeypatch.setattr(serialization, 'brotli', None)
+    assert negotiate_encoding(header) == expected
+
+
+def test_large_responses_are_gzipped_only_when_accepted(app):
+    client = TestClient(app)
+    compressed = client.get('/environment', headers={'Accept-Encoding': 'gzip'})
+    plain = client.get('/environment', headers={'Accept-Encoding': 'identity'})
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert 'content-encoding' not in plain.headers
+    assert compressed.headers['vary'] == 'Accept-Encoding'
+    # httpx decodes the body; the wire size is what the header advertised
+    assert int(compressed.headers['content-length']) < len(plain.content)
+    assert compressed.json() == plain.json()
+    assert len(plain.json()) > 0
+
+
+def test_small_responses_are_sent_uncompressed(app):
+    response = TestClient(app).get('/environment/latest', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert len(response.content) < COMPRESSION_MIN_BYTES
+    assert 'content-encoding' not in response.headers
@@ -0,0 +1,90 @@
+"""Nearest environment profiles, through the API and across index refreshes"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import similarity_index as similarity_module
+from similarity_index import SimilarityIndex
+
+
+def snapshot(rows):
+    """Environment index snapshot of {(area_id, year): (rain, pesticides, temp)}"""
+    keys = sorted(rows)
+    return SimpleNamespace(
+        keys=np.array([(area_id << 16) | year for area_id, year in keys], dtype=np.int64),
+        values=np.array([rows[key] for key in keys], dtype=np.float64).reshape(-1, 3),
+        area_names={area_id: f"area {area_id}" for area_id, _ in keys},
+        item_names={},
+    )
+
+
+@pytest.fixture
+def index(monkeypatch):
+    """A SimilarityIndex over whatever snapshot the test sets, with no yields"""
+    from table_versions import table_versions
+    state = {}
+    monkeypatch.setattr(similarity_module.environment_index, 'snapshot', lambda: state['snapshot'])
+    index = SimilarityIndex()
+    index._yields = (table_versions.current(('yield',)), {})
+
+    def use(rows):
+        state['snapshot'] = snapshot(rows)
+        return index
+    return use
+
+
+def grid(areas, years, offset=0.0):
+    return {(area_id, year): (100.0 * area_id + year + offset, float(area_id), 20.0 + area_id)
+            for area_id in areas for year in years}
+
+
+def test_ingest_after_an_empty_warm_rebuilds_the_tree(index):
+    similarity = index({})
+    similarity.warm()
+    assert similarity.status()["tree_rows"] == 0
+
+    index(grid(range(1, 6), range(2000, 2005)))
+    result = similarity.similar(1, 2000, k=3)
+    assert similarity.rebuilds == 2
+    assert similarity.status()["tree_rows"] == 25
+    assert len(result["neighbours"]) == 3
+    assert {neighbour["area_id"] for neighbour in result["neighbours"]} == {2}
+
+
+def test_small_change_is_a_delta_and_large_one_rebuilds(index):
+    rows = grid(range(1, 41), range(2000, 2010))
+    similarity = index(rows)
+    similarity.warm()
+
+    changed = dict(rows)
+    changed[(7, 2003)] = rows[(1, 2000)]
+    index(changed)
+    result = similarity.similar(1, 2000, k=1)
+    assert similarity.delta_refreshes == 1
+    assert result["neighbours"][0]["area_id"] == 7
+    assert result["neighbours"][0]["distance"] == 0.0
+
+    index(grid(range(1, 41), range(2000, 2010), offset=1.0))
+    similarity.similar(1, 2000, k=1)
+    assert similarity.rebuilds == 2
+
+
+def test_similar_endpoint_after_ingest(app):
+    client = TestClient(app)
+    areas = {row["area_name"]: row["area_id"] for row in client.get('/areas').json()}
+    response = client.get('/environment/similar', params={"area_id": areas['India'], "year": 2000, "k": 5})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["area_name"] == 'India'
+    assert len(body["neighbours"]) == 5
+    assert all(neighbour["area_id"] != areas['India'] for neighbour in body["neighbours"])
+    distances = [neighbour["distance"] for neighbour in body["neighbours"]]
+    assert distances == sorted(distances)
+    assert any(neighbour["yields"] for neighbour in body["neighbours"])
+
+
+def test_unknown_area_year_is_404(app):
+    response = TestClient(app).get('/environment/similar', params={"area_id": 10 ** 6, "year": 2000})
+    assert response.status_code == 404
@@ -0,0 +1,120 @@
+"""Coalescing identical concurrent calls, directly and behind the /procedures routes"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from single_flight import SingleFlight
+
+
+def wait_for_followers(flight, key, followers):
+    for _ in range(1000):
+        with flight._lock:
+            call = flight._calls.get(key)
+            if call is not None and call.followers >= followers:
+                return
+        time.sleep(0.005)
+    pytest.fail(f"{followers} callers never joined {key}")
+
+
+def test_concurrent_identical_calls_run_once():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return {"rows": len(calls)}
+
+    def caller():
+        return flight.do('query', (1, 'a'), work)
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(caller) for _ in range(4)]
+        wait_for_followers(flight, ('query', 1, 'a'), 3)
+        release.set()
+        results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.status()["groups"]["query"] == {"executed": 1, "collapsed": 3, "cached": 0}
+    assert flight.status()["in_flight"] == 0
+
+    # Nothing is kept once the call is over (ttl 0)
+    flight.do('query', (1, 'a'), work)
+    assert len(calls) == 2
+
+
+def test_followers_share_the_leaders_exception():
+    flight, release = SingleFlight(), threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise LookupError('no rows')
+
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(flight.do, 'query', ('k',), fail) for _ in range(3)]
+        wait_for_followers(flight, ('query', 'k'), 2)
+        release.set()
+        errors = [future.exception() for future in futures]
+    assert all(isinstance(error, LookupError) for error in errors)
+    # A failure is never cached
+    assert flight.do('query', ('k',), lambda: 'ok') == 'ok'
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight, release = SingleFlight(), threading.Event()
+    with ThreadPoolExecutor(1) as pool:
+        slow = pool.submit(flight.do, 'query', ('slow',), lambda: release.wait(5))
+        wait_for_followers(flight, ('query', 'slow'), 0)
+        assert flight.do('query', ('fast',), lambda: 'fast') == 'fast'
+        release.set()
+        assert slow.result() is True
+
+
+def test_ttl_keeps_results_and_bounds_their_number():
+    flight = SingleFlight(ttl=60, max_results=2)
+    for key in ('a', 'b', 'c'):
+        flight.do('query', (key,), lambda key=key: key.upper())
+    assert flight.do('query', ('c',), lambda: 'recomputed') == 'C'
+    assert flight.do('query', ('a',), lambda: 'recomputed') == 'recomputed'
+    assert flight.status()["cached_results"] == 2
+    assert flight.status()["groups"]["query"]["cached"] == 1
+
+
+def test_identical_procedure_requests_share_one_query(app, monkeypatch):
+    import main
+    from single_flight import single_flight
+    calls, release = [], threading.Event()
+    call_procedure = main.call_procedure
+
+    def counted(session, name, params):
+        calls.append(name)
+        release.wait(5)
+        return call_procedure(session, name, params)
+
+    monkeypatch.setattr(main, 'call_procedure', counted)
+    client = TestClient(app)
+    item_id = next(row["item_id"] for row in client.get('/items').json() if row["item_name"] == 'Maize')
+    path = f'/procedures/top_producing_areas/{item_id}/2000'
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(client.get, path, params={"limit": 3}) for _ in range(4)]
+        for _ in range(1000):
+            with single_flight._lock:
+                joined = [call.followers for key, call in single_flight._calls.items()
+                          if key[0] == 'FindTopProducingAreas']
+            if joined and joined[0] == 3:
+                break
+            time.sleep(0.005)
+        else:
+            pytest.fail("identical requests were not coalesced")
+        release.set()
+        responses = [future.result() for future in futures]
+
+    assert calls == ['FindTopProducingAreas']
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.text for response in responses}) == 1
+    assert len(responses[0].json()) == 3
+    # Another limit is another query
+    assert len(client.get(path, params={"limit": 2}).json()) == 2
+    assert calls == ['FindTopProducingAreas'] * 2
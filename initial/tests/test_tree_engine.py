@@ -0,0 +1,40 @@
+"""The compiled tree evaluator against sklearn on the training rows"""
+import numpy as np
+import pytest
+
+from tree_engine import TOLERANCE, compile_for_serving, compile_model
+
+
+@pytest.fixture(scope='module')
+def yield_rows(artifact, training_data):
+    """yield_df.csv rows encoded the way the model saw them"""
+    from train_model import encode_training_data
+    return encode_training_data(training_data, artifact.area_codes, artifact.item_codes)
+
+
+def test_numpy_engine_matches_sklearn_exactly(artifact, yield_rows):
+    compiled = compile_model(artifact.model, 'float64')
+    expected = artifact.model.predict(yield_rows)
+    np.testing.assert_array_equal(compiled.predict(yield_rows.to_numpy()), expected)
+
+
+def test_numpy32_engine_within_tolerance(artifact, yield_rows):
+    compiled = compile_model(artifact.model, 'float32')
+    expected = artifact.model.predict(yield_rows)
+    np.testing.assert_allclose(compiled.predict(yield_rows.to_numpy()), expected, rtol=TOLERANCE['numpy32'])
+
+
+def test_single_rows_match_sklearn(artifact, yield_rows):
+    # The serving path scores one row at a time
+    compiled = compile_for_serving(artifact.model, 'numpy')
+    for _, row in yield_rows.sample(50, random_state=0).iterrows():
+        frame = row.to_frame().T.astype(yield_rows.dtypes)
+        assert compiled.predict(frame.to_numpy()) == artifact.model.predict(frame)
+
+
+def test_member_predictions_match_each_tree(artifact, yield_rows):
+    compiled = compile_model(artifact.model, 'float64')
+    X = yield_rows.to_numpy(dtype=np.float32)[:500]
+    members = compiled.member_predictions(X)
+    for tree, estimator in enumerate(artifact.model.estimators_):
+        np.testing.assert_array_equal(members[tree], estimator.predict(X))
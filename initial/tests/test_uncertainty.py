@@ -0,0 +1,103 @@
+"""Prediction intervals from ensemble members or stored backtest residuals"""
+import copy
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from uncertainty import (DEFAULT_QUANTILES, MIN_ITEM_RESIDUALS, parse_quantiles, predict_with_uncertainty,
+                         residual_intervals)
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+@pytest.fixture(scope='module')
+def rows(artifact, training_data):
+    from train_model import encode_training_data
+    encoded = encode_training_data(training_data, artifact.area_codes, artifact.item_codes)
+    return encoded.sample(200, random_state=1).to_numpy(dtype=np.float32)
+
+
+@pytest.fixture
+def single_tree(artifact):
+    """A non-ensemble copy of the session artifact, so intervals have to come from residuals"""
+    tree = copy.copy(artifact)
+    tree.model, tree.engine, tree.version = artifact.model.estimators_[0], None, 'tree-test'
+    return tree
+
+
+def residuals(overall, by_item=None):
+    grid = list(range(1, 100))
+    return {"percentiles": grid, "overall": {"n": 500, "values": [overall * (p - 50) for p in grid]},
+            "by_item": by_item or {}}
+
+
+def test_parse_quantiles():
+    assert parse_quantiles(None) == DEFAULT_QUANTILES
+    assert parse_quantiles('0.1, 0.9') == (0.1, 0.9)
+    assert parse_quantiles([0.25]) == (0.25,)
+    for bad in ('0,0.5', '1.5', ','.join(['0.5'] * 21)):
+        with pytest.raises(ValueError):
+            parse_quantiles(bad)
+
+
+def test_ensemble_intervals_are_member_quantiles(artifact, rows):
+    points, intervals = predict_with_uncertainty(artifact, rows, QUANTILES, [0] * len(rows))
+    members = np.array([tree.predict(rows) for tree in artifact.model.estimators_])
+    np.testing.assert_allclose(points, members.mean(axis=0))
+    np.testing.assert_allclose(points, artifact.model.predict(rows), rtol=1e-9)
+    expected = np.quantile(members, QUANTILES, axis=0)
+    for row, interval in enumerate(intervals[:20]):
+        assert interval["method"] == 'ensemble'
+        assert interval["members"] == len(artifact.model.estimators_)
+        assert [interval["quantiles"][f"{q:g}"] for q in QUANTILES] == pytest.approx(expected[:, row].tolist())
+        assert interval["std"] == pytest.approx(members[:, row].std())
+
+
+def test_residual_intervals_prefer_items_with_enough_rows():
+    by_item = {"1": {"n": MIN_ITEM_RESIDUALS, "values": [10.0 * (p - 50) for p in range(1, 100)]},
+               "2": {"n": MIN_ITEM_RESIDUALS - 1, "values": [1000.0] * 99}}
+    std, spread = residual_intervals([100.0, 100.0, 100.0], [1, 2, 3], residuals(1.0, by_item), (0.1, 0.9))
+    # Item 1 uses its own residuals; item 2 has too few and item 3 none, so they use the overall ones
+    assert spread[:, 0].tolist() == pytest.approx([100.0 - 400.0, 100.0 + 400.0])
+    assert spread[:, 1].tolist() == pytest.approx([100.0 - 40.0, 100.0 + 40.0])
+    assert spread[:, 2].tolist() == spread[:, 1].tolist()
+    assert std.tolist() == pytest.approx([340.0, 34.0, 34.0])
+
+
+def test_non_ensembles_use_stored_backtest_residuals(single_tree, rows, monkeypatch):
+    from backtest import backtester
+    points, intervals = predict_with_uncertainty(single_tree, rows[:3], QUANTILES, [0, 0, 0])
+    assert intervals[0]["method"] is None
+    assert 'backtest' in intervals[0]["detail"]
+
+    monkeypatch.setitem(backtester._stored, single_tree.version, residuals(2.0))
+    points, intervals = predict_with_uncertainty(single_tree, rows[:3], QUANTILES, [0, 0, 0])
+    assert points == pytest.approx(single_tree.model.predict(rows[:3]).tolist())
+    for point, interval in zip(points, intervals):
+        assert interval["method"] == 'backtest_residuals'
+        assert interval["residuals"] == 500
+        assert interval["quantiles"] == pytest.approx({"0.1": point - 80.0, "0.5": point, "0.9": point + 80.0})
+
+
+def test_predict_endpoint_with_uncertainty(app, artifact):
+    client = TestClient(app)
+    areas = {row["area_name"]: row["area_id"] for row in client.get('/areas').json()}
+    items = {row["item_name"]: row["item_id"] for row in client.get('/items').json()}
+    params = {"area_id": areas['India'], "item_id": items['Maize'], "year": 1995}
+    plain = client.post('/predict/ml', params=params).json()
+    assert 'uncertainty' not in plain
+
+    response = client.post('/predict/ml', params={**params, "uncertainty": True, "quantiles": '0.1,0.9'})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["predicted_yield_hg_per_ha"] == pytest.approx(plain["predicted_yield_hg_per_ha"])
+    interval = body["uncertainty"]
+    assert interval["method"] == 'ensemble'
+    assert set(interval["quantiles"]) == {'0.1', '0.9'}
+    assert interval["quantiles"]['0.1'] <= interval["quantiles"]['0.9']
+
+    assert client.post('/predict/ml', params={**params, "uncertainty": True, "quantiles": '2'}).status_code == 422
+    batch = client.post('/predict/ml/batch', json={"rows": [params, {**params, "year": 1996}], "uncertainty": True})
+    assert batch.status_code == 200, batch.text
+    assert all(set(row["uncertainty"]["quantiles"]) == {'0.05', '0.5', '0.95'} for row in batch.json()["predictions"])
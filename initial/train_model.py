@@ -0,0 +1,163 @@
+import argparse
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import text
+
+from model_artifact import FEATURE_COLUMNS, ModelArtifact, freeze_codes, save_artifact
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+TARGET_COLUMN = 'hg/ha_yield'
+
+TRAINING_QUERY = """
+SELECT
+    a.area_name AS Area,
+    i.item_name AS Item,
+    y.year AS Year,
+    y.hg_per_ha_yield AS `hg/ha_yield`,
+    e.average_rai AS average_rain_fall_mm_per_year,
+    e.pesticides_tavg AS pesticides_tonnes,
+    e.temp AS avg_temp
+FROM yield y
+JOIN areas a ON y.area_id = a.area_id
+JOIN items i ON y.item_id = i.item_id
+JOIN environment e ON e.area_id = y.area_id AND e.year = y.year
+"""
+
+
+def normalize_training_data(data: pd.DataFrame) -> pd.DataFrame:
+    """Apply the same name cleaning and dedup as enter_data so codes match DB names"""
+    data = data.copy()
+    data['Item'] = data['Item'].str.strip().str.title()
+    data['Area'] = data['Area'].str.strip()
+    data = data.drop_duplicates(subset=['Area', 'Item', 'Year'], keep='first')
+    return data.astype({
+        'Year': 'int',
+        'average_rain_fall_mm_per_year': 'float',
+        'pesticides_tonnes': 'float',
+        'avg_temp': 'float',
+        TARGET_COLUMN: 'float'
+    })
+
+
+def load_training_data_from_csv(path: str = 'yield_df.csv') -> pd.DataFrame:
+    return normalize_training_data(pd.read_csv(path))
+
+
+def load_training_data_from_db() -> pd.DataFrame:
+    from db_schema_file import engine
+    query = TRAINING_QUERY
+    if engine.dialect.name != 'mysql':
+        query = query.replace('`', '"')
+    with engine.connect() as conn:
+        data = pd.read_sql(text(query), conn)
+    return normalize_training_data(data)
+
+
+def data_fingerprint(data: pd.DataFrame) -> str:
+    """Short content hash used to tie an artifact to the data it was trained on"""
+    hashed = pd.util.hash_pandas_object(data.sort_values(['Area', 'Item', 'Year']), index=False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()[:8]
+
+
+def encode_training_data(data: pd.DataFrame, area_codes, item_codes) -> pd.DataFrame:
+    features = data.copy()
+    features['Area'] = features['Area'].map(area_codes)
+    features['Item'] = features['Item'].map(item_codes)
+    return features[FEATURE_COLUMNS]
+
+
+def train(
+    data: pd.DataFrame,
+    n_jobs: int = -1,
+    n_estimators: int = 100,
+    test_size: float = 0.2,
+    random_state: int = 42,
+    version: str = None
+) -> ModelArtifact:
+    """Fit a random forest on the cleaned dataset and bundle it as an artifact"""
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.metrics import mean_absolute_error, r2_score
+    from sklearn.model_selection import train_test_split
+    from drift_monitor import build_reference_profile
+
+    area_codes = freeze_codes(data['Area'])
+    item_codes = freeze_codes(data['Item'])
+    X = encode_training_data(data, area_codes, item_codes)
+    y = data[TARGET_COLUMN]
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, random_state=random_state
+    )
+    model = RandomForestRegressor(
+        n_estimators=n_estimators,
+        n_jobs=n_jobs,
+        random_state=random_state
+    )
+    logger.info(f"Training on {len(X_train)} rows with n_jobs={n_jobs}...")
+    model.fit(X_train, y_train)
+
+    predictions = model.predict(X_test)
+    fingerprint = data_fingerprint(data)
+    trained_at = datetime.utcnow()
+    metadata = {
+        "trained_at": trained_at.isoformat(),
+        "rows": len(data),
+        "data_fingerprint": fingerprint,
+        "n_estimators": n_estimators,
+        "r2": float(r2_score(y_test, predictions)),
+        "mae": float(mean_absolute_error(y_test, predictions)),
+        # Feature distribution the drift monitor compares served inputs against
+        "reference_profile": build_reference_profile(data)
+    }
+    logger.info(f"Holdout r2={metadata['r2']:.4f} mae={metadata['mae']:.1f}")
+
+    version = version or f"rf-{trained_at.strftime('%Y%m%dT%H%M%S')}-{fingerprint}"
+    return ModelArtifact(
+        model=model,
+        version=version,
+        features=FEATURE_COLUMNS,
+        area_codes=area_codes,
+        item_codes=item_codes,
+        metadata=metadata
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the yield model and write a versioned artifact")
+    parser.add_argument('--source', choices=['csv', 'db'], default='csv')
+    parser.add_argument('--csv', default='yield_df.csv', help="CSV path when --source=csv")
+    parser.add_argument('--output', default=None,
+                        help="Artifact path (.pkl.gz or .joblib); default <models dir>/<version>.joblib")
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--version', default=None, help="Override the generated version string")
+    parser.add_argument('--publish', choices=['active', 'candidate'], default=None,
+                        help="Save into the models directory and point the registry manifest at it")
+    parser.add_argument('--traffic', type=float, default=None, help="Candidate traffic share (0-1) with --publish candidate")
+    args = parser.parse_args()
+
+    if args.source == 'csv':
+        data = load_training_data_from_csv(args.csv)
+    else:
+        data = load_training_data_from_db()
+
+    artifact = train(data, n_jobs=args.n_jobs, n_estimators=args.n_estimators, version=args.version)
+    from model_registry import MODELS_DIR, publish
+    filename = f"{artifact.version}.joblib"
+    # Published versions must live in the models directory; the manifest names files inside it
+    output = os.path.join(MODELS_DIR, filename) if args.publish or args.output is None else args.output
+    save_artifact(artifact, output)
+    print(f"Saved {artifact.version} to {output}")
+    if args.publish:
+        publish(filename, role=args.publish, traffic=args.traffic)
+        print(f"Published {artifact.version} as {args.publish} in {MODELS_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Array-based evaluator for tree models, used instead of sklearn's predict when serving.
+
+sklearn validates the input and dispatches per tree (through joblib for
+forests) on every call, which dominates the cost of scoring one row. At load
+time the model's trees are flattened into contiguous node arrays:
+
+    feature[i], threshold[i]   split of node i (leaves: feature 0, never read)
+    children[2i], children[2i+1]
+                               global left/right child indices (leaves point to themselves)
+    value[i]                   leaf output
+
+and all (row, tree) pairs descend together, one numpy step per tree level.
+Leaves point to themselves, so paths that finish early stay put until they
+are compacted away. Batches above TREE_ENGINE_MAX_ROWS go to sklearn,
+whose C loop wins once per-call overhead no longer matters.
+
+TREE_ENGINE selects the variant: `numpy` (float64 thresholds and values,
+matches sklearn exactly), `numpy32` (float32 arrays, roughly half the memory;
+thresholds are rounded down so splits stay exact, leaf values are rounded) or
+`sklearn` (disabled). A compiled model is only used after its outputs are
+checked against the original model's.
+"""
+import logging
+import os
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TREE_ENGINE = os.getenv('TREE_ENGINE', 'numpy')
+ENGINES = ('numpy', 'numpy32', 'sklearn')
+# Largest relative difference from sklearn's output accepted by verify()
+TOLERANCE = {'numpy': 1e-9, 'numpy32': 1e-5}
+VERIFY_ROWS = 2000
+# Above this many rows sklearn's compiled loop is faster than stepping the trees in numpy
+TREE_ENGINE_MAX_ROWS = int(os.getenv('TREE_ENGINE_MAX_ROWS', '1000'))
+# Finished (row, tree) pairs are dropped every this many levels
+COMPACT_EVERY = 4
+
+
+class CompiledForest:
+    """Flat node arrays for every tree of a regressor; predict() averages the trees like a forest"""
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth: int, n_features: int, dtype: str):
+        import numpy as np
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.roots = roots
+        # [left, right] per node, so a step is one take at 2 * node + went_right
+        self.children = np.stack([left, right], axis=1).ravel()
+        self.max_depth = max_depth
+        self.n_features = n_features
+        self.dtype = dtype
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.feature, self.threshold, self.children, self.value, self.roots))
+
+    def as_input(self, X):
+        """Model input as a C-contiguous float32 array, the precision sklearn trees compare in"""
+        import numpy as np
+        return np.ascontiguousarray(X, dtype=np.float32)
+
+    def leaves(self, X):
+        """(n_rows, n_trees) leaf node index reached by each row in each tree"""
+        import numpy as np
+        X = self.as_input(X)
+        if self.dtype == 'float64':
+            X = X.astype(np.float64)
+        flat = X.ravel()
+        n_rows = len(X)
+        # One entry per (row, tree) pair, row-major; offsets locate each pair's row in the flat input
+        nodes = np.tile(self.roots.astype(np.int64), n_rows)
+        offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * self.n_features, self.n_trees)
+        pairs = np.arange(len(nodes))
+        out = np.empty(len(nodes), dtype=np.int64)
+        for level in range(self.max_depth):
+            go_right = flat.take(offsets + self.feature.take(nodes)) > self.threshold.take(nodes)
+            following = self.children.take(2 * nodes + go_right)
+            if level % COMPACT_EVERY == COMPACT_EVERY - 1:
+                # Drop pairs that reached their leaf so deep trees do not drag finished paths along
+                moved = following != nodes
+                out[pairs[~moved]] = following[~moved]
+                pairs, nodes, offsets = pairs[moved], following[moved], offsets[moved]
+                if not len(pairs):
+                    break
+            else:
+                nodes = following
+        out[pairs] = nodes
+        return out.reshape(n_rows, self.n_trees)
+
+    def member_predictions(self, X):
+        """(n_trees, n_rows) prediction of every tree"""
+        return self.value.take(self.leaves(X)).T.astype('float64')
+
+    def predict(self, X):
+        import numpy as np
+        values = self.value.take(self.leaves(X))
+        # Sum tree by tree in model order, as RandomForestRegressor accumulates its trees
+        total = np.zeros(len(values), dtype=np.float64)
+        for tree in range(values.shape[1]):
+            total += values[:, tree]
+        return total / self.n_trees
+
+
+def _members(model):
+    """(trees, per-tree feature index maps or None), or None if the model is not a supported tree model"""
+    from sklearn.ensemble import BaggingRegressor, ExtraTreesRegressor, RandomForestRegressor
+    from sklearn.tree import BaseDecisionTree
+    if isinstance(model, BaseDecisionTree) and not hasattr(model, 'classes_'):
+        return [model], None
+    if isinstance(model, (RandomForestRegressor, ExtraTreesRegressor)):
+        return list(model.estimators_), None
+    if isinstance(model, BaggingRegressor) and all(
+            isinstance(member, BaseDecisionTree) for member in model.estimators_):
+        return list(model.estimators_), list(model.estimators_features_)
+    return None
+
+
+def compile_model(model, dtype: str = 'float64') -> Optional[CompiledForest]:
+    """Flatten a fitted regression tree, forest or bagged-tree model; None if unsupported"""
+    import numpy as np
+    members = _members(model)
+    if members is None or getattr(model, 'n_outputs_', 1) != 1:
+        return None
+    trees, feature_maps = members
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for index, tree in enumerate(trees):
+        nodes = tree.tree_
+        is_leaf = nodes.children_left < 0
+        feature = np.where(is_leaf, 0, nodes.feature).astype(np.int64)
+        if feature_maps is not None:
+            # Bagged trees see a subset of the columns; map back to the full input
+            feature = np.asarray(feature_maps[index], dtype=np.int64)[feature]
+        own = np.arange(nodes.node_count, dtype=np.int64) + offset
+        features.append(feature)
+        thresholds.append(np.where(is_leaf, 0.0, nodes.threshold))
+        lefts.append(np.where(is_leaf, own, nodes.children_left + offset))
+        rights.append(np.where(is_leaf, own, nodes.children_right + offset))
+        values.append(nodes.value[:, 0, 0])
+        roots.append(offset)
+        offset += nodes.node_count
+        max_depth = max(max_depth, int(nodes.max_depth))
+
+    index_type = np.int32 if offset < 2 ** 31 else np.int64
+    threshold = np.concatenate(thresholds)
+    value = np.concatenate(values).astype(np.float64)
+    if dtype == 'float32':
+        # X is float32; x <= t (float64) holds exactly when x <= the largest float32 not above t
+        threshold32 = threshold.astype(np.float32)
+        too_high = threshold32.astype(np.float64) > threshold
+        threshold32[too_high] = np.nextafter(threshold32[too_high], np.float32(-np.inf))
+        threshold, value = threshold32, value.astype(np.float32)
+    return CompiledForest(
+        feature=np.concatenate(features).astype(index_type),
+        threshold=threshold,
+        left=np.concatenate(lefts).astype(index_type),
+        right=np.concatenate(rights).astype(index_type),
+        value=value,
+        roots=np.asarray(roots, dtype=index_type),
+        max_depth=max_depth,
+        n_features=int(model.n_features_in_),
+        dtype=dtype
+    )
+
+
+def verification_rows(compiled: CompiledForest, rows: int = VERIFY_ROWS, seed: int = 0):
+    """Inputs that hit the split thresholds exactly, just below and just above them, plus values in between"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    is_split = compiled.children[0::2] != np.arange(compiled.n_nodes)
+    X = np.zeros((rows, compiled.n_features), dtype=np.float32)
+    for column in range(compiled.n_features):
+        cuts = compiled.threshold[is_split & (compiled.feature == column)].astype(np.float32)
+        if len(cuts) == 0:
+            continue
+        chosen = rng.choice(cuts, size=rows)
+        direction = rng.integers(-1, 2, size=rows).astype(np.float32)
+        X[:, column] = np.where(direction == 0, chosen, np.nextafter(chosen, chosen + direction))
+        # A quarter of the rows get values spread over the whole range instead
+        spread = rng.random(rows) < 0.25
+        X[spread, column] = rng.uniform(cuts.min(), cuts.max(), size=int(spread.sum()))
+    return X
+
+
+def verify(compiled: CompiledForest, model, X=None) -> Dict[str, Any]:
+    """Compare compiled and sklearn outputs on X (default: verification_rows)"""
+    import numpy as np
+    if X is None:
+        X = verification_rows(compiled)
+    expected = np.asarray(model.predict(np.asarray(X, dtype=np.float32)), dtype=np.float64)
+    actual = compiled.predict(X)
+    difference = np.abs(actual - expected)
+    relative = float((difference / np.maximum(np.abs(expected), 1.0)).max()) if len(X) else 0.0
+    return {
+        "rows": int(len(X)),
+        "exact_matches": int((difference == 0).sum()),
+        "max_abs_diff": float(difference.max()) if len(X) else 0.0,
+        "max_rel_diff": relative,
+        "passed": relative <= TOLERANCE['numpy32' if compiled.dtype == 'float32' else 'numpy'],
+    }
+
+
+def compile_for_serving(model, engine: str = TREE_ENGINE) -> Optional[CompiledForest]:
+    """Compile and verify model for the configured engine; None keeps sklearn's predict"""
+    import warnings
+    if engine == 'sklearn':
+        return None
+    if engine not in ENGINES:
+        logger.warning(f"Unknown TREE_ENGINE {engine}; using sklearn")
+        return None
+    compiled = compile_model(model, 'float32' if engine == 'numpy32' else 'float64')
+    if compiled is None:
+        return None
+    with warnings.catch_warnings():
+        # Fitted on a DataFrame; the check passes a bare array on purpose
+        warnings.simplefilter('ignore', UserWarning)
+        check = verify(compiled, model)
+    if not check["passed"]:
+        logger.warning(f"Compiled {engine} model differs from sklearn ({check}); using sklearn")
+        return None
+    logger.info(f"Compiled {compiled.n_trees} trees / {compiled.n_nodes} nodes ({compiled.nbytes / 1e6:.1f} MB, "
+                f"{engine}); max relative difference {check['max_rel_diff']:.2e}")
+    return compiled
@@ -0,0 +1,103 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+MAX_QUANTILES = 20
+# Per-item residuals are used once the item has this many backtested rows, else the overall ones
+MIN_ITEM_RESIDUALS = 30
+
+
+def parse_quantiles(values: Optional[Sequence]) -> Tuple[float, ...]:
+    """Validate requested quantiles (a list or a comma separated string); ValueError if out of range"""
+    if values is None or values == '':
+        return DEFAULT_QUANTILES
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    quantiles = tuple(float(value) for value in values)
+    if not quantiles or len(quantiles) > MAX_QUANTILES:
+        raise ValueError(f"Give between 1 and {MAX_QUANTILES} quantiles")
+    if any(not 0 < q < 1 for q in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1 (exclusive)")
+    return quantiles
+
+
+def is_ensemble(model) -> bool:
+    """Averaging ensembles (random forest, extra trees, bagging) whose members predict the target"""
+    from sklearn.ensemble import BaggingRegressor, ExtraTreesRegressor, RandomForestRegressor
+    return isinstance(model, (RandomForestRegressor, ExtraTreesRegressor, BaggingRegressor)) \
+        and bool(getattr(model, 'estimators_', None))
+
+
+def member_predictions(model, X):
+    """(n_members, n_rows) array of every member's predictions for X"""
+    import numpy as np
+    X = np.asarray(X, dtype=np.float32)
+    features = getattr(model, 'estimators_features_', None)
+    out = np.empty((len(model.estimators_), len(X)), dtype='float64')
+    for index, member in enumerate(model.estimators_):
+        if features is None:
+            # Forest members are trees; X is already a validated float32 array
+            out[index] = member.predict(X, check_input=False)
+        else:
+            out[index] = member.predict(X[:, features[index]])
+    return out
+
+
+def ensemble_intervals(model, X, quantiles: Sequence[float], engine=None):
+    """Point predictions (member mean), member std and quantiles for every row in one array pass"""
+    import numpy as np
+    members = engine.member_predictions(X) if engine is not None else member_predictions(model, X)
+    return members.mean(axis=0), members.std(axis=0), np.quantile(members, quantiles, axis=0)
+
+
+def residual_intervals(points, item_ids: Sequence[int], residuals: Dict[str, Any], quantiles: Sequence[float]):
+    """Std and quantiles of prediction + backtest residual, per item where that item has enough residuals"""
+    import numpy as np
+    grid = np.asarray(residuals["percentiles"], dtype='float64') / 100
+    item_ids = np.asarray(item_ids)
+    offsets = np.empty((len(quantiles), len(points)), dtype='float64')
+    std = np.empty(len(points), dtype='float64')
+    for item_id in np.unique(item_ids).tolist():
+        entry = residuals["by_item"].get(str(item_id))
+        if entry is None or entry["n"] < MIN_ITEM_RESIDUALS:
+            entry = residuals["overall"]
+        values = np.asarray(entry["values"], dtype='float64')
+        rows = item_ids == item_id
+        offsets[:, rows] = np.interp(quantiles, grid, values)[:, None]
+        # Half the central 68% range of the residuals, the normal-equivalent of one std
+        std[rows] = (np.interp(0.84, grid, values) - np.interp(0.16, grid, values)) / 2
+    return std, np.asarray(points, dtype='float64')[None, :] + offsets
+
+
+def predict_with_uncertainty(artifact, frame, quantiles: Sequence[float],
+                             item_ids: Sequence[int]) -> Tuple[List[float], List[Dict[str, Any]]]:
+    """Point predictions plus an `uncertainty` entry per row of frame.
+
+    Ensembles use the spread of their members (and their mean as the point,
+    so the forest is evaluated once). Other models fall back to the residual
+    percentiles of a stored out-of-sample backtest of the same model version.
+    """
+    names = [f"{q:g}" for q in quantiles]
+    if is_ensemble(artifact.model):
+        engine = artifact.engine if not hasattr(frame, 'columns') else None
+        points, std, spread = ensemble_intervals(artifact.model, frame, quantiles, engine)
+        method, extra = 'ensemble', {"members": len(artifact.model.estimators_)}
+    else:
+        from backtest import backtester
+        points = artifact.predict_input(frame)
+        residuals = backtester.stored_residuals(artifact.version)
+        if residuals is None or residuals.get("overall") is None:
+            unavailable = {"method": None, "detail": "No backtest residuals stored for this model; "
+                                                    "run GET /backtest/summary?mode=loyo first"}
+            return [float(point) for point in points], [dict(unavailable) for _ in points]
+        std, spread = residual_intervals(points, item_ids, residuals, quantiles)
+        method, extra = 'backtest_residuals', {"residuals": residuals["overall"]["n"]}
+
+    spread = spread.T.tolist()
+    intervals = [
+        {"method": method, "std": float(std[row]), "quantiles": dict(zip(names, spread[row])), **extra}
+        for row in range(len(points))
+    ]
+    return [float(point) for point in points], intervals